@@ -0,0 +1,66 @@
+"""
+Compare discovery engines on a loopback or veth test network.
+
+Every address in 127.0.0.0/8 answers on Linux, so the default target is a
+fully populated /24 on loopback. Point --cidr at a veth/bridge test network
+to include ARP on a real segment.
+
+Usage (from backend/):
+    python benchmarks/bench_discovery.py
+    python benchmarks/bench_discovery.py --cidr 10.99.0.0/24 --rounds 5 --rate 5000
+"""
+
+import argparse
+import ipaddress
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+
+def run_engine(engine, first_ip, last_ip, rounds):
+    timings = []
+    found = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        found = len(engine.discover(first_ip, last_ip))
+        timings.append(time.perf_counter() - started)
+    return found, timings
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cidr", default="127.0.0.0/24", help="range to sweep")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--rate", type=int, default=main.SWEEP_RATE, help="async engine probes/sec")
+    parser.add_argument("--timeout", type=float, default=main.SWEEP_TIMEOUT, help="async engine reply timeout")
+    parser.add_argument("--engines", default="nmap,async")
+    args = parser.parse_args()
+
+    network = ipaddress.IPv4Network(args.cidr, strict=False)
+    first_ip = int(network.network_address)
+    last_ip = int(network.broadcast_address)
+
+    engines = {
+        "nmap": main.NmapEngine(),
+        "async": main.AsyncSweepEngine(rate=args.rate, timeout=args.timeout),
+    }
+
+    print(f"Sweeping {network} ({network.num_addresses} addresses), {args.rounds} rounds\n")
+    print(f"{'engine':<8} {'up':>6} {'best s':>9} {'median s':>9} {'hosts/s':>10}")
+    for name in args.engines.split(","):
+        try:
+            found, timings = run_engine(engines[name], first_ip, last_ip, args.rounds)
+        except Exception as e:
+            print(f"{name:<8} skipped: {e}")
+            continue
+        median = statistics.median(timings)
+        print(f"{name:<8} {found:>6} {min(timings):>9.3f} {median:>9.3f} {network.num_addresses / median:>10.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
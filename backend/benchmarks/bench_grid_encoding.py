@@ -0,0 +1,96 @@
+"""
+Compare the compact grid format against the JSON ScanResponse.
+
+Builds synthetic scan results for /24, /20 and /16 ranges at a given share
+of responding hosts, then measures payload size and encode time for:
+  - json     : ScanResponse.model_dump_json()
+  - fastapi  : jsonable_encoder + json.dumps (what the endpoint does today)
+  - compact  : encode_scan_results() (application/vnd.ipmanager.grid)
+
+Usage (from backend/):
+    python benchmarks/bench_grid_encoding.py
+    python benchmarks/bench_grid_encoding.py --density 0.6 --rounds 5
+"""
+
+import argparse
+import gzip
+import ipaddress
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import main  # noqa: E402
+
+
+def synthetic_results(cidr, density, seed=1):
+    rng = random.Random(seed)
+    network = ipaddress.IPv4Network(cidr)
+    now = datetime.now().replace(microsecond=0).isoformat()
+    results = []
+    for address in network:
+        roll = rng.random()
+        if roll < density:
+            results.append(main.IPStatus(
+                ip=str(address), status="up", hostname=f"host-{int(address) & 0xFFFF}.lab",
+                mac_address="52:54:00:%02X:%02X:%02X" % (rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+                vendor="QEMU virtual NIC", last_scanned=now, first_seen=now, last_seen=now, times_seen=3
+            ))
+        elif roll < density + 0.02:
+            results.append(main.IPStatus(
+                ip=str(address), status="reserved", last_scanned=now, notes="Reserved for lab", is_reserved=True
+            ))
+        else:
+            results.append(main.IPStatus(ip=str(address), status="down", last_scanned=now))
+    return results
+
+
+def timed(fn, rounds):
+    timings = []
+    payload = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        payload = fn()
+        timings.append(time.perf_counter() - started)
+    return payload, statistics.median(timings)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cidrs", default="10.0.0.0/24,10.0.0.0/20,10.0.0.0/16")
+    parser.add_argument("--density", type=float, default=0.3, help="share of hosts that are up")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'range':<14} {'format':<8} {'bytes':>12} {'gzip bytes':>11} {'encode ms':>10}")
+    for cidr in args.cidrs.split(","):
+        results = synthetic_results(cidr, args.density)
+        tally = main.ScanTally()
+        tally.add(results)
+        summary = tally.summary(cidr, 0.0)
+        response = main.ScanResponse(**summary.model_dump(), results=results)
+
+        encoders = {
+            "json": lambda: response.model_dump_json().encode(),
+            "fastapi": lambda: json.dumps(jsonable_encoder(response)).encode(),
+            "compact": lambda: main.encode_scan_results(summary, results),
+        }
+        for name, encode in encoders.items():
+            payload, seconds = timed(encode, args.rounds)
+            print(f"{cidr:<14} {name:<8} {len(payload):>12,} {len(gzip.compress(payload)):>11,} {seconds * 1000:>10.2f}")
+
+        decoded = main.decode_grid(main.encode_scan_results(summary, results))
+        assert len(decoded["status"]) == len(results)
+        assert len(decoded["side"]) == sum(1 for r in results if r.hostname or r.mac_address or r.vendor or r.notes)
+        print()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,545 @@
+"""
+Benchmark the scan pipeline (run_scan -> scan_shard -> persist_scan_results)
+and the POST /api/scan endpoint without a real network.
+
+A replay engine stands in for nmap: it answers for a fixed, seeded share of
+each range (--density) and flips --churn of them between rounds, so later
+rounds exercise the up/down transition paths as well as steady state.
+
+The database is either:
+  - stand-in (default): an in-process table that answers the statements the
+    scan path issues. It measures the Python side and counts statements,
+    not MySQL execution time.
+  - mysql (--mysql): a real server from the MYSQL_* variables. --load-schema
+    recreates --database from mysql/init.sql first.
+
+Each range runs in its own process. Per range it reports addresses/sec
+through run_scan, DB statements and transactions per scan, p50/p99 latency
+of POST /api/scan over --samples requests (p99 needs at least 100), and the
+peak RSS of that range's process.
+
+--save writes the numbers and settings as a baseline. Shard size, shard
+workers and active shards are pinned by the benchmark (not derived from the
+CPU count), so a baseline carries over to other machines. --compare refuses
+(exit 2) a baseline taken with different settings and fails (exit 1) when a gated
+metric is worse by more than --tolerance. Latency is only gated where it is
+meaningful: p50 when the baseline p50 is at least 50 ms, p99 when both runs
+have enough samples.
+
+Usage (from backend/):
+    python benchmarks/bench_scan_pipeline.py
+    python benchmarks/bench_scan_pipeline.py --cidrs 10.0.0.0/24,10.0.0.0/16 --density 0.6 --rounds 10
+    python benchmarks/bench_scan_pipeline.py --save
+    python benchmarks/bench_scan_pipeline.py --compare benchmarks/baselines/scan_pipeline_standin.json
+    MYSQL_HOST=127.0.0.1 python benchmarks/bench_scan_pipeline.py --mysql --load-schema --save
+"""
+
+import argparse
+import bisect
+import contextlib
+import ipaddress
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+INIT_SQL = os.path.join(BENCH_DIR, "..", "..", "mysql", "init.sql")
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+
+# Metrics where a larger value is a regression; hosts_per_sec is the reverse
+LOWER_IS_BETTER = ("statements_per_scan", "p50_ms", "p99_ms", "peak_rss_mb")
+P99_MIN_SAMPLES = 100       # below this p99 is just the slowest request
+P50_GATE_MIN_MS = 50.0      # faster scans are dominated by scheduling noise
+RESULT_PREFIX = "RESULT "   # how a range worker hands its metrics to the parent
+BENCH_SHARD_SIZE = 256
+BENCH_SHARD_WORKERS = 4
+BENCH_MAX_ACTIVE_SHARDS = 8
+
+
+class ReplayEngine(main.DiscoveryEngine):
+    """Replays synthetic nmap results: a seeded share of addresses is up"""
+    name = "replay"
+
+    def __init__(self, density, churn, seed=1, delay=0.0):
+        self.density = density
+        self.churn = churn
+        self.seed = seed
+        self.delay = delay
+        self.up = set()
+
+    def prepare(self, first_ip, last_ip, generation):
+        """Choose the responding hosts for one round (outside the timed section)"""
+        base = random.Random(self.seed)
+        flips = random.Random(self.seed * 1000 + generation)
+        self.up = set()
+        for address in range(first_ip, last_ip + 1):
+            up = base.random() < self.density
+            if generation and flips.random() < self.churn:
+                up = not up
+            if up:
+                self.up.add(address)
+
+    def discover(self, first_ip, last_ip):
+        if self.delay:
+            time.sleep(self.delay)
+        discovered = {}
+        for address in range(first_ip, last_ip + 1):
+            if address in self.up:
+                discovered[str(ipaddress.IPv4Address(address))] = {
+                    "hostname": f"host-{address & 0xFFFF}.lab",
+                    "mac_address": "52:54:00:%02X:%02X:%02X" % (
+                        (address >> 16) & 0xFF, (address >> 8) & 0xFF, address & 0xFF
+                    ),
+                    "vendor": "QEMU virtual NIC"
+                }
+        return discovered
+
+
+class StatementCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.commits = 0
+
+    def reset(self):
+        with self.lock:
+            self.statements = 0
+            self.commits = 0
+
+    def statement(self):
+        with self.lock:
+            self.statements += 1
+
+    def commit(self):
+        with self.lock:
+            self.commits += 1
+
+
+class CountingCursor:
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def execute(self, query, params=()):
+        self.counter.statement()
+        return self.cursor.execute(query, params)
+
+    def executemany(self, query, seq):
+        self.counter.statement()
+        return self.cursor.executemany(query, seq)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class CountingConnection:
+    def __init__(self, conn, counter):
+        self.conn = conn
+        self.counter = counter
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self.conn.cursor(*args, **kwargs), self.counter)
+
+    def commit(self):
+        self.counter.commit()
+        return self.conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class CountingPool:
+    """Wraps a mysql.connector pool (or the stand-in) to count statements and commits"""
+
+    def __init__(self, pool, counter):
+        self.pool = pool
+        self.counter = counter
+
+    def get_connection(self):
+        return CountingConnection(self.pool.get_connection(), self.counter)
+
+
+class StandInDatabase:
+    """
+    Just enough of the nodes table for the scan path.
+
+    Answers the ranged SELECT, applies the up-host upsert and the
+    previously_used update; every other statement is accepted and ignored.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}  # ip_num -> row
+        self.addresses = []  # sorted ip_nums, the stand-in for idx_ip_num
+        self.by_id = {}
+        self.next_id = 1
+
+    def get_connection(self):
+        return StandInConnection(self)
+
+    def select_range(self, first_ip, last_ip):
+        with self.lock:
+            start = bisect.bisect_left(self.addresses, first_ip)
+            end = bisect.bisect_right(self.addresses, last_ip)
+            return [dict(self.nodes[address]) for address in self.addresses[start:end]]
+
+    def upsert_up(self, params):
+        with self.lock:
+            for offset in range(0, len(params), 9):
+                ip, subnet, last_octet, hostname, mac, vendor, first_seen, last_seen, last_scanned = \
+                    params[offset:offset + 9]
+                address = int(ipaddress.IPv4Address(ip))
+                row = self.nodes.get(address)
+                if row is None:
+                    self.nodes[address] = {
+                        "id": self.next_id, "ip_address": ip, "subnet": subnet, "last_octet": last_octet,
+                        "status": "up", "hostname": hostname, "mac_address": mac, "vendor": vendor,
+                        "first_seen": first_seen, "last_seen": last_seen, "last_scanned": last_scanned,
+                        "times_seen": 1, "notes": None, "is_reserved": 0
+                    }
+                    bisect.insort(self.addresses, address)
+                    self.by_id[self.next_id] = self.nodes[address]
+                    self.next_id += 1
+                else:
+                    # COALESCE(VALUES(x), x): unresolved fields keep their value
+                    row.update(status="up", hostname=hostname or row["hostname"], mac_address=mac or row["mac_address"],
+                               vendor=vendor or row["vendor"], last_seen=last_seen, last_scanned=last_scanned,
+                               times_seen=row["times_seen"] + 1)
+
+    def mark_previously_used(self, ids):
+        with self.lock:
+            for node_id in ids:
+                row = self.by_id.get(node_id)
+                if row is not None and row["status"] != "reserved":
+                    row["status"] = "previously_used"
+
+
+class StandInCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, query, params=()):
+        statement = " ".join(query.split())
+        self.rows = []
+        if statement.startswith("SELECT * FROM nodes WHERE ip_num BETWEEN"):
+            self.rows = self.db.select_range(*params)
+        elif statement.startswith("INSERT INTO nodes") and "'up'" in statement:
+            self.db.upsert_up(params)
+        elif statement.startswith("UPDATE nodes SET status = 'previously_used'"):
+            self.db.mark_previously_used(params[1:])
+        self.rowcount = len(self.rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+class StandInConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, *args, **kwargs):
+        return StandInCursor(self.db)
+
+    def start_transaction(self, **kwargs):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+
+def mysql_statements(path):
+    """Split init.sql into statements (full-line comments dropped)"""
+    with open(path) as f:
+        lines = [line for line in f if not line.lstrip().startswith("--")]
+    return [s.strip() for s in "".join(lines).split(";\n") if s.strip().rstrip(";")]
+
+
+def connect_mysql(database, load_schema):
+    config = {k: v for k, v in main.db_config.items() if k not in ("pool_name", "pool_size", "database")}
+    if load_schema:
+        conn = main.mysql.connector.connect(**config)
+        cursor = conn.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{database}`")
+        cursor.execute(f"CREATE DATABASE `{database}`")
+        cursor.execute(f"USE `{database}`")
+        for statement in mysql_statements(INIT_SQL):
+            cursor.execute(statement)
+        conn.commit()
+        cursor.close()
+        conn.close()
+        print(f"Loaded {INIT_SQL} into {database}")
+    return main.pooling.MySQLConnectionPool(
+        pool_name="ipmanager_bench", pool_size=main.db_pool.size, database=database, **config
+    )
+
+
+def percentile(values, share):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(share * len(ordered))) - 1))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+@contextlib.contextmanager
+def quiet(enabled):
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def bench_range(cidr, engine, counter, client, rounds, samples, sample_budget, verbose):
+    network = ipaddress.IPv4Network(cidr, strict=False)
+    first_ip, last_ip = int(network.network_address), int(network.broadcast_address)
+    main.grid_cache.invalidate(str(network.network_address).rsplit('.', 1)[0])
+
+    pipeline_seconds = []
+    statements = []
+    commits = []
+    latencies = []
+    for generation in range(rounds):
+        engine.prepare(first_ip, last_ip, generation)
+        target = main.ScanTarget(first_ip, last_ip, str(network), engine=engine)
+        counter.reset()
+        with quiet(not verbose):
+            started = time.perf_counter()
+            main.run_scan(target)
+            pipeline_seconds.append(time.perf_counter() - started)
+        statements.append(counter.statements)
+        commits.append(counter.commits)
+
+    # Endpoint latency gets its own, larger sample, bounded by a time budget
+    budget_ends = time.monotonic() + sample_budget
+    for sample in range(samples):
+        if latencies and time.monotonic() > budget_ends:
+            break
+        engine.prepare(first_ip, last_ip, rounds + sample)
+        with quiet(not verbose):
+            started = time.perf_counter()
+            response = client.post("/api/scan", json={"cidr": str(network)})
+            latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+
+    # The first round creates every node; report steady state when there is one
+    steady = slice(1, None) if rounds > 1 else slice(None)
+    median = statistics.median(pipeline_seconds[steady])
+    p99 = percentile(latencies, 0.99) if len(latencies) >= P99_MIN_SAMPLES else None
+    return {
+        "addresses": network.num_addresses,
+        "hosts_per_sec": round(network.num_addresses / median),
+        "cold_scan_s": round(pipeline_seconds[0], 3),
+        "statements_per_scan": statistics.median(statements[steady]),
+        "commits_per_scan": statistics.median(commits[steady]),
+        "latency_samples": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def bench_range_in_subprocess(cidr, args):
+    """Run one range in a fresh interpreter so its peak RSS is its own"""
+    command = [sys.executable, os.path.abspath(__file__), "--range-worker", "--cidrs", cidr,
+               "--density", str(args.density), "--churn", str(args.churn), "--rounds", str(args.rounds),
+               "--samples", str(args.samples), "--sample-budget", str(args.sample_budget),
+               "--discover-delay", str(args.discover_delay), "--seed", str(args.seed),
+               "--database", args.database]
+    if args.mysql:
+        command.append("--mysql")
+    if args.verbose:
+        command.append("--verbose")
+    # Shard settings are read at import, so the worker gets them through the environment
+    env = dict(os.environ, SCAN_SHARD_SIZE=str(args.shard_size), SCAN_SHARD_WORKERS=str(args.shard_workers),
+               SCAN_MAX_ACTIVE_SHARDS=str(args.max_active_shards))
+    worker = subprocess.run(command, stdout=subprocess.PIPE, text=True, env=env)
+    metrics = None
+    for line in worker.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            metrics = json.loads(line[len(RESULT_PREFIX):])
+        elif args.verbose:
+            print(line)
+    if worker.returncode or metrics is None:
+        sys.exit(f"✗ Benchmark of {cidr} failed (exit {worker.returncode})")
+    return metrics
+
+
+def run_settings(args, db_kind):
+    """Everything that changes the numbers; baselines only compare under identical settings"""
+    return {
+        "db": db_kind, "cidrs": args.cidrs.split(","), "density": args.density, "churn": args.churn,
+        "rounds": args.rounds, "samples": args.samples, "sample_budget": args.sample_budget,
+        "discover_delay": args.discover_delay, "seed": args.seed,
+        "shard_size": args.shard_size, "shard_workers": args.shard_workers,
+        "max_active_shards": args.max_active_shards
+    }
+
+
+def host_info():
+    """Where a run happened; reported next to a comparison but never a reason to refuse one"""
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def compare(results, baseline, tolerance):
+    """Print per-metric changes against a baseline; return the regressions"""
+    regressions = []
+    for cidr, metrics in results.items():
+        previous = baseline.get("results", {}).get(cidr)
+        if not previous:
+            print(f"{cidr}: not in baseline")
+            continue
+        for name, value in metrics.items():
+            if name not in LOWER_IS_BETTER and name != "hosts_per_sec":
+                continue
+            before = previous.get(name)
+            if before is None or value is None:
+                print(f"{cidr:<14} {name:<20} {'-':>12}    (fewer than {P99_MIN_SAMPLES} samples, not gated)")
+                continue
+            change = (value - before) / before if before else 0.0
+            worse = -change if name == "hosts_per_sec" else change
+            gated = not (name == "p50_ms" and before < P50_GATE_MIN_MS)
+            flag = "REGRESSION" if gated and worse > tolerance else "" if gated else "(not gated)"
+            if flag == "REGRESSION":
+                regressions.append((cidr, name, before, value))
+            print(f"{cidr:<14} {name:<20} {before:>12} -> {value:<12} {change:+7.1%} {flag}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cidrs", default="10.0.0.0/24,10.0.0.0/20,10.0.0.0/16")
+    parser.add_argument("--density", type=float, default=0.3, help="share of hosts that are up")
+    parser.add_argument("--churn", type=float, default=0.05, help="share of hosts that flip between rounds")
+    parser.add_argument("--rounds", type=int, default=5, help="scans per range through run_scan")
+    parser.add_argument("--samples", type=int, default=P99_MIN_SAMPLES, help="POST /api/scan requests per range")
+    parser.add_argument("--sample-budget", type=float, default=60.0,
+                        help="seconds per range for latency samples; large ranges may stop short of --samples")
+    parser.add_argument("--discover-delay", type=float, default=0.0, help="seconds per shard, to mimic nmap")
+    parser.add_argument("--seed", type=int, default=1)
+    # Pinned rather than taken from the backend's CPU-derived defaults, so baselines travel between machines
+    parser.add_argument("--shard-size", type=int, default=BENCH_SHARD_SIZE, help="SCAN_SHARD_SIZE for the run")
+    parser.add_argument("--shard-workers", type=int, default=BENCH_SHARD_WORKERS, help="SCAN_SHARD_WORKERS for the run")
+    parser.add_argument("--max-active-shards", type=int, default=BENCH_MAX_ACTIVE_SHARDS,
+                        help="SCAN_MAX_ACTIVE_SHARDS for the run")
+    parser.add_argument("--mysql", action="store_true", help="use the MySQL server from MYSQL_* instead of the stand-in")
+    parser.add_argument("--database", default="ipmanager_bench", help="database the benchmark may overwrite")
+    parser.add_argument("--load-schema", action="store_true", help="recreate --database from mysql/init.sql")
+    parser.add_argument("--save", nargs="?", const="", metavar="PATH",
+                        help="write a baseline (default benchmarks/baselines/scan_pipeline_<db>.json)")
+    parser.add_argument("--compare", metavar="PATH", help="baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="keep the scan path's logging")
+    parser.add_argument("--range-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    db_kind = "mysql" if args.mysql else "standin"
+    if args.range_worker:
+        counter = StatementCounter()
+        pool = connect_mysql(args.database, False) if args.mysql else StandInDatabase()
+        main.db_pool.pool = CountingPool(pool, counter)
+
+        engine = ReplayEngine(args.density, args.churn, args.seed, args.discover_delay)
+        main.discovery_engines[engine.name] = engine
+        main.SCAN_ENGINE = engine.name
+        metrics = bench_range(args.cidrs, engine, counter, TestClient(main.app), args.rounds,
+                              args.samples, args.sample_budget, args.verbose)
+        print(RESULT_PREFIX + json.dumps(metrics))
+        return
+
+    settings = run_settings(args, db_kind)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        differences = {key: (baseline.get("settings", {}).get(key), value)
+                       for key, value in settings.items() if baseline.get("settings", {}).get(key) != value}
+        if differences:
+            for key, (before, now) in differences.items():
+                print(f"  {key}: baseline {before}, this run {now}")
+            print(f"✗ {args.compare} was taken with different settings; rerun with the baseline's settings")
+            sys.exit(2)
+    if args.mysql and args.load_schema:
+        connect_mysql(args.database, True)
+
+    print(f"Scan pipeline on {db_kind}, density {args.density}, churn {args.churn}, "
+          f"{args.rounds} rounds, up to {args.samples} endpoint samples\n")
+    print(f"{'range':<14} {'hosts/s':>10} {'cold s':>8} {'stmts':>7} {'commits':>8} "
+          f"{'samples':>8} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS MB':>12}")
+    results = {}
+    for cidr in settings["cidrs"]:
+        metrics = bench_range_in_subprocess(cidr, args)
+        results[cidr] = metrics
+        p99 = f"{metrics['p99_ms']:.1f}" if metrics['p99_ms'] is not None else "-"
+        print(f"{cidr:<14} {metrics['hosts_per_sec']:>10,} {metrics['cold_scan_s']:>8.3f} "
+              f"{metrics['statements_per_scan']:>7} {metrics['commits_per_scan']:>8} "
+              f"{metrics['latency_samples']:>8} {metrics['p50_ms']:>9.1f} {p99:>9} {metrics['peak_rss_mb']:>12.1f}")
+
+    if args.save is not None:
+        path = args.save or os.path.join(BASELINE_DIR, f"scan_pipeline_{db_kind}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                **host_info(),
+                "settings": settings,
+                "results": results
+            }, f, indent=2)
+            f.write("\n")
+        print(f"\nSaved baseline to {path}")
+
+    if baseline is not None:
+        print(f"\nAgainst {args.compare} ({baseline.get('created_at')}, tolerance {args.tolerance:.0%})")
+        for key, value in host_info().items():
+            if baseline.get(key) != value:
+                print(f"⚠ Baseline {key} was {baseline.get(key)}, this run {value}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s)")
+            sys.exit(1)
+        print("\n✓ No regressions")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -3,8 +3,9 @@ FastAPI Backend for IP Manager with MySQL persistence
 Tracks node history and allows IP reassignment
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, validator
 #from typing import List, Optional
 import nmap
@@ -12,11 +13,14 @@ import asyncio
 from datetime import datetime
 import mysql.connector
 from mysql.connector import pooling
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
 import os
 import subprocess
 import re
 from pathlib import Path
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
 
 import paramiko
 import json
@@ -26,6 +30,17 @@ from typing import List, Optional, Dict
 from datetime import datetime
 import yaml
 import threading
+import ipaddress
+import socket
+import struct
+import fcntl
+import heapq
+import zlib
+import random
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import concurrent.futures
 
 
 app = FastAPI(title="IP Manager API", version="2.0.0")
@@ -38,7 +53,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# =============================================
+# Backend metrics (Prometheus)
+# =============================================
+
+# Scan phases take seconds to minutes; request/DB/SSH latencies are sub-second
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SCAN_PHASE_SECONDS = Histogram(
+    "ipmanager_scan_phase_seconds", "Time spent per scan phase (discovery and persist are per shard)",
+    ["phase"], buckets=SLOW_BUCKETS
+)
+SCAN_SECONDS = Histogram(
+    "ipmanager_scan_seconds", "End-to-end scan duration", ["engine"], buckets=SLOW_BUCKETS
+)
+SCAN_HOSTS = Counter("ipmanager_scan_hosts_total", "Addresses probed by scans", ["status"])
+DB_CHECKOUT_SECONDS = Histogram(
+    "ipmanager_db_checkout_seconds", "Wait for a MySQL pool connection", buckets=FAST_BUCKETS
+)
+DB_CHECKOUT_FAILURES = Counter("ipmanager_db_checkout_failures_total", "MySQL pool checkouts that failed")
+DB_CONNECTIONS_IN_USE = Gauge("ipmanager_db_connections_in_use", "MySQL pool connections checked out")
+DB_CHECKOUT_WAITING = Gauge("ipmanager_db_checkout_waiting", "Callers queued for a MySQL pool connection")
+HTTP_REQUEST_SECONDS = Histogram(
+    "ipmanager_http_request_duration_seconds", "HTTP request latency (to first byte for streams)",
+    ["method", "route", "status"], buckets=FAST_BUCKETS
+)
+SSH_SECONDS = Histogram(
+    "ipmanager_ssh_seconds", "SSH pool operation latency", ["operation"], buckets=SLOW_BUCKETS
+)
+PROXMOX_REQUEST_SECONDS = Histogram(
+    "ipmanager_proxmox_request_seconds", "Proxmox API call latency", ["method", "status"], buckets=FAST_BUCKETS
+)
+TRAFFIC_TESTS_RUNNING = Gauge("ipmanager_traffic_tests_running", "iperf3 tests currently running")
+BACKGROUND_JOBS = Gauge("ipmanager_background_jobs", "Background jobs queued or running", ["kind"])
+SSH_SESSIONS = Gauge("ipmanager_ssh_sessions", "Open pooled SSH sessions")
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep cardinality bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            request.method, route.path if route else "unmatched", str(status)
+        ).observe(time.perf_counter() - started)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus exposition of the backend's own metrics"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 # MySQL connection pool
+MYSQL_POOL_SIZE = min(int(os.getenv("MYSQL_POOL_SIZE", 10)), pooling.CNX_POOL_MAXSIZE)
+MYSQL_CHECKOUT_TIMEOUT = float(os.getenv("MYSQL_CHECKOUT_TIMEOUT", 10))  # seconds queued before 503
+MYSQL_RETRY_INTERVAL = float(os.getenv("MYSQL_RETRY_INTERVAL", 5))      # between pool rebuild attempts
+
 db_config = {
     "host": os.getenv("MYSQL_HOST", "localhost"),
     "port": int(os.getenv("MYSQL_PORT", 3306)),
@@ -46,26 +124,172 @@ db_config = {
     "password": os.getenv("MYSQL_PASSWORD", "ipmanager_pass_2024"),
     "database": os.getenv("MYSQL_DATABASE", "ipmanager"),
     "pool_name": "ipmanager_pool",
-    "pool_size": 10
+    "pool_size": MYSQL_POOL_SIZE
 }
 
-try:
-    connection_pool = pooling.MySQLConnectionPool(**db_config)
-    print("✓ MySQL connection pool created successfully")
-except Exception as e:
-    print(f"✗ Failed to create MySQL pool: {e}")
-    connection_pool = None
+
+class PooledConnection:
+    """Pool connection that hands its checkout slot back when closed"""
+
+    def __init__(self, conn, pool: "DatabasePool"):
+        self.conn = conn
+        self.pool = pool
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.conn.close()
+        finally:
+            self.pool.release_slot()
+
+    def __del__(self):
+        # Last resort for a caller that never closed: don't leak the slot
+        if not self.closed:
+            self.close()
+
+
+class DatabasePool:
+    """
+    MySQL pool with FIFO checkout queueing and lazy (re)creation.
+
+    mysql.connector's pool raises as soon as it is exhausted; here callers
+    queue for one of pool_size slots, each freed slot going to the oldest
+    waiter, and give up after checkout_timeout. If MySQL is unreachable the
+    pool is retried at most every retry_interval seconds instead of staying
+    down for the life of the process.
+    """
+
+    def __init__(self, config: dict, size: int = MYSQL_POOL_SIZE,
+                 checkout_timeout: float = MYSQL_CHECKOUT_TIMEOUT,
+                 retry_interval: float = MYSQL_RETRY_INTERVAL):
+        self.config = config
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.retry_interval = retry_interval
+        self.pool = None
+        self.next_attempt = 0.0
+        self.last_error = None
+        self.build_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.free = size
+        self.waiters = deque()  # one Event per queued caller, oldest first
+        self.checkouts = 0
+        self.timeouts = 0
+
+    def available(self) -> bool:
+        """True if the pool exists or could be (re)built just now"""
+        if self.pool is not None:
+            return True
+        with self.build_lock:
+            if self.pool is not None or time.monotonic() < self.next_attempt:
+                return self.pool is not None
+            try:
+                self.pool = pooling.MySQLConnectionPool(**self.config)
+                self.last_error = None
+                print(f"✓ MySQL connection pool created ({self.size} connections)")
+            except Exception as e:
+                self.last_error = str(e)
+                self.next_attempt = time.monotonic() + self.retry_interval
+                print(f"✗ Failed to create MySQL pool: {e}")
+        return self.pool is not None
+
+    def acquire_slot(self, timeout: float) -> bool:
+        with self.lock:
+            if self.free and not self.waiters:
+                self.free -= 1
+                return True
+            event = threading.Event()
+            self.waiters.append(event)
+        if event.wait(timeout):
+            return True
+        with self.lock:
+            # A slot may have been handed over between the timeout and the lock
+            if event.is_set():
+                return True
+            self.waiters.remove(event)
+            return False
+
+    def release_slot(self):
+        with self.lock:
+            if self.waiters:
+                self.waiters.popleft().set()  # hand the slot straight to the oldest waiter
+            else:
+                self.free += 1
+
+    def get_connection(self):
+        """Check out a connection, queueing up to checkout_timeout; None if MySQL is down"""
+        if not self.available():
+            return None
+        with DB_CHECKOUT_SECONDS.time():
+            if not self.acquire_slot(self.checkout_timeout):
+                self.timeouts += 1
+                DB_CHECKOUT_FAILURES.inc()
+                raise HTTPException(status_code=503, detail="Database busy, try again")
+            try:
+                conn = self.pool.get_connection()
+            except Exception:
+                self.release_slot()
+                DB_CHECKOUT_FAILURES.inc()
+                raise
+        self.checkouts += 1
+        return PooledConnection(conn, self)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "connected": self.pool is not None,
+                "pool_size": self.size,
+                "in_use": self.size - self.free,
+                "waiting": len(self.waiters),
+                "checkout_timeout": self.checkout_timeout,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "last_error": self.last_error
+            }
+
+
+db_pool = DatabasePool(db_config)
+db_pool.available()
+DB_CONNECTIONS_IN_USE.set_function(lambda: db_pool.size - db_pool.free)
+DB_CHECKOUT_WAITING.set_function(lambda: len(db_pool.waiters))
+
+# Handlers run their queries here rather than on the event loop; sized to
+# the pool so queued work waits in the executor, not holding threads
+db_executor = ThreadPoolExecutor(max_workers=MYSQL_POOL_SIZE, thread_name_prefix="db")
+
 
 def get_db_connection():
     """Get a database connection from the pool"""
-    if connection_pool:
-        return connection_pool.get_connection()
-    return None
+    return db_pool.get_connection()
+
+
+async def run_db(func, *args):
+    """Run blocking database work on the database executor"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
+
+@app.get("/api/db/pool")
+async def get_db_pool_stats():
+    """Get MySQL pool stats"""
+    return db_pool.stats()
+
+# Largest range a single scan request may cover (/16 by default)
+SCAN_MIN_PREFIX = int(os.getenv("SCAN_MIN_PREFIX", 16))
 
 class ScanRequest(BaseModel):
-    subnet: str
+    subnet: Optional[str] = None
     start_ip: int = 0
     end_ip: int = 255
+    cidr: Optional[str] = None          # e.g. "10.20.0.0/20", takes precedence over subnet
+    shard_size: Optional[int] = None    # addresses per nmap process
+    max_workers: Optional[int] = None   # shards swept in parallel for this scan
+    engine: Optional[str] = None        # discovery engine: "nmap" or "async"
     
     @validator("start_ip", "end_ip")
     def validate_ip_range(cls, v):
@@ -75,10 +299,44 @@ class ScanRequest(BaseModel):
     
     @validator("subnet")
     def validate_subnet(cls, v):
+        if v is None:
+            return v
         parts = v.split(".")
         if len(parts) != 3:
             raise ValueError("Subnet must be x.x.x")
         return v
+    
+    @validator("cidr", always=True)
+    def validate_cidr(cls, v, values):
+        if v is None:
+            if not values.get("subnet"):
+                raise ValueError("Either subnet or cidr is required")
+            return v
+        try:
+            network = ipaddress.IPv4Network(v, strict=False)
+        except ValueError as e:
+            raise ValueError(f"Invalid IPv4 CIDR: {e}")
+        if network.prefixlen < SCAN_MIN_PREFIX:
+            raise ValueError(f"CIDR prefix must be /{SCAN_MIN_PREFIX} or longer")
+        return str(network)
+    
+    @validator("shard_size")
+    def validate_shard_size(cls, v):
+        if v is not None and not 8 <= v <= 4096:
+            raise ValueError("shard_size must be 8-4096")
+        return v
+    
+    @validator("max_workers")
+    def validate_max_workers(cls, v):
+        if v is not None and not 1 <= v <= 64:
+            raise ValueError("max_workers must be 1-64")
+        return v
+    
+    @validator("engine")
+    def validate_engine(cls, v):
+        if v is not None and v not in ("nmap", "async"):
+            raise ValueError("engine must be 'nmap' or 'async'")
+        return v
 
 class IPStatus(BaseModel):
     ip: str
@@ -105,7 +363,7 @@ class UpdateNodeRequest(BaseModel):
     notes: Optional[str] = None
     is_reserved: Optional[bool] = None
 
-class ScanResponse(BaseModel):
+class ScanSummary(BaseModel):
     subnet: str
     total_ips: int
     active_ips: int
@@ -113,525 +371,2958 @@ class ScanResponse(BaseModel):
     previously_used_ips: int
     reserved_ips: int
     scan_time: float
+
+class ScanResponse(ScanSummary):
     results: List[IPStatus]
 
 
 # =============================================0
 
-def add_prometheus_target(ip_address: str):
-    """Add a new VM to Prometheus targets"""
-    targets_file = Path("/app/monitoring/prometheus/targets/nodes.yml")
-    
-    try:
-        # Read existing targets
-        if targets_file.exists():
-            with open(targets_file, 'r') as f:
-                data = yaml.safe_load(f) or []
-        else:
-            data = []
+PROMETHEUS_TARGETS_DIR = Path(os.getenv("PROMETHEUS_TARGETS_DIR", "/app/monitoring/prometheus/targets"))
+PROMETHEUS_URL = os.getenv("PROMETHEUS_URL", "http://localhost:9090")
+PROMETHEUS_FLUSH_DELAY = float(os.getenv("PROMETHEUS_FLUSH_DELAY", 2.0))
+PROMETHEUS_RETRY_DELAY = float(os.getenv("PROMETHEUS_RETRY_DELAY", 30.0))  # after a failed write
+# file_sd files are re-read by Prometheus on change, so a reload is only needed
+# when file watching is unreliable (e.g. some bind mounts)
+PROMETHEUS_RELOAD = os.getenv("PROMETHEUS_RELOAD", "false").lower() == "true"
+PROMETHEUS_IPERF_PORT = int(os.getenv("PROMETHEUS_IPERF_PORT", 9579))
+
+PROMETHEUS_TARGET_GROUPS = {
+    "nodes": {"file": "nodes.yml", "port": 9100, "labels": {"job": "node_exporter", "environment": "production"}},
+    "iperf": {"file": "iperf.yml", "port": PROMETHEUS_IPERF_PORT, "labels": {"job": "iperf3", "environment": "production"}},
+}
+
+
+class PrometheusTargetRegistry:
+    """
+    In-memory file_sd target lists with debounced, atomic writes.
+
+    Adds and removes only touch the in-memory sets; a timer coalesces every
+    change made within PROMETHEUS_FLUSH_DELAY into one write per file (temp
+    file + rename, so Prometheus never reads a partial file) and, if enabled,
+    a single reload.
+    """
+
+    def __init__(self, directory: Path = PROMETHEUS_TARGETS_DIR, delay: float = PROMETHEUS_FLUSH_DELAY):
+        self.directory = directory
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.targets = None     # group -> set of "ip:port", loaded lazily
+        self.dirty = set()
+        self.timer = None
+        self.closed = False
+        self.writes = 0
+        self.reloads = 0
+
+    def ensure_loaded(self):
+        """Seed the in-memory sets from the files on disk (caller holds the lock)"""
+        if self.targets is not None:
+            return
+        self.targets = {}
+        for group, spec in PROMETHEUS_TARGET_GROUPS.items():
+            existing = set()
+            path = self.directory / spec["file"]
+            try:
+                if path.exists():
+                    with open(path, 'r') as f:
+                        for entry in yaml.safe_load(f) or []:
+                            existing.update(entry.get('targets', []))
+            except Exception as e:
+                print(f"⚠ Couldn't read {path}: {e}")
+            self.targets[group] = existing
+
+    def target(self, ip: str, group: str) -> str:
+        return f"{ip}:{PROMETHEUS_TARGET_GROUPS[group]['port']}"
+
+    def change(self, ip_addresses: List[str], groups: List[str], add: bool) -> int:
+        changed = 0
+        with self.lock:
+            self.ensure_loaded()
+            for group in groups:
+                targets = self.targets[group]
+                for ip in ip_addresses:
+                    target = self.target(ip, group)
+                    if (target in targets) != add:
+                        (targets.add if add else targets.discard)(target)
+                        self.dirty.add(group)
+                        changed += 1
+            if self.dirty:
+                self.schedule(self.delay)
+        return changed
+
+    def schedule(self, delay: float):
+        """Arm the flush timer unless one is pending (caller holds the lock)"""
+        if self.timer is None and not self.closed:
+            self.timer = threading.Timer(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def add(self, ip_addresses: List[str], groups: List[str] = ("nodes",)) -> int:
+        """Queue targets for addition; returns how many were new"""
+        return self.change(ip_addresses, groups, add=True)
+
+    def remove(self, ip_addresses: List[str], groups: List[str] = tuple(PROMETHEUS_TARGET_GROUPS)) -> int:
+        """Queue targets for removal; returns how many were present"""
+        return self.change(ip_addresses, groups, add=False)
+
+    def write_file(self, group: str, targets: List[str]):
+        spec = PROMETHEUS_TARGET_GROUPS[group]
+        path = self.directory / spec["file"]
+        data = [{'targets': targets, 'labels': dict(spec["labels"])}] if targets else []
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            yaml.dump(data, f, default_flow_style=False, sort_keys=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """Write every dirty file once and reload Prometheus at most once"""
+        with self.lock:
+            self.timer = None
+            dirty, self.dirty = self.dirty, set()
+            snapshot = {group: sorted(self.targets[group]) for group in dirty}
+        if not snapshot:
+            return
         
-        # Ensure we have the right structure
-        if not data:
-            data = [{
-                'targets': [],
-                'labels': {
-                    'job': 'node_exporter',
-                    'environment': 'production'
-                }
-            }]
+        written = {}
+        for group, targets in snapshot.items():
+            try:
+                self.write_file(group, targets)
+                written[group] = len(targets)
+            except Exception as e:
+                print(f"Failed to write Prometheus targets for {group}: {e}, retrying in {PROMETHEUS_RETRY_DELAY}s")
+                with self.lock:
+                    self.dirty.add(group)
+                    self.schedule(PROMETHEUS_RETRY_DELAY)
+        self.writes += len(written)
+        if not written:
+            return
         
-        # Add new target if not already present
-        new_target = f"{ip_address}:9100"
-        if new_target not in data[0]['targets']:
-            data[0]['targets'].append(new_target)
-            data[0]['targets'].sort()  # Keep sorted
-            
-            # Write back to file
-            with open(targets_file, 'w') as f:
-                yaml.dump(data, f, default_flow_style=False, sort_keys=False)
-            
-            # Reload Prometheus
+        if PROMETHEUS_RELOAD:
             try:
-                import requests
-                requests.post('http://localhost:9090/-/reload', timeout=5)
-                print(f"✓ Added {ip_address} to Prometheus targets and reloaded")
+                requests.post(f"{PROMETHEUS_URL}/-/reload", timeout=5)
+                self.reloads += 1
             except Exception as e:
-                print(f"⚠ Added target but couldn't reload Prometheus: {e}")
-            
-            return True
-        else:
-            print(f"Target {ip_address} already exists in Prometheus")
-            return False
-            
-    except Exception as e:
-        print(f"Failed to add Prometheus target: {e}")
-        return False
+                print(f"⚠ Updated targets but couldn't reload Prometheus: {e}")
+        print(f"✓ Wrote Prometheus targets: {', '.join(f'{g}={n}' for g, n in written.items())}")
+
+    def shutdown(self):
+        with self.lock:
+            timer, self.timer = self.timer, None
+            self.closed = True  # final flush below; no retries after shutdown
+        if timer:
+            timer.cancel()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            self.ensure_loaded()
+            return {
+                "targets": {group: sorted(targets) for group, targets in self.targets.items()},
+                "pending": sorted(self.dirty),
+                "writes": self.writes,
+                "reloads": self.reloads,
+                "flush_delay": self.delay,
+                "reload_enabled": PROMETHEUS_RELOAD
+            }
+
+
+prometheus_targets = PrometheusTargetRegistry()
+
+
+def add_prometheus_target(ip_address: str):
+    """Add a new VM to Prometheus targets"""
+    return add_prometheus_targets([ip_address]) > 0
+
+
+def add_prometheus_targets(ip_addresses: List[str]) -> int:
+    """Register VMs' node_exporter and iperf3 targets; returns how many node targets were new"""
+    prometheus_targets.add(ip_addresses, ["iperf"])
+    added = prometheus_targets.add(ip_addresses, ["nodes"])
+    if not added:
+        print(f"Targets {', '.join(ip_addresses)} already exist in Prometheus")
+    return added
 
 
 # =============================================1
-def update_or_create_node(conn, ip_address, subnet, last_octet, status, hostname=None, mac=None, vendor=None):
-    """Update existing node or create new one"""
-    cursor = conn.cursor(dictionary=True)
+def sql_placeholders(count, row="%s"):
+    """Build a comma separated list of placeholder groups for multi-row statements"""
+    return ", ".join([row] * count)
+
+
+def subnet_bounds(subnet: str) -> tuple:
+    """Inclusive numeric (first, last) IPv4 addresses of a /24 given as 'a.b.c', or of a CIDR"""
+    try:
+        network = ipaddress.IPv4Network(subnet if '/' in subnet else f"{subnet}.0/24", strict=False)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid subnet: {subnet}")
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def node_to_ip_status(node):
+    """Convert a nodes row (dict) into an IPStatus"""
+    return IPStatus(
+        ip=node['ip_address'],
+        status=node['status'],
+        hostname=node['hostname'],
+        mac_address=node['mac_address'],
+        vendor=node['vendor'],
+        last_scanned=node['last_scanned'].isoformat() if node['last_scanned'] else datetime.now().isoformat(),
+        first_seen=node['first_seen'].isoformat() if node['first_seen'] else None,
+        last_seen=node['last_seen'].isoformat() if node['last_seen'] else None,
+        times_seen=node['times_seen'],
+        notes=node['notes'],
+        is_reserved=bool(node['is_reserved'])
+    )
 
-    # Check if node exists
-    cursor.execute("SELECT * FROM nodes WHERE ip_address = %s", (ip_address,))
-    existing = cursor.fetchone()
-    
-    if existing:
-        # Node exists - update it
-        if status == 'up':
-            # Device is back online
-            cursor.execute("""
-                UPDATE nodes 
-                SET status = %s, hostname = %s, mac_address = %s, vendor = %s,
-                    last_seen = NOW(), last_scanned = NOW(), times_seen = times_seen + 1
-                WHERE ip_address = %s
-            """, (status, hostname, mac, vendor, ip_address))
-            
-            # Record in history
-            cursor.execute("""
-                INSERT INTO node_history (node_id, ip_address, status, hostname, mac_address, vendor)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (existing['id'], ip_address, status, hostname, mac, vendor))
-        else:
-            # Device is offline
-            # Only mark as 'previously_used' if it was ACTUALLY online before (status was 'up')
-            if existing['status'] == 'up':
-                cursor.execute("""
-                    UPDATE nodes 
-                    SET status = 'previously_used', last_scanned = NOW()
-                    WHERE ip_address = %s AND status != 'reserved'
-                """, (ip_address,))
-            else:
-                # Was never up, keep as 'down'
-                cursor.execute("""
-                    UPDATE nodes 
-                    SET last_scanned = NOW()
-                    WHERE ip_address = %s AND status != 'reserved'
-                """, (ip_address,))
-    else:
-        # New node - ONLY create it if it's actually responding (up)
-        if status == 'up':
-            cursor.execute("""
-                INSERT INTO nodes (ip_address, subnet, last_octet, status, hostname, mac_address, vendor, times_seen, last_seen)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, 1, NOW())
-            """, (ip_address, subnet, last_octet, status, hostname, mac, vendor))
-            
-            node_id = cursor.lastrowid
-            cursor.execute("""
-                INSERT INTO node_history (node_id, ip_address, status, hostname, mac_address, vendor)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (node_id, ip_address, status, hostname, mac, vendor))
-        else:
-            # Don't create database entries for IPs that don't respond
-            # They'll show as 'unknown' in the grid (no data)
-            pass
-    
-    conn.commit()
-    cursor.close()
-# =============================================2    
 
+def nmap_discover(ip_range: str) -> Dict[str, dict]:
+    """Run an nmap ping sweep and return details for every responding host"""
+    nm = nmap.PortScanner()
+    nm.scan(hosts=ip_range, arguments='-sn -n -T4')
 
+    discovered = {}
+    for ip in nm.all_hosts():
+        host_info = nm[ip]
+        if host_info.state() != "up":
+            continue
 
+        hostname = None
+        mac_address = None
+        vendor = None
 
-def get_node_info(conn, ip_address):
-    """Get node information from database"""
+        if 'hostnames' in host_info and host_info['hostnames']:
+            hostname = host_info['hostnames'][0].get('name') or None
+
+        if 'addresses' in host_info:
+            mac_address = host_info['addresses'].get('mac')
+            if mac_address and 'vendor' in host_info:
+                vendor = host_info['vendor'].get(mac_address)
+
+        discovered[ip] = {"hostname": hostname, "mac_address": mac_address, "vendor": vendor}
+
+    return discovered
+
+
+def persist_scan_results(conn, first_ip: int, last_ip: int, discovered: Dict[str, dict],
+                         addresses: Optional[List[int]] = None) -> List[IPStatus]:
+    """
+    Write one scan's results with set-based statements and build the grid in memory.
+
+    first_ip/last_ip are an inclusive range of integer IPv4 addresses. When only
+    some addresses in that range were probed, pass them (sorted) as addresses.
+    Status transitions:
+      - responding hosts become 'up' (created if unknown)
+      - hosts that were 'up' and stopped responding become 'previously_used'
+      - other known hosts only get last_scanned refreshed; reserved rows are left alone
+      - unknown hosts that don't respond are not stored
+    node_history only gets a row when a host changes state (up/down or a new
+    hostname/MAC/vendor); otherwise the latest row's observations count is
+    bumped. Every known address also counts toward its hourly availability.
+    The caller owns the transaction and commits once.
+    """
+    scan_time = datetime.now().replace(microsecond=0)
+    scan_hour = scan_time.replace(minute=0, second=0)
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM nodes WHERE ip_address = %s", (ip_address,))
-    node = cursor.fetchone()
-    cursor.close()
-    return node
 
-async def scan_ip_range(subnet: str, start_ip: int, end_ip: int) -> List[IPStatus]:
-    """Scan IP range using nmap and update database"""
+    # One index range scan on the numeric address, whatever the range size
+    cursor.execute("SELECT * FROM nodes WHERE ip_num BETWEEN %s AND %s", (first_ip, last_ip))
+    existing = {row['ip_address']: row for row in cursor.fetchall()}
+
+    upsert_params = []
+    up_ips = []
+    changed_up_ips = []     # came up or changed identity: new history row
+    steady_up_ips = []      # same state as last scan: extend the current run
+    previously_used_ids = []
+    touched_ids = []
+    steady_down_ips = []
+    availability_params = []
     results = []
-    ip_range = f"{subnet}.{start_ip}-{end_ip}"
-    
-    print(f"\n{'='*60}")
-    print(f"Scanning {ip_range} with nmap...")
-    print(f"{'='*60}")
-    
-    conn = get_db_connection()
-    if not conn:
-        print("✗ Database connection failed")
-        # Return empty results if DB is down
-        for last_octet in range(start_ip, end_ip + 1):
-            ip = f"{subnet}.{last_octet}"
-            results.append(IPStatus(
-                ip=ip,
-                status="unknown",
-                last_scanned=datetime.now().isoformat()
+
+    for address in (addresses if addresses is not None else range(first_ip, last_ip + 1)):
+        ip = str(ipaddress.IPv4Address(address))
+        subnet, last_octet = ip.rsplit('.', 1)
+        host = discovered.get(ip)
+        node = existing.get(ip)
+
+        if host is not None:
+            upsert_params.extend((
+                ip, subnet, int(last_octet), host.get('hostname'), host.get('mac_address'),
+                host.get('vendor'), scan_time, scan_time, scan_time
             ))
-        return results
-    
-    try:
-        nm = nmap.PortScanner()
-        nm.scan(hosts=ip_range, arguments='-sn -n -T4')
-        
-        active_ips = set(nm.all_hosts())
-        print(f"Nmap found {len(active_ips)} responding hosts")
-        
-        for last_octet in range(start_ip, end_ip + 1):
-            ip = f"{subnet}.{last_octet}"
-            
-            # Check current scan status
-            is_up = ip in active_ips and nm[ip].state() == "up"
-            current_status = 'up' if is_up else 'down'
-            
-            hostname = None
-            mac_address = None
-            vendor = None
-            
-            if is_up:
-                host_info = nm[ip]
-                
-                if 'hostnames' in host_info and host_info['hostnames']:
-                    hostname = host_info['hostnames'][0].get('name')
-                
-                if 'addresses' in host_info:
-                    mac_address = host_info['addresses'].get('mac')
-                    if mac_address and 'vendor' in host_info:
-                        vendor = host_info['vendor'].get(mac_address)
-                
-                print(f"  UP: {ip}" + (f" ({vendor})" if vendor else ""))
-            
-            # Update database
-            update_or_create_node(conn, ip, subnet, last_octet, current_status, hostname, mac_address, vendor)
-            
-            # Get updated node info from DB
-            node = get_node_info(conn, ip)
-            
-            if node:
-                results.append(IPStatus(
-                    ip=ip,
-                    status=node['status'],
-                    hostname=node['hostname'],
-                    mac_address=node['mac_address'],
-                    vendor=node['vendor'],
-                    last_scanned=node['last_scanned'].isoformat(),
-                    first_seen=node['first_seen'].isoformat() if node['first_seen'] else None,
-                    last_seen=node['last_seen'].isoformat() if node['last_seen'] else None,
-                    times_seen=node['times_seen'],
-                    notes=node['notes'],
-                    is_reserved=bool(node['is_reserved'])
-                ))
+            up_ips.append(ip)
+            changed = node is None or node['status'] != 'up' or any(
+                host.get(field) is not None and host.get(field) != node.get(field)
+                for field in ('hostname', 'mac_address', 'vendor')
+            )
+            (changed_up_ips if changed else steady_up_ips).append(ip)
+            availability_params.extend((ip, scan_hour, 1))
+
+            if node is None:
+                node = {
+                    'ip_address': ip, 'first_seen': scan_time, 'times_seen': 0,
+                    'hostname': None, 'mac_address': None, 'vendor': None,
+                    'notes': None, 'is_reserved': False
+                }
+            # A field the engine couldn't determine keeps its known value, as in the upsert
+            node.update({field: host[field] for field in ('hostname', 'mac_address', 'vendor')
+                         if host.get(field) is not None})
+            node.update({
+                'status': 'up',
+                'last_seen': scan_time,
+                'last_scanned': scan_time,
+                'times_seen': node['times_seen'] + 1
+            })
+        elif node is not None and node['status'] != 'reserved':
+            if node['status'] == 'up':
+                previously_used_ids.append(node['id'])
+                node['status'] = 'previously_used'
             else:
-                results.append(IPStatus(
-                    ip=ip,
-                    status=current_status,
-                    last_scanned=datetime.now().isoformat()
-                ))
-        
-        # Record scan in history
-        cursor = conn.cursor()
-        active_count = sum(1 for r in results if r.status == 'up')
-        cursor.execute("""
-            INSERT INTO scan_history (subnet, start_ip, end_ip, total_ips, active_ips, scan_duration)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (subnet, start_ip, end_ip, len(results), active_count, 0))
-        conn.commit()
-        cursor.close()
-        
-        print(f"{'='*60}\n")
-    
-    except Exception as e:
-        print(f"Scan error: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
-    
+                touched_ids.append(node['id'])
+                steady_down_ips.append(ip)
+            node['last_scanned'] = scan_time
+            availability_params.extend((ip, scan_hour, 0))
+
+        if node is not None:
+            results.append(node_to_ip_status(node))
+        else:
+            results.append(IPStatus(ip=ip, status='down', last_scanned=scan_time.isoformat()))
+
+    if up_ips:
+        cursor.execute(f"""
+            INSERT INTO nodes (ip_address, subnet, last_octet, status, hostname, mac_address, vendor,
+                               times_seen, first_seen, last_seen, last_scanned)
+            VALUES {sql_placeholders(len(up_ips), "(%s, %s, %s, 'up', %s, %s, %s, 1, %s, %s, %s)")}
+            ON DUPLICATE KEY UPDATE
+                status = 'up', hostname = COALESCE(VALUES(hostname), hostname),
+                mac_address = COALESCE(VALUES(mac_address), mac_address),
+                vendor = COALESCE(VALUES(vendor), vendor), last_seen = VALUES(last_seen),
+                last_scanned = VALUES(last_scanned), times_seen = times_seen + 1
+        """, upsert_params)
+
+    if changed_up_ips:
+        cursor.execute(f"""
+            INSERT INTO node_history (node_id, ip_address, status, hostname, mac_address, vendor,
+                                      recorded_at, last_recorded_at)
+            SELECT id, ip_address, 'up', hostname, mac_address, vendor, %s, %s
+            FROM nodes WHERE ip_address IN ({sql_placeholders(len(changed_up_ips))})
+        """, [scan_time, scan_time] + changed_up_ips)
+
+    if previously_used_ids:
+        cursor.execute(f"""
+            INSERT INTO node_history (node_id, ip_address, status, hostname, mac_address, vendor,
+                                      recorded_at, last_recorded_at)
+            SELECT id, ip_address, 'down', hostname, mac_address, vendor, %s, %s
+            FROM nodes WHERE id IN ({sql_placeholders(len(previously_used_ids))})
+        """, [scan_time, scan_time] + previously_used_ids)
+
+    # Extend each unchanged host's current run; a latest row in the other state
+    # (e.g. history predating transition tracking) is left as is
+    if steady_up_ips or steady_down_ips:
+        steady_ips = steady_up_ips + steady_down_ips
+        up_match = f"h.ip_address IN ({sql_placeholders(len(steady_up_ips))})" if steady_up_ips else "FALSE"
+        cursor.execute(f"""
+            UPDATE node_history h
+            JOIN (
+                SELECT MAX(id) AS id FROM node_history
+                WHERE ip_address IN ({sql_placeholders(len(steady_ips))})
+                GROUP BY ip_address
+            ) latest ON h.id = latest.id
+            SET h.observations = h.observations + 1, h.last_recorded_at = %s
+            WHERE h.status = IF({up_match}, 'up', 'down')
+        """, steady_ips + [scan_time] + steady_up_ips)
+
+    # last_seen is re-assigned to itself so its ON UPDATE clause doesn't fire for offline hosts
+    if previously_used_ids:
+        cursor.execute(f"""
+            UPDATE nodes
+            SET status = 'previously_used', last_scanned = %s, last_seen = last_seen
+            WHERE id IN ({sql_placeholders(len(previously_used_ids))}) AND status != 'reserved'
+        """, [scan_time] + previously_used_ids)
+
+    if touched_ids:
+        cursor.execute(f"""
+            UPDATE nodes
+            SET last_scanned = %s, last_seen = last_seen
+            WHERE id IN ({sql_placeholders(len(touched_ids))}) AND status != 'reserved'
+        """, [scan_time] + touched_ids)
+
+    if availability_params:
+        cursor.execute(f"""
+            INSERT INTO node_availability_hourly (ip_address, bucket, observations, up_observations)
+            VALUES {sql_placeholders(len(availability_params) // 3, "(%s, %s, 1, %s)")}
+            ON DUPLICATE KEY UPDATE
+                observations = observations + 1, up_observations = up_observations + VALUES(up_observations)
+        """, availability_params)
+
+    cursor.close()
     return results
 
-@app.get("/")
-async def root():
-    return {
-        "message": "IP Manager API v2.0", 
-        "features": ["Node tracking", "IP reservation", "History"],
-        "database": "connected" if connection_pool else "disconnected"
-    }
 
-@app.get("/health")
-async def health_check():
-    db_status = "connected"
-    try:
+# =============================================
+# Subnet grid cache
+# =============================================
+
+GRID_CACHE_MAX_SUBNETS = int(os.getenv("GRID_CACHE_MAX_SUBNETS", 1024))
+GRID_CACHE_TTL = int(os.getenv("GRID_CACHE_TTL", 300))  # bounds staleness from writes made outside the API
+
+# One status byte per address; index = code
+GRID_STATUS_NAMES = ["unknown", "up", "down", "previously_used", "reserved"]
+GRID_STATUS_CODES = {name: code for code, name in enumerate(GRID_STATUS_NAMES)}
+
+
+class SubnetGrid:
+    """Compact per-address state for one /24: status bytes, reserved bits, last_seen epochs"""
+    __slots__ = ("status", "reserved", "last_seen", "loaded_at")
+
+    def __init__(self):
+        self.status = bytearray(256)
+        self.reserved = bytearray(32)          # bitset, one bit per last octet
+        self.last_seen = array('I', bytes(1024))  # epoch seconds, 0 = never seen
+        self.loaded_at = time.monotonic()
+
+    def set(self, last_octet: int, status: Optional[str] = None,
+            is_reserved: Optional[bool] = None, last_seen: Optional[datetime] = None):
+        if status is not None:
+            self.status[last_octet] = GRID_STATUS_CODES.get(status, 0)
+        if is_reserved is not None:
+            if is_reserved:
+                self.reserved[last_octet >> 3] |= 1 << (last_octet & 7)
+            else:
+                self.reserved[last_octet >> 3] &= ~(1 << (last_octet & 7)) & 0xFF
+        if last_seen is not None:
+            self.last_seen[last_octet] = int(last_seen.timestamp())
+
+    def is_reserved(self, last_octet: int) -> bool:
+        return bool(self.reserved[last_octet >> 3] & (1 << (last_octet & 7)))
+
+
+class SubnetGridCache:
+    """
+    Read-through cache of SubnetGrid objects keyed by /24 subnet ("a.b.c").
+
+    Misses load the subnet from nodes in one query. Scans, reservations and
+    node updates patch cached grids in place; destructive operations
+    invalidate them. A per-subnet version stops a load that raced with a
+    write from caching stale rows.
+    """
+
+    def __init__(self, max_subnets: int = GRID_CACHE_MAX_SUBNETS, ttl: int = GRID_CACHE_TTL):
+        self.max_subnets = max_subnets
+        self.ttl = ttl
+        self.grids = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.patches = 0
+        self.invalidations = 0
+
+    def peek(self, subnet: str) -> Optional[SubnetGrid]:
+        """Return a fresh cached grid without touching MySQL, counting the hit or miss"""
+        with self.lock:
+            grid = self.grids.get(subnet)
+            if grid is not None and time.monotonic() - grid.loaded_at < self.ttl:
+                self.grids.move_to_end(subnet)
+                self.hits += 1
+                return grid
+            self.misses += 1
+            return None
+
+    def load(self, subnet: str) -> SubnetGrid:
+        """Build a grid from MySQL and cache it (blocking)"""
+        with self.lock:
+            version = self.versions.get(subnet, 0)
+
+        grid = SubnetGrid()
         conn = get_db_connection()
-        if conn:
+        if not conn:
+            raise HTTPException(status_code=500, detail="Database connection failed")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT last_octet, status, is_reserved, last_seen
+                FROM nodes WHERE ip_num BETWEEN %s AND %s
+            """, subnet_bounds(subnet))
+            for last_octet, status, is_reserved, last_seen in cursor:
+                grid.set(last_octet, status, bool(is_reserved), last_seen)
+            # Reservations recorded without a nodes row (or with is_reserved unset) still count
+            cursor.execute("""
+                SELECT DISTINCT ip_num FROM ip_reservations
+                WHERE ip_num BETWEEN %s AND %s AND is_active = TRUE
+            """, subnet_bounds(subnet))
+            for (ip_num,) in cursor:
+                grid.set(ip_num & 0xFF, is_reserved=True)
+            cursor.close()
+        finally:
             conn.close()
-        else:
-            db_status = "disconnected"
-    except:
-        db_status = "error"
-    
-    return {
-        "status": "healthy", 
-        "timestamp": datetime.now().isoformat(),
-        "database": db_status
-    }
 
-@app.post("/api/scan", response_model=ScanResponse)
-async def scan_network(request: ScanRequest):
-    """Scan network and update node database"""
-    scan_start = datetime.now()
-    results = await scan_ip_range(request.subnet, request.start_ip, request.end_ip)
-    
-    active_count = sum(1 for r in results if r.status == 'up')
-    inactive_count = sum(1 for r in results if r.status == 'down')
-    previously_used_count = sum(1 for r in results if r.status == 'previously_used')
-    reserved_count = sum(1 for r in results if r.status == 'reserved')
-    
-    return ScanResponse(
-        subnet=f"{request.subnet}.{request.start_ip}-{request.end_ip}",
-        total_ips=len(results),
-        active_ips=active_count,
-        inactive_ips=inactive_count,
-        previously_used_ips=previously_used_count,
-        reserved_ips=reserved_count,
-        scan_time=(datetime.now() - scan_start).total_seconds(),
-        results=results
-    )
+        with self.lock:
+            if self.versions.get(subnet, 0) == version:
+                self.grids[subnet] = grid
+                self.grids.move_to_end(subnet)
+                while len(self.grids) > self.max_subnets:
+                    self.grids.popitem(last=False)
+        return grid
 
-@app.post("/api/reserve")
-async def reserve_ip(request: ReserveIPRequest):
-    """Reserve an IP address"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    
-    try:
-        cursor = conn.cursor()
-        
-        # Update node as reserved
-        cursor.execute("""
-            UPDATE nodes 
-            SET status = 'reserved', is_reserved = TRUE, 
-                reserved_by = %s, reserved_at = NOW(),
-                notes = %s
-            WHERE ip_address = %s
-        """, (request.reserved_by, request.description, request.ip))
-        
-        # Add reservation record
-        cursor.execute("""
-            INSERT INTO ip_reservations (ip_address, reserved_for, description, reserved_by)
-            VALUES (%s, %s, %s, %s)
-        """, (request.ip, request.reserved_for, request.description, request.reserved_by))
-        
-        conn.commit()
-        cursor.close()
-        
-        return {"status": "success", "message": f"IP {request.ip} reserved"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+    def get(self, subnet: str) -> SubnetGrid:
+        return self.peek(subnet) or self.load(subnet)
 
-@app.post("/api/release/{ip}")
-async def release_ip(ip: str):
-    """Release a reserved IP"""
-    conn = get_db_connection()
+    def patch(self, ip: str, status: Optional[str] = None,
+              is_reserved: Optional[bool] = None, last_seen: Optional[datetime] = None):
+        """Update one address in its cached grid, if that grid is cached"""
+        subnet, last_octet = ip.rsplit('.', 1)
+        with self.lock:
+            self.versions[subnet] = self.versions.get(subnet, 0) + 1
+            grid = self.grids.get(subnet)
+            if grid is not None:
+                grid.set(int(last_octet), status, is_reserved, last_seen)
+                self.patches += 1
+
+    def patch_many(self, ips: List[str], status: Optional[str] = None,
+                   is_reserved: Optional[bool] = None):
+        """Apply the same update to many addresses under one lock"""
+        with self.lock:
+            for ip in ips:
+                subnet, last_octet = ip.rsplit('.', 1)
+                self.versions[subnet] = self.versions.get(subnet, 0) + 1
+                grid = self.grids.get(subnet)
+                if grid is not None:
+                    grid.set(int(last_octet), status, is_reserved)
+                    self.patches += 1
+
+    def apply_results(self, results: List[IPStatus]):
+        """
+        Patch cached grids with a batch of scan results.
+
+        A scan can only add the reserved bit, never clear it: an address held
+        only by an active ip_reservations row comes back with is_reserved
+        False. Reserve and release patch the bit directly.
+        """
+        with self.lock:
+            for r in results:
+                subnet, last_octet = r.ip.rsplit('.', 1)
+                self.versions[subnet] = self.versions.get(subnet, 0) + 1
+                grid = self.grids.get(subnet)
+                if grid is None:
+                    continue
+                last_seen = datetime.fromisoformat(r.last_seen) if r.last_seen else None
+                grid.set(int(last_octet), r.status, True if r.is_reserved else None, last_seen)
+                self.patches += 1
+
+    def invalidate(self, subnet: str):
+        with self.lock:
+            self.versions[subnet] = self.versions.get(subnet, 0) + 1
+            if self.grids.pop(subnet, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "subnets_cached": len(self.grids),
+                "max_subnets": self.max_subnets,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "patches": self.patches,
+                "invalidations": self.invalidations
+            }
+
+
+grid_cache = SubnetGridCache()
+
+
+# Compact grid wire format, selected with "Accept: application/vnd.ipmanager.grid"
+#
+#   header  : magic "IPGR", version u8, flags u8, pad u16,
+#             base address u32, count u32, side table entries u32, meta length u32
+#   meta    : UTF-8 JSON (subnet label, summary counts, legend)
+#   status  : count bytes, low 7 bits = GRID_STATUS_NAMES code, 0x80 = reserved
+#   side    : entries of offset u32 + hostname, mac, vendor, notes
+#             (each u16 length + UTF-8 bytes), only for addresses that have any
+# All integers are big-endian.
+GRID_MEDIA_TYPE = "application/vnd.ipmanager.grid"
+GRID_FORMAT_VERSION = 1
+GRID_RESERVED_FLAG = 0x80
+GRID_HEADER = struct.Struct("!4sBBHIIII")
+GRID_SIDE_OFFSET = struct.Struct("!I")
+GRID_STRING_LENGTH = struct.Struct("!H")
+
+
+def sse_event(event: str, payload: str) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def wants_compact_grid(http_request: Request) -> bool:
+    """True when the client asked for the compact grid format"""
+    return GRID_MEDIA_TYPE in http_request.headers.get("accept", "")
+
+
+def encode_grid(base_ip: int, status: bytes, side: List[tuple], meta: dict) -> bytes:
+    """Pack status bytes plus (offset, hostname, mac, vendor, notes) side entries"""
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode()
+    parts = [
+        GRID_HEADER.pack(b"IPGR", GRID_FORMAT_VERSION, 0, 0, base_ip, len(status), len(side), len(meta_bytes)),
+        meta_bytes,
+        bytes(status)
+    ]
+    for offset, *fields in side:
+        parts.append(GRID_SIDE_OFFSET.pack(offset))
+        for field in fields:
+            encoded = (field or "").encode()[:0xFFFF]
+            parts.append(GRID_STRING_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+    return b"".join(parts)
+
+
+def decode_grid(data: bytes) -> dict:
+    """Unpack the compact grid format (reference decoder for clients and benchmarks)"""
+    magic, version, _, _, base_ip, count, side_count, meta_length = GRID_HEADER.unpack_from(data)
+    if magic != b"IPGR" or version != GRID_FORMAT_VERSION:
+        raise ValueError("Not a compact grid payload")
+    position = GRID_HEADER.size
+    meta = json.loads(data[position:position + meta_length])
+    position += meta_length
+    status = data[position:position + count]
+    position += count
+
+    side = {}
+    for _ in range(side_count):
+        (offset,) = GRID_SIDE_OFFSET.unpack_from(data, position)
+        position += GRID_SIDE_OFFSET.size
+        fields = []
+        for _ in range(4):
+            (length,) = GRID_STRING_LENGTH.unpack_from(data, position)
+            position += GRID_STRING_LENGTH.size
+            fields.append(data[position:position + length].decode() or None)
+            position += length
+        side[str(ipaddress.IPv4Address(base_ip + offset))] = dict(
+            zip(("hostname", "mac_address", "vendor", "notes"), fields)
+        )
+
+    return {"base": str(ipaddress.IPv4Address(base_ip)), "meta": meta, "status": status, "side": side}
+
+
+def encode_scan_results(summary: ScanSummary, results: List[IPStatus]) -> bytes:
+    """Encode an address-ordered, contiguous list of scan results"""
+    base_ip = int(ipaddress.IPv4Address(results[0].ip)) if results else 0
+    status = bytearray(len(results))
+    side = []
+    for offset, r in enumerate(results):
+        code = GRID_STATUS_CODES.get(r.status, 0)
+        status[offset] = code | GRID_RESERVED_FLAG if r.is_reserved else code
+        if r.hostname or r.mac_address or r.vendor or r.notes:
+            side.append((offset, r.hostname, r.mac_address, r.vendor, r.notes))
+    meta = summary.model_dump()
+    meta["legend"] = GRID_STATUS_NAMES
+    return encode_grid(base_ip, status, side, meta)
+
+
+def encode_subnet_grid(subnet: str, grid: SubnetGrid) -> bytes:
+    """Encode a cached /24 grid (the cache holds no side-table fields)"""
+    status = bytearray(grid.status)
+    for octet in range(256):
+        if grid.is_reserved(octet):
+            status[octet] |= GRID_RESERVED_FLAG
+    meta = {"subnet": subnet, "legend": GRID_STATUS_NAMES}
+    return encode_grid(int(ipaddress.IPv4Address(f"{subnet}.0")), status, [], meta)
+
+
+# =============================================
+# Discovery engines
+# =============================================
+
+# Defaults for the in-process sweep engine
+SWEEP_RATE = int(os.getenv("SWEEP_RATE", 2000))            # probes per second per shard
+SWEEP_TIMEOUT = float(os.getenv("SWEEP_TIMEOUT", 1.0))     # seconds to wait for replies
+SWEEP_RETRIES = int(os.getenv("SWEEP_RETRIES", 1))         # extra passes for silent hosts
+SWEEP_TCP_PORTS = [int(p) for p in os.getenv("SWEEP_TCP_PORTS", "22,80,443,445,3389,9100").split(",")]
+SCAN_ENGINE = os.getenv("SCAN_ENGINE", "nmap")
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+ETH_P_ARP = 0x0806
+ARPHRD_ETHER = 1
+
+
+def nmap_hosts_spec(first_ip: int, last_ip: int) -> str:
+    """Express an address range as space separated CIDR blocks for nmap"""
+    networks = ipaddress.summarize_address_range(
+        ipaddress.IPv4Address(first_ip), ipaddress.IPv4Address(last_ip)
+    )
+    return " ".join(str(n) for n in networks)
+
+
+class DiscoveryEngine(ABC):
+    """Finds responding hosts in an address range"""
+    name = "base"
+
+    @abstractmethod
+    def discover(self, first_ip: int, last_ip: int) -> Dict[str, dict]:
+        """Return {ip: {hostname, mac_address, vendor}} for every host that is up"""
+
+    def discover_addresses(self, addresses: List[int]) -> Dict[str, dict]:
+        """Probe a sorted, possibly sparse list of addresses"""
+        discovered = {}
+        run_start = previous = None
+        for address in addresses + [None]:
+            if run_start is not None and address != previous + 1:
+                discovered.update(self.discover(run_start, previous))
+                run_start = None
+            if run_start is None:
+                run_start = address
+            previous = address
+        return discovered
+
+
+class NmapEngine(DiscoveryEngine):
+    """Ping sweep through an nmap subprocess (-sn -n -T4)"""
+    name = "nmap"
+
+    def discover(self, first_ip: int, last_ip: int) -> Dict[str, dict]:
+        return nmap_discover(nmap_hosts_spec(first_ip, last_ip))
+
+    def discover_addresses(self, addresses: List[int]) -> Dict[str, dict]:
+        return nmap_discover(" ".join(str(ipaddress.IPv4Address(a)) for a in addresses))
+
+
+def icmp_checksum(data: bytes) -> int:
+    """RFC 1071 internet checksum"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(identifier: int, sequence: int) -> bytes:
+    """Build an ICMP echo request packet"""
+    payload = b'ipmanager-sweep'
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = icmp_checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + payload
+
+
+def local_ipv4_interfaces() -> List[dict]:
+    """List non-loopback interfaces with their primary IPv4 address, network, MAC and ARPHRD link type"""
+    interfaces = []
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for _, name in socket.if_nameindex():
+            if name == "lo":
+                continue
+            packed_name = struct.pack("256s", name[:15].encode())
+            try:
+                address = socket.inet_ntoa(fcntl.ioctl(probe.fileno(), SIOCGIFADDR, packed_name)[20:24])
+                netmask = socket.inet_ntoa(fcntl.ioctl(probe.fileno(), SIOCGIFNETMASK, packed_name)[20:24])
+                mac = Path(f"/sys/class/net/{name}/address").read_text().strip()
+            except OSError:
+                continue
+            try:
+                link_type = int(Path(f"/sys/class/net/{name}/type").read_text())
+            except (OSError, ValueError):
+                link_type = None
+            interfaces.append({
+                "interface": name,
+                "ip_address": address,
+                "network": ipaddress.IPv4Network(f"{address}/{netmask}", strict=False),
+                "mac_address": mac,
+                "link_type": link_type
+            })
+    finally:
+        probe.close()
+    return interfaces
+
+
+class AsyncRateLimiter:
+    """Spaces out probes to a fixed rate within one event loop"""
+
+    def __init__(self, rate: int):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_slot > now:
+            await asyncio.sleep(self.next_slot - now)
+        self.next_slot = max(now, self.next_slot) + self.interval
+
+
+class AsyncSweepEngine(DiscoveryEngine):
+    """
+    In-process asyncio sweep.
+
+    Hosts on a directly connected Ethernet segment are found with ARP when raw
+    packet sockets are available. Everything else, including on-segment
+    addresses that didn't answer ARP, gets ICMP echo over a raw
+    socket (or an unprivileged ICMP datagram socket). When no ICMP socket can
+    be opened, hosts are probed with TCP connects; a refused connection still
+    proves the host is up.
+    """
+    name = "async"
+
+    def __init__(self, rate: int = SWEEP_RATE, timeout: float = SWEEP_TIMEOUT,
+                 retries: int = SWEEP_RETRIES, tcp_ports: Optional[List[int]] = None):
+        self.rate = rate
+        self.timeout = timeout
+        self.retries = retries
+        self.tcp_ports = tcp_ports or SWEEP_TCP_PORTS
+
+    def discover(self, first_ip: int, last_ip: int) -> Dict[str, dict]:
+        # Each shard runs on its own worker thread, so it gets its own event loop
+        return asyncio.run(self.sweep(range(first_ip, last_ip + 1)))
+
+    def discover_addresses(self, addresses: List[int]) -> Dict[str, dict]:
+        return asyncio.run(self.sweep(addresses))
+
+    async def sweep(self, addresses) -> Dict[str, dict]:
+        targets = [ipaddress.IPv4Address(a) for a in addresses]
+        discovered = {}
+        limiter = AsyncRateLimiter(self.rate)
+
+        # ARP only means something on Ethernet; tun, WireGuard and other
+        # point-to-point links have no MAC and never answer who-has
+        remaining = targets
+        for iface in local_ipv4_interfaces():
+            if iface["link_type"] != ARPHRD_ETHER or not iface["mac_address"].strip("0:"):
+                continue
+            on_segment = [t for t in remaining if t in iface["network"]]
+            if not on_segment:
+                continue
+            found = await self.arp_sweep(iface, on_segment, limiter)
+            if found is None:
+                break  # no CAP_NET_RAW, nothing else will work either
+            discovered.update(found)
+            # Silence on ARP isn't proof the host is down; ICMP/TCP get a try too
+            remaining = [t for t in remaining if str(t) not in found]
+
+        if remaining:
+            found = await self.icmp_sweep(remaining, limiter)
+            if found is None:
+                found = await self.tcp_sweep(remaining, limiter)
+            discovered.update(found)
+
+        return discovered
+
+    async def collect_replies(self, sock, send_probe, targets, parse_reply) -> Dict[str, dict]:
+        """Send a probe to every target (with retries) and gather parsed replies"""
+        loop = asyncio.get_running_loop()
+        discovered = {}
+        all_replied = asyncio.Event()
+
+        def on_readable():
+            while True:
+                try:
+                    packet, address = sock.recvfrom(65535)
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError:
+                    return
+                reply = parse_reply(packet, address)
+                if reply:
+                    ip, info = reply
+                    discovered.setdefault(ip, info)
+                    if len(discovered) == len(targets):
+                        all_replied.set()
+
+        loop.add_reader(sock.fileno(), on_readable)
+        try:
+            pending = targets
+            for _ in range(self.retries + 1):
+                for target in pending:
+                    await send_probe(target)
+                try:
+                    await asyncio.wait_for(all_replied.wait(), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+                pending = [t for t in pending if str(t) not in discovered]
+                if not pending:
+                    break
+        finally:
+            loop.remove_reader(sock.fileno())
+        return discovered
+
+    async def icmp_sweep(self, targets, limiter) -> Optional[Dict[str, dict]]:
+        """ICMP echo sweep; returns None when no ICMP socket is permitted"""
+        raw = True
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        except PermissionError:
+            raw = False
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            except (PermissionError, OSError):
+                return None
+        sock.setblocking(False)
+
+        identifier = os.getpid() & 0xFFFF
+        target_set = {str(t) for t in targets}
+        sequence = 0
+
+        async def send_probe(target):
+            nonlocal sequence
+            await limiter.wait()
+            sequence = (sequence + 1) & 0xFFFF
+            try:
+                sock.sendto(build_echo_request(identifier, sequence), (str(target), 0))
+            except OSError:
+                pass
+
+        def parse_reply(packet, address):
+            # Raw sockets include the IP header; datagram sockets rewrite the identifier
+            icmp = packet[(packet[0] & 0x0F) * 4:] if raw else packet
+            if len(icmp) < 8 or icmp[0] != ICMP_ECHO_REPLY:
+                return None
+            if raw and struct.unpack("!H", icmp[4:6])[0] != identifier:
+                return None
+            if address[0] not in target_set:
+                return None
+            return address[0], {"hostname": None, "mac_address": None, "vendor": None}
+
+        try:
+            return await self.collect_replies(sock, send_probe, targets, parse_reply)
+        finally:
+            sock.close()
+
+    async def arp_sweep(self, iface, targets, limiter) -> Optional[Dict[str, dict]]:
+        """ARP who-has sweep of a local segment; returns None without CAP_NET_RAW"""
+        try:
+            sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+            sock.bind((iface["interface"], 0))
+        except (PermissionError, OSError, AttributeError):
+            return None
+        sock.setblocking(False)
+
+        src_mac = bytes.fromhex(iface["mac_address"].replace(":", ""))
+        src_ip = socket.inet_aton(iface["ip_address"])
+        target_set = {str(t) for t in targets}
+
+        async def send_probe(target):
+            await limiter.wait()
+            frame = (b'\xff' * 6 + src_mac + struct.pack("!H", ETH_P_ARP)
+                     + struct.pack("!HHBBH", 1, 0x0800, 6, 4, 1)
+                     + src_mac + src_ip + b'\x00' * 6 + target.packed)
+            try:
+                sock.send(frame)
+            except OSError:
+                pass
+
+        def parse_reply(frame, address):
+            if len(frame) < 42 or struct.unpack("!H", frame[12:14])[0] != ETH_P_ARP:
+                return None
+            if struct.unpack("!H", frame[20:22])[0] != 2:  # ARP reply
+                return None
+            sender_ip = socket.inet_ntoa(frame[28:32])
+            if sender_ip not in target_set:
+                return None
+            mac = ":".join(f"{b:02X}" for b in frame[22:28])
+            return sender_ip, {"hostname": None, "mac_address": mac, "vendor": None}
+
+        try:
+            return await self.collect_replies(sock, send_probe, targets, parse_reply)
+        finally:
+            sock.close()
+
+    async def tcp_sweep(self, targets, limiter) -> Dict[str, dict]:
+        """TCP connect sweep for when ICMP isn't available"""
+        discovered = {}
+        semaphore = asyncio.Semaphore(max(1, min(self.rate, 512)))
+
+        async def probe(target, port):
+            async with semaphore:
+                await limiter.wait()
+                try:
+                    _, writer = await asyncio.wait_for(
+                        asyncio.open_connection(str(target), port), timeout=self.timeout
+                    )
+                    writer.close()
+                    return True
+                except ConnectionRefusedError:
+                    return True  # RST from the host itself
+                except (OSError, asyncio.TimeoutError):
+                    return False
+
+        async def probe_host(target):
+            for port in self.tcp_ports:
+                if await probe(target, port):
+                    discovered[str(target)] = {"hostname": None, "mac_address": None, "vendor": None}
+                    return
+
+        await asyncio.gather(*(probe_host(t) for t in targets))
+        return discovered
+
+
+discovery_engines: Dict[str, DiscoveryEngine] = {
+    "nmap": NmapEngine(),
+    "async": AsyncSweepEngine(),
+}
+
+
+def get_discovery_engine(name: Optional[str] = None) -> DiscoveryEngine:
+    """Look up a discovery engine by name, defaulting to SCAN_ENGINE"""
+    engine = discovery_engines.get(name or SCAN_ENGINE)
+    if not engine:
+        raise HTTPException(status_code=400, detail=f"Unknown scan engine: {name}")
+    return engine
+
+
+# Scans run on a dedicated pool so nmap and MySQL never block the event loop
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", 4))
+# A /24 is one shard: one persist, one commit and one grid patch. Lower it to
+# sweep a single /24 on several workers, at the cost of a commit per shard.
+SCAN_SHARD_SIZE = int(os.getenv("SCAN_SHARD_SIZE", 256))
+SCAN_SHARD_WORKERS = int(os.getenv("SCAN_SHARD_WORKERS", os.cpu_count() or 4))
+# Cap on shards being swept at once across all concurrent scans
+SCAN_MAX_ACTIVE_SHARDS = int(os.getenv("SCAN_MAX_ACTIVE_SHARDS", (os.cpu_count() or 4) * 2))
+SCAN_JOB_HISTORY = int(os.getenv("SCAN_JOB_HISTORY", 50))
+SCAN_STREAM_BUFFER = int(os.getenv("SCAN_STREAM_BUFFER", 4))  # shards buffered per streaming client
+
+scan_executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan")
+shard_slots = threading.BoundedSemaphore(SCAN_MAX_ACTIVE_SHARDS)
+
+
+class ScanCancelled(Exception):
+    """Raised inside a scan worker when its job has been cancelled"""
+
+
+class ScanTarget:
+    """An inclusive range of IPv4 addresses to sweep, split into shards"""
+
+    def __init__(self, first_ip: int, last_ip: int, label: str,
+                 shard_size: Optional[int] = None, max_workers: Optional[int] = None,
+                 engine: Optional[DiscoveryEngine] = None):
+        self.first_ip = first_ip
+        self.last_ip = last_ip
+        self.label = label
+        self.shard_size = shard_size or SCAN_SHARD_SIZE
+        self.max_workers = min(max_workers or SCAN_SHARD_WORKERS, SCAN_MAX_ACTIVE_SHARDS)
+        self.engine = engine or get_discovery_engine()
+
+    @classmethod
+    def from_request(cls, request: ScanRequest) -> "ScanTarget":
+        if request.cidr:
+            network = ipaddress.IPv4Network(request.cidr)
+            first_ip = int(network.network_address)
+            last_ip = int(network.broadcast_address)
+            label = str(network)
+        else:
+            if request.start_ip > request.end_ip:
+                raise HTTPException(status_code=400, detail="start_ip must not be greater than end_ip")
+            base = int(ipaddress.IPv4Address(f"{request.subnet}.0"))
+            first_ip = base + request.start_ip
+            last_ip = base + request.end_ip
+            label = f"{request.subnet}.{request.start_ip}-{request.end_ip}"
+        return cls(first_ip, last_ip, label, request.shard_size, request.max_workers,
+                   get_discovery_engine(request.engine))
+
+    @property
+    def size(self) -> int:
+        return self.last_ip - self.first_ip + 1
+
+    def shards(self):
+        """Yield (first_ip, last_ip) pairs of at most shard_size addresses"""
+        for shard_first in range(self.first_ip, self.last_ip + 1, self.shard_size):
+            yield shard_first, min(shard_first + self.shard_size - 1, self.last_ip)
+
+
+class ScanJob:
+    """Progress and control state for a background scan"""
+
+    def __init__(self, target: ScanTarget):
+        self.job_id = str(uuid.uuid4())
+        self.target = target
+        self.status = "queued"  # queued, running, completed, failed, cancelled
+        self.phase = "queued"   # queued, scanning, recording, done
+        self.hosts_total = target.size
+        self.hosts_probed = 0
+        self.hosts_up = 0
+        self.shards_total = len(range(target.first_ip, target.last_ip + 1, target.shard_size))
+        self.shards_done = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result = None
+        self.future = None
+        self.on_shard = None
+        self.tally = ScanTally()
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise ScanCancelled()
+
+    def shard_finished(self, probed: int, up: int):
+        with self.lock:
+            self.hosts_probed += probed
+            self.hosts_up += up
+            self.shards_done += 1
+
+    def to_dict(self, include_result=True):
+        return {
+            "job_id": self.job_id,
+            "subnet": self.target.label,
+            "status": self.status,
+            "phase": self.phase,
+            "hosts_total": self.hosts_total,
+            "hosts_probed": self.hosts_probed,
+            "hosts_up": self.hosts_up,
+            "shards_total": self.shards_total,
+            "shards_done": self.shards_done,
+            "progress": round(self.hosts_probed / self.hosts_total * 100, 1) if self.hosts_total else 100.0,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "result": self.result if include_result else None
+        }
+
+
+# Store scan jobs (finished ones are pruned to SCAN_JOB_HISTORY)
+scan_jobs: Dict[str, ScanJob] = {}
+scan_jobs_lock = threading.Lock()
+BACKGROUND_JOBS.labels("scan").set_function(
+    lambda: sum(1 for job in list(scan_jobs.values()) if job.finished_at is None)
+)
+
+
+def scan_shard(engine: DiscoveryEngine, first_ip: int, last_ip: int,
+               job: Optional[ScanJob] = None) -> List[IPStatus]:
+    """Sweep one shard with the discovery engine and persist it in one transaction"""
+    if job:
+        job.check_cancelled()
+    
+    with shard_slots:
+        if job:
+            job.check_cancelled()
+        with SCAN_PHASE_SECONDS.labels("discovery").time():
+            discovered = engine.discover(first_ip, last_ip)
+    
+    for ip, host in discovered.items():
+        print(f"  UP: {ip}" + (f" ({host['vendor']})" if host['vendor'] else ""))
+    
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        with SCAN_PHASE_SECONDS.labels("persist").time():
+            results = persist_scan_results(conn, first_ip, last_ip, discovered)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    grid_cache.apply_results(results)
+    if job:
+        job.shard_finished(last_ip - first_ip + 1, len(discovered))
+    return results
+
+
+class ScanTally:
+    """Running status counts for a scan, also kept per /24 block for scan_history"""
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.blocks = {}  # subnet -> [start_ip, end_ip, total, active]
+        self.lock = threading.Lock()
+
+    def add(self, results: List[IPStatus]):
+        with self.lock:
+            for r in results:
+                self.total += 1
+                self.counts[r.status] = self.counts.get(r.status, 0) + 1
+                subnet, last_octet = r.ip.rsplit('.', 1)
+                last_octet = int(last_octet)
+                block = self.blocks.setdefault(subnet, [last_octet, last_octet, 0, 0])
+                block[0] = min(block[0], last_octet)
+                block[1] = max(block[1], last_octet)
+                block[2] += 1
+                block[3] += r.status == 'up'
+
+    def summary(self, subnet_label: str, scan_time: float) -> ScanSummary:
+        return ScanSummary(
+            subnet=subnet_label,
+            total_ips=self.total,
+            active_ips=self.counts.get('up', 0),
+            inactive_ips=self.counts.get('down', 0),
+            previously_used_ips=self.counts.get('previously_used', 0),
+            reserved_ips=self.counts.get('reserved', 0),
+            scan_time=scan_time
+        )
+
+
+def record_scan_history(tally: ScanTally, scan_duration: float):
+    """Insert one scan_history row per /24 block covered by a scan"""
+    blocks = tally.blocks
+    if not blocks:
+        return
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        params = []
+        for subnet, (start_ip, end_ip, total, active) in blocks.items():
+            params.extend((subnet, start_ip, end_ip, total, active, round(scan_duration, 3)))
+        cursor.execute(f"""
+            INSERT INTO scan_history (subnet, start_ip, end_ip, total_ips, active_ips, scan_duration)
+            VALUES {sql_placeholders(len(blocks), "(%s, %s, %s, %s, %s, %s)")}
+        """, params)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def run_scan(target: ScanTarget, job: Optional[ScanJob] = None, on_shard=None) -> List[IPStatus]:
+    """
+    Scan a target with parallel shards and update database (blocking, runs on scan_executor).
+
+    Without on_shard, results are merged in address order and returned. With
+    on_shard, each shard's results are handed over as soon as the shard is
+    persisted and nothing is accumulated, so memory stays flat for any range.
+    """
+    results = []
+    tally = job.tally if job else ScanTally()
+    scan_started = time.perf_counter()
+    
+    print(f"\n{'='*60}")
+    print(f"Scanning {target.label} with {target.engine.name} "
+          f"({target.size} addresses, shards of {target.shard_size}, {target.max_workers} workers)...")
+    print(f"{'='*60}")
+    
+    if not db_pool.available():
+        print("✗ Database connection failed")
+        # Return empty results if DB is down
+        for first, last in target.shards():
+            shard_results = [
+                IPStatus(ip=str(ipaddress.IPv4Address(address)), status="unknown",
+                         last_scanned=datetime.now().isoformat())
+                for address in range(first, last + 1)
+            ]
+            tally.add(shard_results)
+            if on_shard:
+                on_shard(shard_results)
+            else:
+                results.extend(shard_results)
+        return results
+    
+    if job:
+        job.phase = "scanning"
+    
+    shard_pool = ThreadPoolExecutor(max_workers=target.max_workers, thread_name_prefix="shard")
+    try:
+        futures = [shard_pool.submit(scan_shard, target.engine, first, last, job) for first, last in target.shards()]
+        if on_shard:
+            # Hand shards over in completion order; a failed shard fails the scan
+            for future in as_completed(futures):
+                shard_results = future.result()
+                tally.add(shard_results)
+                on_shard(shard_results)
+        else:
+            # Merge in address order; a failed shard fails the scan
+            for future in futures:
+                shard_results = future.result()
+                tally.add(shard_results)
+                results.extend(shard_results)
+        
+        if job:
+            job.phase = "recording"
+        scan_duration = time.perf_counter() - scan_started
+        with SCAN_PHASE_SECONDS.labels("history").time():
+            record_scan_history(tally, scan_duration)
+        SCAN_SECONDS.labels(target.engine.name).observe(scan_duration)
+        for status, count in tally.counts.items():
+            SCAN_HOSTS.labels(status).inc(count)
+        
+        print(f"Found {tally.counts.get('up', 0)} responding hosts in {target.label}")
+        print(f"{'='*60}\n")
+    
+    except ScanCancelled:
+        print(f"Scan of {target.label} cancelled")
+        raise
+    except Exception as e:
+        print(f"Scan error: {e}")
+        import traceback
+        traceback.print_exc()
+        if job:
+            raise
+    finally:
+        # Drop shards that haven't started if the scan was cancelled or a shard failed
+        shard_pool.shutdown(wait=True, cancel_futures=True)
+    
+    return results
+
+
+def build_scan_response(subnet_label: str, results: List[IPStatus], scan_time: float) -> ScanResponse:
+    """Summarize scan results into a ScanResponse"""
+    tally = ScanTally()
+    tally.add(results)
+    return ScanResponse(**tally.summary(subnet_label, scan_time).model_dump(), results=results)
+
+
+def run_scan_job(job: ScanJob):
+    """Worker entry point for a background scan job"""
+    if job.cancel_event.is_set():
+        job.status = "cancelled"
+        job.finished_at = time.time()
+        return
+    
+    job.status = "running"
+    job.started_at = time.time()
+    try:
+        if job.on_shard:
+            # Streaming jobs keep only the summary
+            run_scan(job.target, job, job.on_shard)
+            job.result = job.tally.summary(job.target.label, time.time() - job.started_at)
+        else:
+            results = run_scan(job.target, job)
+            job.result = build_scan_response(job.target.label, results, time.time() - job.started_at)
+        job.hosts_up = job.result.active_ips
+        job.status = "completed"
+    except ScanCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.phase = "done"
+        job.finished_at = time.time()
+
+
+def prune_scan_jobs():
+    """Drop the oldest finished jobs beyond SCAN_JOB_HISTORY"""
+    with scan_jobs_lock:
+        finished = [j for j in scan_jobs.values() if j.finished_at is not None]
+        finished.sort(key=lambda j: j.finished_at)
+        for job in finished[:max(0, len(finished) - SCAN_JOB_HISTORY)]:
+            del scan_jobs[job.job_id]
+
+
+def submit_scan_job(target: ScanTarget, on_shard=None) -> ScanJob:
+    """Queue a scan on the worker pool and return its job"""
+    prune_scan_jobs()
+    job = ScanJob(target)
+    job.on_shard = on_shard
+    with scan_jobs_lock:
+        scan_jobs[job.job_id] = job
+    job.future = scan_executor.submit(run_scan_job, job)
+    return job
+
+@app.get("/")
+async def root():
+    return {
+        "message": "IP Manager API v2.0", 
+        "features": ["Node tracking", "IP reservation", "History"],
+        "database": "connected" if db_pool.pool is not None else "disconnected"
+    }
+
+@app.get("/health")
+async def health_check():
+    def check():
+        db_status = "connected"
+        try:
+            conn = get_db_connection()
+            if conn:
+                conn.close()
+            else:
+                db_status = "disconnected"
+        except:
+            db_status = "error"
+    
+        return {
+            "status": "healthy", 
+            "timestamp": datetime.now().isoformat(),
+            "database": db_status
+        }
+    
+    return await run_db(check)
+
+@app.post("/api/scan", response_model=ScanResponse)
+async def scan_network(request: ScanRequest, http_request: Request):
+    """Scan network and update node database (compact grid format via Accept header)"""
+    scan_start = datetime.now()
+    target = ScanTarget.from_request(request)
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(scan_executor, run_scan, target)
+    scan_time = (datetime.now() - scan_start).total_seconds()
+    
+    with SCAN_PHASE_SECONDS.labels("serialize").time():
+        if wants_compact_grid(http_request):
+            tally = ScanTally()
+            tally.add(results)
+            return Response(
+                content=encode_scan_results(tally.summary(target.label, scan_time), results),
+                media_type=GRID_MEDIA_TYPE
+            )
+        
+        return Response(
+            content=build_scan_response(target.label, results, scan_time).model_dump_json(),
+            media_type="application/json"
+        )
+
+@app.post("/api/scan/stream")
+async def stream_scan(request: ScanRequest):
+    """
+    Scan network and stream results as Server-Sent Events.
+
+    Emits a 'result' event per address (IPStatus) as soon as its shard is
+    persisted, a 'progress' event after each shard, and a final 'summary'
+    (ScanSummary) or 'error' event. Disconnecting cancels the scan.
+    """
+    target = ScanTarget.from_request(request)
+    loop = asyncio.get_running_loop()
+    # Bounded so a slow client applies back-pressure instead of buffering the whole range
+    queue = asyncio.Queue(maxsize=SCAN_STREAM_BUFFER)
+    job = None
+    
+    def on_shard(shard_results):
+        future = asyncio.run_coroutine_threadsafe(queue.put(shard_results), loop)
+        while True:
+            try:
+                return future.result(timeout=1)
+            except concurrent.futures.TimeoutError:
+                if job.cancel_event.is_set():
+                    future.cancel()
+                    raise ScanCancelled()
+    
+    job = submit_scan_job(target, on_shard=on_shard)
+    
+    def progress_event():
+        return sse_event("progress", json.dumps(job.to_dict(include_result=False)))
+    
+    async def event_stream():
+        done = asyncio.wrap_future(job.future)
+        try:
+            yield sse_event("job", json.dumps({"job_id": job.job_id, "subnet": target.label, "hosts_total": target.size}))
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, done}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    break
+                for result in getter.result():
+                    yield sse_event("result", result.model_dump_json())
+                yield progress_event()
+            
+            while not queue.empty():
+                for result in queue.get_nowait():
+                    yield sse_event("result", result.model_dump_json())
+            
+            if job.status == "completed":
+                yield sse_event("summary", job.result.model_dump_json())
+            else:
+                yield sse_event("error", json.dumps({"status": job.status, "error": job.error}))
+        finally:
+            # Client went away (or we finished) - stop any remaining shards
+            job.cancel_event.set()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/scan/jobs", status_code=202)
+async def create_scan_job(request: ScanRequest):
+    """Submit a scan to run in the background and return its job ID"""
+    job = submit_scan_job(ScanTarget.from_request(request))
+    return job.to_dict()
+
+@app.get("/api/scan/jobs")
+async def list_scan_jobs():
+    """List recent scan jobs without their results"""
+    with scan_jobs_lock:
+        jobs = sorted(scan_jobs.values(), key=lambda j: j.created_at, reverse=True)
+    return {"jobs": [j.to_dict(include_result=False) for j in jobs], "count": len(jobs)}
+
+@app.get("/api/scan/jobs/{job_id}")
+async def get_scan_job(job_id: str):
+    """Get progress of a scan job, including results once completed"""
+    job = scan_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job.to_dict()
+
+@app.delete("/api/scan/jobs/{job_id}")
+async def cancel_scan_job(job_id: str):
+    """Cancel a queued or running scan job"""
+    job = scan_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    
+    if job.finished_at is None:
+        job.cancel_event.set()
+        if job.future and job.future.cancel():
+            # Never started - finish it here since the worker won't run
+            job.status = "cancelled"
+            job.phase = "done"
+            job.finished_at = time.time()
+    
+    return job.to_dict(include_result=False)
+
+# =============================================
+# Adaptive rescan scheduler
+# =============================================
+
+RESCAN_ENABLED = os.getenv("RESCAN_ENABLED", "false").lower() == "true"
+RESCAN_PPS = float(os.getenv("RESCAN_PPS", 20))                   # probe budget, packets per second
+RESCAN_ENGINE = os.getenv("RESCAN_ENGINE", "async")
+RESCAN_MIN_INTERVAL = int(os.getenv("RESCAN_MIN_INTERVAL", 30))         # churning hosts
+RESCAN_ACTIVE_INTERVAL = int(os.getenv("RESCAN_ACTIVE_INTERVAL", 120))  # recently active / reserved-unseen
+RESCAN_STABLE_INTERVAL = int(os.getenv("RESCAN_STABLE_INTERVAL", 900))  # long-stable known hosts
+RESCAN_EMPTY_INTERVAL = int(os.getenv("RESCAN_EMPTY_INTERVAL", 3600))   # never seen
+RESCAN_CHURN_WINDOW_HOURS = int(os.getenv("RESCAN_CHURN_WINDOW_HOURS", 24))
+RESCAN_REFRESH_INTERVAL = int(os.getenv("RESCAN_REFRESH_INTERVAL", 300))  # reload node state from MySQL
+
+
+class RescanScheduler:
+    """
+    Keeps every known /24 fresh by probing addresses at different rates.
+
+    Each address gets a class from nodes/node_history (churning, active,
+    reserved_unseen, stable, empty) that sets its base interval. A probe that
+    sees a change halves the address's interval; a quiet probe relaxes it back
+    toward the class base. Due addresses are drained from a heap within a
+    packets-per-second budget and probed in per-/24 batches.
+    """
+
+    CLASS_INTERVALS = {
+        "churning": RESCAN_MIN_INTERVAL,
+        "active": RESCAN_ACTIVE_INTERVAL,
+        "reserved_unseen": RESCAN_ACTIVE_INTERVAL,
+        "stable": RESCAN_STABLE_INTERVAL,
+        "empty": RESCAN_EMPTY_INTERVAL,
+    }
+
+    def __init__(self, pps: float = RESCAN_PPS, engine_name: str = RESCAN_ENGINE):
+        self.pps = pps
+        self.engine_name = engine_name
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.heap = []          # (due_time, address)
+        self.state = {}         # address -> {"class", "interval", "status", "changes"}
+        self.subnets = set()
+        self.last_refresh = 0.0
+        self.probes_sent = 0
+        self.changes_seen = 0
+        self.batches = 0
+        self.last_error = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="rescan-scheduler", daemon=True)
+        self.thread.start()
+        print(f"✓ Rescan scheduler started ({self.pps} probes/s, {self.engine_name} engine)")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+        self.thread = None
+        print("Rescan scheduler stopped")
+
+    def classify(self, node, churn: int, now: datetime) -> str:
+        """Pick a probe class for one address"""
+        if node is None:
+            return "empty"
+        if churn > 0:
+            return "churning"
+        last_seen = node['last_seen']
+        seen_recently = last_seen is not None and (now - last_seen).total_seconds() < 3600
+        if node['is_reserved'] and (node['status'] != 'up' or not seen_recently):
+            return "reserved_unseen"
+        if node['status'] == 'up':
+            first_seen = node['first_seen']
+            long_lived = first_seen is not None and (now - first_seen).total_seconds() > 86400
+            return "stable" if long_lived else "active"
+        return "active" if seen_recently else "stable"
+
+    def load_churn(self, cursor) -> Dict[str, int]:
+        """Count identity/state changes per address within the churn window"""
+        # node_history holds transitions only, so every row in the window after
+        # a node's first sighting is a change (up/down or hostname/MAC/vendor)
+        cursor.execute("""
+            SELECT h.ip_address, SUM(h.recorded_at > n.first_seen) AS changes
+            FROM node_history h
+            JOIN nodes n ON n.ip_address = h.ip_address
+            WHERE h.recorded_at >= NOW() - INTERVAL %s HOUR
+            GROUP BY h.ip_address
+        """, (RESCAN_CHURN_WINDOW_HOURS,))
+        churn = {row['ip_address']: int(row['changes']) for row in cursor.fetchall()}
+
+        # Hosts that dropped off within the window also count as churn
+        cursor.execute("""
+            SELECT ip_address FROM nodes
+            WHERE status = 'previously_used' AND last_seen >= NOW() - INTERVAL %s HOUR
+        """, (RESCAN_CHURN_WINDOW_HOURS,))
+        for row in cursor.fetchall():
+            churn[row['ip_address']] = churn.get(row['ip_address'], 0) + 1
+        return churn
+
+    def refresh(self):
+        """Reload known subnets and node state, then (re)plan every address"""
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT DISTINCT subnet FROM nodes UNION SELECT DISTINCT subnet FROM scan_history")
+            subnets = {row['subnet'] for row in cursor.fetchall()}
+            cursor.execute("""
+                SELECT ip_address, status, is_reserved, first_seen, last_seen, times_seen
+                FROM nodes
+            """)
+            nodes = {row['ip_address']: row for row in cursor.fetchall()}
+            churn = self.load_churn(cursor)
+            cursor.close()
+        finally:
+            conn.close()
+
+        now = datetime.now()
+        mono = time.monotonic()
+        with self.lock:
+            self.subnets = subnets
+            known = set()
+            for subnet in subnets:
+                try:
+                    base = int(ipaddress.IPv4Address(f"{subnet}.0"))
+                except ValueError:
+                    continue
+                for last_octet in range(256):
+                    address = base + last_octet
+                    ip = f"{subnet}.{last_octet}"
+                    node = nodes.get(ip)
+                    known.add(address)
+                    probe_class = self.classify(node, churn.get(ip, 0), now)
+                    entry = self.state.get(address)
+                    if entry is None:
+                        interval = self.CLASS_INTERVALS[probe_class]
+                        self.state[address] = {
+                            "class": probe_class,
+                            "interval": interval,
+                            "status": node['status'] if node else None,
+                            "changes": 0
+                        }
+                        # Spread first probes over one interval instead of bursting
+                        heapq.heappush(self.heap, (mono + random.uniform(0, interval), address))
+                    else:
+                        entry["class"] = probe_class
+                        entry["interval"] = min(entry["interval"], self.CLASS_INTERVALS[probe_class])
+
+            for address in [a for a in self.state if a not in known]:
+                del self.state[address]
+            self.heap = [(due, a) for due, a in self.heap if a in known]
+            heapq.heapify(self.heap)
+        self.last_refresh = mono
+
+    def take_due(self, limit: int) -> List[int]:
+        """Pop up to limit addresses whose probe is due"""
+        due = []
+        now = time.monotonic()
+        with self.lock:
+            while self.heap and len(due) < limit and self.heap[0][0] <= now:
+                _, address = heapq.heappop(self.heap)
+                if address in self.state:
+                    due.append(address)
+        return due
+
+    def probe(self, addresses: List[int]):
+        """Probe addresses one /24 at a time, persist, and reschedule them"""
+        engine = get_discovery_engine(self.engine_name)
+        blocks = {}
+        for address in sorted(addresses):
+            blocks.setdefault(address >> 8, []).append(address)
+
+        for block_addresses in blocks.values():
+            with shard_slots:
+                discovered = engine.discover_addresses(block_addresses)
+            conn = get_db_connection()
+            if not conn:
+                raise RuntimeError("Database connection failed")
+            try:
+                results = persist_scan_results(
+                    conn, block_addresses[0], block_addresses[-1], discovered, block_addresses
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+            grid_cache.apply_results(results)
+            self.probes_sent += len(block_addresses)
+            self.batches += 1
+            self.reschedule(block_addresses, results)
+
+    def reschedule(self, addresses: List[int], results: List[IPStatus]):
+        mono = time.monotonic()
+        with self.lock:
+            for address, result in zip(addresses, results):
+                entry = self.state.get(address)
+                if entry is None:
+                    continue
+                base = self.CLASS_INTERVALS[entry["class"]]
+                if entry["status"] is not None and result.status != entry["status"]:
+                    entry["interval"] = max(RESCAN_MIN_INTERVAL, entry["interval"] / 2)
+                    entry["changes"] += 1
+                    self.changes_seen += 1
+                else:
+                    entry["interval"] = min(base, entry["interval"] * 1.25)
+                entry["status"] = result.status
+                heapq.heappush(self.heap, (mono + entry["interval"], address))
+
+    def run(self):
+        tokens = 0.0
+        last_tick = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                if time.monotonic() - self.last_refresh > RESCAN_REFRESH_INTERVAL:
+                    self.refresh()
+
+                now = time.monotonic()
+                tokens = min(tokens + (now - last_tick) * self.pps, max(self.pps * 2, 1))
+                last_tick = now
+
+                due = self.take_due(int(tokens))
+                if due:
+                    tokens -= len(due)
+                    self.probe(due)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Rescan scheduler error: {e}")
+                self.stop_event.wait(10)
+            self.stop_event.wait(1)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            classes = {}
+            for entry in self.state.values():
+                classes[entry["class"]] = classes.get(entry["class"], 0) + 1
+            backlog = sum(1 for due, _ in self.heap if due <= now)
+            expected_pps = sum(1 / e["interval"] for e in self.state.values()) if self.state else 0
+        return {
+            "running": self.running,
+            "pps_budget": self.pps,
+            "engine": self.engine_name,
+            "subnets": sorted(self.subnets),
+            "addresses": len(self.state),
+            "classes": classes,
+            "due_backlog": backlog,
+            "planned_pps": round(expected_pps, 2),
+            "probes_sent": self.probes_sent,
+            "changes_seen": self.changes_seen,
+            "batches": self.batches,
+            "last_error": self.last_error
+        }
+
+
+rescan_scheduler = RescanScheduler()
+
+
+class RescanConfigRequest(BaseModel):
+    pps: Optional[float] = None
+    engine: Optional[str] = None
+
+    @validator("pps")
+    def validate_pps(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError("pps must be positive")
+        return v
+
+
+@app.on_event("startup")
+async def start_rescan_scheduler():
+    if RESCAN_ENABLED:
+        rescan_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def stop_rescan_scheduler():
+    if rescan_scheduler.running:
+        rescan_scheduler.stop()
+
+
+@app.get("/api/rescan/status")
+async def get_rescan_status():
+    """Get rescan scheduler state, probe classes and budget usage"""
+    return rescan_scheduler.stats()
+
+
+@app.post("/api/rescan/start")
+async def start_rescan():
+    """Start the background rescan scheduler"""
+    rescan_scheduler.start()
+    return rescan_scheduler.stats()
+
+
+@app.post("/api/rescan/stop")
+async def stop_rescan():
+    """Stop the background rescan scheduler"""
+    await asyncio.get_running_loop().run_in_executor(None, rescan_scheduler.stop)
+    return rescan_scheduler.stats()
+
+
+@app.put("/api/rescan/config")
+async def configure_rescan(request: RescanConfigRequest):
+    """Change the probe budget or engine of the running scheduler"""
+    if request.engine is not None:
+        get_discovery_engine(request.engine)
+        rescan_scheduler.engine_name = request.engine
+    if request.pps is not None:
+        rescan_scheduler.pps = request.pps
+    return rescan_scheduler.stats()
+
+
+# =============================================
+# History retention and availability rollups
+# =============================================
+
+NODE_HISTORY_RETENTION_DAYS = int(os.getenv("NODE_HISTORY_RETENTION_DAYS", 180))
+AVAILABILITY_HOURLY_RETENTION_DAYS = int(os.getenv("AVAILABILITY_HOURLY_RETENTION_DAYS", 30))
+AVAILABILITY_DAILY_RETENTION_DAYS = int(os.getenv("AVAILABILITY_DAILY_RETENTION_DAYS", 730))
+NODE_HISTORY_PARTITIONS_AHEAD = int(os.getenv("NODE_HISTORY_PARTITIONS_AHEAD", 2))
+HISTORY_MAINTENANCE_INTERVAL = int(os.getenv("HISTORY_MAINTENANCE_INTERVAL", 3600))
+
+
+def month_start(year: int, month: int) -> datetime:
+    """First instant of a month, normalizing month overflow"""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1)
+
+
+class HistoryMaintenance:
+    """
+    Keeps node_history and the availability rollups bounded.
+
+    node_history is range-partitioned by month: each pass splits the next
+    NODE_HISTORY_PARTITIONS_AHEAD months off the catch-all pmax partition and
+    drops partitions wholly older than the retention window, which is a
+    metadata operation rather than a row-by-row DELETE. If the table isn't
+    partitioned (migration not applied) retention falls back to DELETE.
+    Daily availability is re-aggregated from the hourly rollup for recent days.
+    """
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_run = None
+        self.last_error = None
+        self.last_result = {}
+
+    def partitions(self, cursor) -> Dict[str, Optional[int]]:
+        """Partition name -> upper bound (epoch seconds, None for MAXVALUE)"""
+        cursor.execute("""
+            SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'node_history' AND PARTITION_NAME IS NOT NULL
+        """)
+        return {
+            name: None if bound == 'MAXVALUE' else int(bound)
+            for name, bound in cursor.fetchall()
+        }
+
+    def ensure_partitions(self, cursor, partitions: Dict[str, Optional[int]]) -> List[str]:
+        """Split upcoming months off pmax so new rows never land in it"""
+        now = datetime.now()
+        highest = max((bound for bound in partitions.values() if bound is not None), default=0)
+        wanted = []
+        for offset in range(NODE_HISTORY_PARTITIONS_AHEAD + 1):
+            start = month_start(now.year, now.month + offset)
+            end = month_start(now.year, now.month + offset + 1)
+            if end.timestamp() > highest:
+                wanted.append((f"p{start:%Y%m}", end))
+        if not wanted:
+            return []
+        cursor.execute(f"""
+            ALTER TABLE node_history REORGANIZE PARTITION pmax INTO (
+                {", ".join(f"PARTITION {name} VALUES LESS THAN (UNIX_TIMESTAMP('{end:%Y-%m-%d %H:%M:%S}'))"
+                           for name, end in wanted)},
+                PARTITION pmax VALUES LESS THAN MAXVALUE
+            )
+        """)
+        return [name for name, _ in wanted]
+
+    def drop_expired_partitions(self, cursor, partitions: Dict[str, Optional[int]]) -> List[str]:
+        cutoff = time.time() - NODE_HISTORY_RETENTION_DAYS * 86400
+        expired = [name for name, bound in partitions.items() if bound is not None and bound <= cutoff]
+        if expired:
+            cursor.execute(f"ALTER TABLE node_history DROP PARTITION {', '.join(expired)}")
+        return expired
+
+    def rollup_daily(self, cursor, days: int = 2) -> int:
+        """Recompute the daily rollup for the last few days from the hourly one"""
+        cursor.execute("""
+            INSERT INTO node_availability_daily (ip_address, bucket, observations, up_observations)
+            SELECT ip_address, DATE(bucket), SUM(observations), SUM(up_observations)
+            FROM node_availability_hourly
+            WHERE bucket >= CURDATE() - INTERVAL %s DAY
+            GROUP BY ip_address, DATE(bucket)
+            ON DUPLICATE KEY UPDATE
+                observations = VALUES(observations), up_observations = VALUES(up_observations)
+        """, (days - 1,))
+        return cursor.rowcount
+
+    def run_once(self) -> dict:
+        """One maintenance pass (blocking)"""
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        result = {}
+        try:
+            cursor = conn.cursor()
+            partitions = self.partitions(cursor)
+            if partitions:
+                result["partitions_added"] = self.ensure_partitions(cursor, partitions)
+                result["partitions_dropped"] = self.drop_expired_partitions(cursor, partitions)
+            else:
+                cursor.execute(
+                    "DELETE FROM node_history WHERE recorded_at < NOW() - INTERVAL %s DAY",
+                    (NODE_HISTORY_RETENTION_DAYS,)
+                )
+                result["history_rows_deleted"] = cursor.rowcount
+            
+            result["daily_rows_upserted"] = self.rollup_daily(cursor)
+            cursor.execute("DELETE FROM node_availability_hourly WHERE bucket < NOW() - INTERVAL %s DAY",
+                           (AVAILABILITY_HOURLY_RETENTION_DAYS,))
+            result["hourly_rows_deleted"] = cursor.rowcount
+            cursor.execute("DELETE FROM node_availability_daily WHERE bucket < CURDATE() - INTERVAL %s DAY",
+                           (AVAILABILITY_DAILY_RETENTION_DAYS,))
+            result["daily_rows_deleted"] = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        
+        self.last_run = time.time()
+        self.last_result = result
+        self.last_error = None
+        return result
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                result = self.run_once()
+                print(f"✓ History maintenance: {result}")
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"History maintenance failed: {e}")
+            self.stop_event.wait(HISTORY_MAINTENANCE_INTERVAL)
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="history-maintenance", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self) -> dict:
+        return {
+            "last_run": self.last_run,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "interval": HISTORY_MAINTENANCE_INTERVAL,
+            "retention_days": {
+                "node_history": NODE_HISTORY_RETENTION_DAYS,
+                "availability_hourly": AVAILABILITY_HOURLY_RETENTION_DAYS,
+                "availability_daily": AVAILABILITY_DAILY_RETENTION_DAYS
+            }
+        }
+
+
+history_maintenance = HistoryMaintenance()
+
+
+@app.on_event("startup")
+async def start_history_maintenance():
+    # Runs even if MySQL is down now; each pass reconnects through the pool
+    history_maintenance.start()
+
+
+@app.on_event("shutdown")
+async def stop_history_maintenance():
+    history_maintenance.stop()
+
+
+@app.get("/api/history/maintenance")
+async def get_history_maintenance():
+    """Get retention settings and the last maintenance pass"""
+    return history_maintenance.stats()
+
+
+@app.post("/api/history/maintenance")
+async def run_history_maintenance():
+    """Run partition rotation, retention and the daily rollup now"""
+    try:
+        return await run_db(history_maintenance.run_once)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"History maintenance failed: {str(e)}")
+
+
+# =============================================
+# Bulk node operations
+# =============================================
+
+BULK_MAX_ADDRESSES = int(os.getenv("BULK_MAX_ADDRESSES", 4096))
+
+
+class BulkTargetRequest(BaseModel):
+    ips: List[str] = []
+    cidrs: List[str] = []     # network and broadcast addresses are skipped below /31
+
+    @validator('cidrs', always=True)
+    def require_targets(cls, cidrs, values):
+        if not cidrs and not values.get('ips'):
+            raise ValueError('ips or cidrs required')
+        return cidrs
+
+    def addresses(self) -> List[str]:
+        """Unique addresses in numeric order"""
+        numbers = set()
+        try:
+            for ip in self.ips:
+                numbers.add(int(ipaddress.IPv4Address(ip)))
+            for cidr in self.cidrs:
+                network = ipaddress.IPv4Network(cidr, strict=False)
+                if network.num_addresses > BULK_MAX_ADDRESSES:
+                    raise HTTPException(status_code=400, detail=f"{cidr} is larger than {BULK_MAX_ADDRESSES} addresses")
+                numbers.update(int(host) for host in network.hosts())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if len(numbers) > BULK_MAX_ADDRESSES:
+            raise HTTPException(status_code=400, detail=f"Too many addresses ({len(numbers)} > {BULK_MAX_ADDRESSES})")
+        return [str(ipaddress.IPv4Address(number)) for number in sorted(numbers)]
+
+
+class BulkReserveRequest(BulkTargetRequest):
+    reserved_for: str
+    description: Optional[str] = None
+    reserved_by: Optional[str] = None
+    force: bool = False       # also reserve addresses that are currently up
+
+
+class BulkUpdateRequest(BulkTargetRequest):
+    notes: Optional[str] = None
+    is_reserved: Optional[bool] = None
+
+
+def lock_node_rows(cursor, ips: List[str]) -> Dict[str, dict]:
+    """SELECT ... FOR UPDATE the nodes rows of ips, keyed by address"""
+    cursor.execute(f"""
+        SELECT ip_address, status, is_reserved FROM nodes
+        WHERE ip_num IN ({sql_placeholders(len(ips))})
+        FOR UPDATE
+    """, [int(ipaddress.IPv4Address(ip)) for ip in ips])
+    return {row['ip_address']: row for row in cursor.fetchall()}
+
+
+def lock_active_reservations(cursor, ips: List[str]) -> set:
+    """SELECT ... FOR UPDATE the active ip_reservations of ips; returns the addresses that have one"""
+    cursor.execute(f"""
+        SELECT DISTINCT ip_address FROM ip_reservations
+        WHERE ip_num IN ({sql_placeholders(len(ips))}) AND is_active = TRUE
+        FOR UPDATE
+    """, [int(ipaddress.IPv4Address(ip)) for ip in ips])
+    return {row['ip_address'] for row in cursor.fetchall()}
+
+
+def bulk_transaction(work):
+    """Run work(cursor) in one transaction and return its result (blocking)"""
+    conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection failed")
-    
     try:
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE nodes 
-            SET status = 'down', is_reserved = FALSE, 
-                reserved_by = NULL, reserved_at = NULL
-            WHERE ip_address = %s
-        """, (ip,))
-        
-        cursor.execute("""
-            UPDATE ip_reservations 
-            SET is_active = FALSE
-            WHERE ip_address = %s AND is_active = TRUE
-        """, (ip,))
-        
+        conn.start_transaction()
+        cursor = conn.cursor(dictionary=True)
+        result = work(cursor)
         conn.commit()
         cursor.close()
-        
-        return {"status": "success", "message": f"IP {ip} released"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return result
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
 
-@app.put("/api/node/update")
-async def update_node(request: UpdateNodeRequest):
-    """Update node information"""
+
+def bulk_reserve(ips: List[str], request: BulkReserveRequest) -> Dict[str, str]:
+    """
+    Reserve addresses, creating missing nodes rows (blocking).
+
+    Outcome per address: reserved, created (no nodes row before),
+    already_reserved (flagged in nodes or holding an active reservation),
+    or in_use (up and not forced; left untouched).
+    """
+    def work(cursor):
+        rows = lock_node_rows(cursor, ips)
+        held = lock_active_reservations(cursor, ips)
+        outcomes = {}
+        for ip in ips:
+            row = rows.get(ip)
+            if ip in held or (row is not None and row['is_reserved']):
+                outcomes[ip] = "already_reserved"
+            elif row is None:
+                outcomes[ip] = "created"
+            elif row['status'] == 'up' and not request.force:
+                outcomes[ip] = "in_use"
+            else:
+                outcomes[ip] = "reserved"
+        
+        targets = [ip for ip in ips if outcomes[ip] in ("reserved", "created")]
+        if targets:
+            node_params = []
+            for ip in targets:
+                subnet, last_octet = ip.rsplit('.', 1)
+                node_params.extend((ip, subnet, int(last_octet), request.description, request.reserved_by))
+            cursor.execute(f"""
+                INSERT INTO nodes (ip_address, subnet, last_octet, status, is_reserved, notes,
+                                   reserved_by, reserved_at, times_seen)
+                VALUES {sql_placeholders(len(targets), "(%s, %s, %s, 'reserved', TRUE, %s, %s, NOW(), 0)")}
+                ON DUPLICATE KEY UPDATE
+                    status = 'reserved', is_reserved = TRUE, notes = VALUES(notes),
+                    reserved_by = VALUES(reserved_by), reserved_at = NOW()
+            """, node_params)
+            cursor.execute(f"""
+                INSERT INTO ip_reservations (ip_address, reserved_for, description, reserved_by)
+                VALUES {sql_placeholders(len(targets), "(%s, %s, %s, %s)")}
+            """, [value for ip in targets
+                  for value in (ip, request.reserved_for, request.description, request.reserved_by)])
+        return outcomes, targets
+    
+    outcomes, targets = bulk_transaction(work)
+    grid_cache.patch_many(targets, status='reserved', is_reserved=True)
+    return outcomes
+
+
+def active_reservation(ip: str) -> Optional[dict]:
+    """Latest active ip_reservations row for ip, or None when only nodes flags it (blocking)"""
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database connection failed")
-    
     try:
-        cursor = conn.cursor()
-        
-        if request.notes is not None:
-            cursor.execute("""
-                UPDATE nodes SET notes = %s WHERE ip_address = %s
-            """, (request.notes, request.ip))
-        
-        if request.is_reserved is not None:
-            status = 'reserved' if request.is_reserved else 'down'
-            cursor.execute("""
-                UPDATE nodes 
-                SET is_reserved = %s, status = %s
-                WHERE ip_address = %s
-            """, (request.is_reserved, status, request.ip))
-        
-        conn.commit()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, ip_address, reserved_for, description, reserved_by, reserved_at, expires_at
+            FROM ip_reservations
+            WHERE ip_num = %s AND is_active = TRUE
+            ORDER BY reserved_at DESC, id DESC
+            LIMIT 1
+        """, (int(ipaddress.IPv4Address(ip)),))
+        row = cursor.fetchone()
         cursor.close()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    for column in ("reserved_at", "expires_at"):
+        row[column] = row[column].isoformat() if row[column] else None
+    return row
+
+
+def bulk_release(ips: List[str]) -> Dict[str, str]:
+    """
+    Release addresses (blocking).
+
+    Reserved nodes rows go back to 'down' and every active reservation of
+    the addresses is deactivated, including reservations recorded without
+    a nodes row. Outcome: released (something changed in either table),
+    not_reserved, or not_found (no nodes row and no reservation).
+    """
+    def work(cursor):
+        rows = lock_node_rows(cursor, ips)
+        held = lock_active_reservations(cursor, ips)
+        reserved_nodes = [ip for ip in ips
+                          if ip in rows and (rows[ip]['is_reserved'] or rows[ip]['status'] == 'reserved')]
+        if reserved_nodes:
+            numbers = [int(ipaddress.IPv4Address(ip)) for ip in reserved_nodes]
+            cursor.execute(f"""
+                UPDATE nodes
+                SET status = 'down', is_reserved = FALSE,
+                    reserved_by = NULL, reserved_at = NULL
+                WHERE ip_num IN ({sql_placeholders(len(numbers))})
+            """, numbers)
+        cursor.execute(f"""
+            UPDATE ip_reservations
+            SET is_active = FALSE
+            WHERE ip_num IN ({sql_placeholders(len(ips))}) AND is_active = TRUE
+        """, [int(ipaddress.IPv4Address(ip)) for ip in ips])
         
-        return {"status": "success", "message": "Node updated"}
+        outcomes = {}
+        for ip in ips:
+            if ip in held or ip in reserved_nodes:
+                outcomes[ip] = "released"
+            else:
+                outcomes[ip] = "not_reserved" if ip in rows else "not_found"
+        return outcomes, reserved_nodes, held
+    
+    outcomes, reserved_nodes, held = bulk_transaction(work)
+    grid_cache.patch_many(reserved_nodes, status='down', is_reserved=False)
+    grid_cache.patch_many(sorted(held - set(reserved_nodes)), is_reserved=False)
+    return outcomes
+
+
+def bulk_update(ips: List[str], request: BulkUpdateRequest) -> Dict[str, str]:
+    """Set notes and/or the reserved flag on existing nodes (blocking). Outcome: updated or not_found"""
+    status = None
+    if request.is_reserved is not None:
+        status = 'reserved' if request.is_reserved else 'down'
+    
+    def work(cursor):
+        rows = lock_node_rows(cursor, ips)
+        targets = [ip for ip in ips if ip in rows]
+        assignments, params = [], []
+        if request.notes is not None:
+            assignments.append("notes = %s")
+            params.append(request.notes)
+        if status is not None:
+            assignments.append("is_reserved = %s, status = %s")
+            params.extend((request.is_reserved, status))
+        if targets and assignments:
+            cursor.execute(f"""
+                UPDATE nodes SET {', '.join(assignments)}
+                WHERE ip_num IN ({sql_placeholders(len(targets))})
+            """, params + [int(ipaddress.IPv4Address(ip)) for ip in targets])
+        return {ip: "updated" if ip in rows else "not_found" for ip in ips}, targets
+    
+    outcomes, targets = bulk_transaction(work)
+    if status is not None:
+        grid_cache.patch_many(targets, status=status, is_reserved=request.is_reserved)
+    return outcomes
+
+
+def bulk_response(outcomes: Dict[str, str]) -> dict:
+    counts = {}
+    for outcome in outcomes.values():
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return {"total": len(outcomes), "counts": counts, "results": outcomes}
+
+
+@app.post("/api/bulk/reserve")
+async def bulk_reserve_ips(request: BulkReserveRequest):
+    """Reserve a list of IPs and/or CIDR ranges in one transaction"""
+    return bulk_response(await run_db(bulk_reserve, request.addresses(), request))
+
+
+@app.post("/api/bulk/release")
+async def bulk_release_ips(request: BulkTargetRequest):
+    """Release a list of IPs and/or CIDR ranges in one transaction"""
+    return bulk_response(await run_db(bulk_release, request.addresses()))
+
+
+@app.put("/api/bulk/update")
+async def bulk_update_nodes(request: BulkUpdateRequest):
+    """Update notes and/or reservation flag for a list of IPs and/or CIDR ranges in one transaction"""
+    if request.notes is None and request.is_reserved is None:
+        raise HTTPException(status_code=400, detail="notes or is_reserved required")
+    return bulk_response(await run_db(bulk_update, request.addresses(), request))
+
+
+@app.post("/api/reserve")
+async def reserve_ip(request: ReserveIPRequest):
+    """Reserve an IP address"""
+    bulk_request = BulkReserveRequest(ips=[request.ip], reserved_for=request.reserved_for,
+                                      description=request.description, reserved_by=request.reserved_by,
+                                      force=True)
+    try:
+        outcome = (await run_db(bulk_reserve, bulk_request.addresses(), bulk_request))[request.ip]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+    
+    if outcome == "already_reserved":
+        # Idempotent for retrying clients: hand back the reservation that already holds it
+        reservation = await run_db(active_reservation, request.ip)
+        return {"status": "success", "message": f"IP {request.ip} already reserved",
+                "outcome": outcome, "reservation": reservation}
+    return {"status": "success", "message": f"IP {request.ip} reserved", "outcome": outcome}
+
+@app.post("/api/release/{ip}")
+async def release_ip(ip: str):
+    """Release a reserved IP"""
+    try:
+        outcome = (await run_db(bulk_release, BulkTargetRequest(ips=[ip]).addresses()))[ip]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {"status": "success", "message": f"IP {ip} released", "outcome": outcome}
+
+NODE_QUERY_MAX = 4096
+
+@app.get("/api/nodes")
+async def query_nodes(cidr: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                      status: Optional[str] = None, after: Optional[str] = None, limit: int = 256):
+    """
+    List known nodes in a CIDR or an inclusive start-end range, in address order.
+
+    Answered from the numeric ip_num index as a range scan. Page with
+    after=<last ip of the previous page>.
+    """
+    try:
+        if cidr:
+            first_ip, last_ip = subnet_bounds(cidr)
+        elif start and end:
+            first_ip, last_ip = int(ipaddress.IPv4Address(start)), int(ipaddress.IPv4Address(end))
+        else:
+            raise HTTPException(status_code=400, detail="Provide cidr or start and end")
+        if after:
+            first_ip = max(first_ip, int(ipaddress.IPv4Address(after)) + 1)
+    except ipaddress.AddressValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if status and status not in GRID_STATUS_CODES:
+        raise HTTPException(status_code=400, detail=f"Unknown status: {status}")
+    if not 1 <= limit <= NODE_QUERY_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be 1-{NODE_QUERY_MAX}")
+    
+    def load():
+        conn = get_db_connection()
+        if not conn:
+            raise HTTPException(status_code=500, detail="Database connection failed")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            # (status, ip_num) serves the filtered form, the unique ip_num index the plain one
+            status_filter = "status = %s AND " if status else ""
+            cursor.execute(f"""
+                SELECT ip_address, status, hostname, mac_address, vendor, first_seen, last_seen,
+                       last_scanned, times_seen, notes, is_reserved
+                FROM nodes
+                WHERE {status_filter}ip_num BETWEEN %s AND %s
+                ORDER BY ip_num
+                LIMIT %s
+            """, ((status,) if status else ()) + (first_ip, last_ip, limit + 1))
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+    
+    rows = await run_db(load)
+    more = len(rows) > limit
+    nodes = [node_to_ip_status(row) for row in rows[:limit]]
+    return {
+        "start": str(ipaddress.IPv4Address(first_ip)),
+        "end": str(ipaddress.IPv4Address(last_ip)),
+        "count": len(nodes),
+        "nodes": nodes,
+        "next": nodes[-1].ip if more else None
+    }
+
+@app.put("/api/node/update")
+async def update_node(request: UpdateNodeRequest):
+    """Update node information"""
+    bulk_request = BulkUpdateRequest(ips=[request.ip], notes=request.notes, is_reserved=request.is_reserved)
+    try:
+        outcome = (await run_db(bulk_update, bulk_request.addresses(), bulk_request))[request.ip]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {"status": "success", "message": "Node updated", "outcome": outcome}
+
+@app.get("/api/subnet/{subnet}/grid")
+async def get_subnet_grid(subnet: str, http_request: Request):
+    """
+    Get a /24's per-address state from the in-memory grid cache.
+
+    status holds one code per last octet (see legend), reserved lists reserved
+    last octets and last_seen holds epoch seconds (0 = never seen).
+    Also available in the compact grid format via the Accept header.
+    """
+    if len(subnet.split(".")) != 3:
+        raise HTTPException(status_code=400, detail="Subnet must be x.x.x")
+    
+    grid = grid_cache.peek(subnet)
+    cache = "hit"
+    if grid is None:
+        cache = "miss"
+        grid = await run_db(grid_cache.load, subnet)
+    
+    if wants_compact_grid(http_request):
+        return Response(
+            content=encode_subnet_grid(subnet, grid),
+            media_type=GRID_MEDIA_TYPE,
+            headers={"X-Grid-Cache": cache}
+        )
+    
+    return {
+        "subnet": subnet,
+        "cache": cache,
+        "legend": GRID_STATUS_NAMES,
+        "status": list(grid.status),
+        "reserved": [octet for octet in range(256) if grid.is_reserved(octet)],
+        "last_seen": grid.last_seen.tolist(),
+        "vms": proxmox_inventory.owners_in_subnet(subnet)
+    }
+
+# =============================================
+# Free-address allocation
+# =============================================
+
+ALLOCATE_QUIET_HOURS = float(os.getenv("ALLOCATE_QUIET_HOURS", 24))
+# Network, gateway and broadcast by default
+ALLOCATE_EXCLUDE_OCTETS = [int(octet) for octet in os.getenv("ALLOCATE_EXCLUDE_OCTETS", "0,1,255").split(",") if octet.strip()]
+ALLOCATE_MAX_COUNT = 254
+ALLOCATE_ATTEMPTS = 3
+MYSQL_DEADLOCK = 1213
+
+
+class AllocateRequest(BaseModel):
+    reserved_for: str = "allocation"
+    description: Optional[str] = None
+    reserved_by: Optional[str] = None
+
+
+class AddressAllocator:
+    """
+    Hands out free addresses from a /24 without scanning nodes.
+
+    Candidates come from a free bitmap derived from the cached SubnetGrid,
+    which scans, reservations and node updates already keep in sync. A
+    per-subnet lock serializes allocators in this process; inside the
+    transaction the candidate rows are re-checked with SELECT ... FOR UPDATE
+    (locking the index gaps of rows that don't exist yet), so concurrent
+    allocators in other processes can't take the same address either.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subnet_locks: Dict[str, threading.Lock] = {}
+        self.allocated = 0
+        self.conflicts = 0
+
+    def subnet_lock(self, subnet: str) -> threading.Lock:
+        with self.lock:
+            return self.subnet_locks.setdefault(subnet, threading.Lock())
+
+    @staticmethod
+    def free_bitmap(grid: SubnetGrid, quiet_before: float) -> int:
+        """Bit n set = last octet n is free (not up, not reserved, quiet since quiet_before)"""
+        bitmap = 0
+        up = GRID_STATUS_CODES['up']
+        reserved = GRID_STATUS_CODES['reserved']
+        for octet in range(256):
+            if grid.status[octet] in (up, reserved) or grid.is_reserved(octet):
+                continue
+            if grid.last_seen[octet] > quiet_before:
+                continue
+            bitmap |= 1 << octet
+        for octet in ALLOCATE_EXCLUDE_OCTETS:
+            bitmap &= ~(1 << octet)
+        return bitmap
+
+    @staticmethod
+    def pick(bitmap: int, count: int, contiguous: bool) -> List[int]:
+        """Lowest free octets, or the first run of count consecutive ones"""
+        if contiguous:
+            run = (1 << count) - 1
+            for start in range(257 - count):
+                if (bitmap >> start) & run == run:
+                    return list(range(start, start + count))
+            return []
+        octets = []
+        while bitmap and len(octets) < count:
+            lowest = bitmap & -bitmap
+            octets.append(lowest.bit_length() - 1)
+            bitmap ^= lowest
+        return octets if len(octets) == count else []
+
+    def reserve(self, subnet: str, octets: List[int], quiet_before: float,
+                request: AllocateRequest) -> List[int]:
+        """
+        Re-check and reserve candidates in one transaction.
+
+        Returns the octets that turned out not to be free (nothing is written
+        then), or an empty list once all of them are reserved.
+        """
+        ips = [f"{subnet}.{octet}" for octet in octets]
+        numbers = [int(ipaddress.IPv4Address(ip)) for ip in ips]
+        conn = get_db_connection()
+        if not conn:
+            raise HTTPException(status_code=500, detail="Database connection failed")
+        try:
+            conn.start_transaction()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT ip_address, last_octet, status, is_reserved, last_seen FROM nodes
+                WHERE ip_num IN ({sql_placeholders(len(ips))})
+                FOR UPDATE
+            """, numbers)
+            taken = []
+            for row in cursor.fetchall():
+                last_seen = row['last_seen'].timestamp() if row['last_seen'] else 0
+                if row['status'] in ('up', 'reserved') or row['is_reserved'] or last_seen > quiet_before:
+                    taken.append(row)
+            held = sorted(lock_active_reservations(cursor, ips))
+            if taken or held:
+                conn.rollback()
+                for row in taken:
+                    grid_cache.patch(row['ip_address'], status=row['status'],
+                                     is_reserved=bool(row['is_reserved']), last_seen=row['last_seen'])
+                grid_cache.patch_many(held, is_reserved=True)
+                return [row['last_octet'] for row in taken] + [int(ip.rsplit('.', 1)[1]) for ip in held]
+            
+            note = request.description or f"Allocated for {request.reserved_for}"
+            cursor.execute(f"""
+                INSERT INTO nodes (ip_address, subnet, last_octet, status, is_reserved, notes,
+                                   reserved_by, reserved_at, times_seen)
+                VALUES {sql_placeholders(len(ips), "(%s, %s, %s, 'reserved', TRUE, %s, %s, NOW(), 0)")}
+                ON DUPLICATE KEY UPDATE
+                    status = 'reserved', is_reserved = TRUE, notes = VALUES(notes),
+                    reserved_by = VALUES(reserved_by), reserved_at = NOW()
+            """, [value for ip, octet in zip(ips, octets)
+                  for value in (ip, subnet, octet, note, request.reserved_by)])
+            cursor.execute(f"""
+                INSERT INTO ip_reservations (ip_address, reserved_for, description, reserved_by)
+                VALUES {sql_placeholders(len(ips), "(%s, %s, %s, %s)")}
+            """, [value for ip in ips
+                  for value in (ip, request.reserved_for, request.description, request.reserved_by)])
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        grid_cache.patch_many(ips, status='reserved', is_reserved=True)
+        return []
+
+    def allocate(self, subnet: str, count: int, request: AllocateRequest,
+                 quiet_hours: float = ALLOCATE_QUIET_HOURS, contiguous: bool = False) -> List[str]:
+        """Reserve count free addresses in a /24 and return them (blocking)"""
+        quiet_before = time.time() - quiet_hours * 3600
+        with self.subnet_lock(subnet):
+            skip = 0
+            for attempt in range(ALLOCATE_ATTEMPTS):
+                bitmap = self.free_bitmap(grid_cache.get(subnet), quiet_before) & ~skip
+                octets = self.pick(bitmap, count, contiguous)
+                if not octets:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"Only {bin(bitmap).count('1')} free addresses in {subnet}, "
+                               f"{count}{' contiguous' if contiguous else ''} requested"
+                    )
+                try:
+                    taken = self.reserve(subnet, octets, quiet_before, request)
+                except mysql.connector.Error as e:
+                    if e.errno != MYSQL_DEADLOCK:
+                        raise
+                    self.conflicts += 1  # lost a gap-lock race with another process; pick again
+                    continue
+                if not taken:
+                    self.allocated += count
+                    return [f"{subnet}.{octet}" for octet in octets]
+                # The cache was stale for these; it has been patched, but skip them
+                # explicitly in case the grid isn't cached
+                self.conflicts += 1
+                for octet in taken:
+                    skip |= 1 << octet
+        raise HTTPException(status_code=409, detail=f"Could not allocate {count} addresses in {subnet}, try again")
+
+
+address_allocator = AddressAllocator()
+
+
+@app.post("/api/subnet/{subnet}/allocate")
+async def allocate_addresses(subnet: str, count: int = 1, contiguous: bool = False,
+                             quiet_hours: float = ALLOCATE_QUIET_HOURS,
+                             request: Optional[AllocateRequest] = None):
+    """
+    Reserve count free addresses in a /24 atomically and return them.
+
+    Free means not up, not reserved and not seen for quiet_hours. Each
+    address gets an ip_reservations row in the same transaction.
+    """
+    if len(subnet.split(".")) != 3:
+        raise HTTPException(status_code=400, detail="Subnet must be x.x.x")
+    subnet_bounds(subnet)
+    if not 1 <= count <= ALLOCATE_MAX_COUNT:
+        raise HTTPException(status_code=400, detail=f"count must be 1-{ALLOCATE_MAX_COUNT}")
+    if quiet_hours < 0:
+        raise HTTPException(status_code=400, detail="quiet_hours must be >= 0")
+    
+    ips = await run_db(
+        address_allocator.allocate, subnet, count, request or AllocateRequest(), quiet_hours, contiguous
+    )
+    return {"subnet": subnet, "count": len(ips), "ip_addresses": ips}
+
+
+@app.get("/api/cache/grid/stats")
+async def get_grid_cache_stats():
+    """Get grid cache hit/miss counters"""
+    return grid_cache.stats()
+
+class PrometheusTargetsRequest(BaseModel):
+    ip_addresses: List[str]
+    groups: List[str] = ["nodes"]
+
+    @validator('groups')
+    def validate_groups(cls, v):
+        unknown = [group for group in v if group not in PROMETHEUS_TARGET_GROUPS]
+        if unknown:
+            raise ValueError(f"Unknown target groups: {', '.join(unknown)}")
+        return v
+
+@app.get("/api/prometheus/targets")
+async def get_prometheus_targets():
+    """List registered Prometheus file_sd targets"""
+    return prometheus_targets.stats()
+
+@app.post("/api/prometheus/targets")
+async def register_prometheus_targets(request: PrometheusTargetsRequest):
+    """Add targets; the files are written once the debounce window closes"""
+    return {"added": prometheus_targets.add(request.ip_addresses, request.groups)}
+
+@app.delete("/api/prometheus/targets/{ip}")
+async def remove_prometheus_target(ip: str):
+    """Remove an IP from every target group"""
+    return {"removed": prometheus_targets.remove([ip])}
+
+@app.on_event("shutdown")
+async def flush_prometheus_targets():
+    prometheus_targets.shutdown()
 
 @app.get("/api/node/{ip}")
 async def get_node(ip: str):
     """Get detailed node information including history"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=404, detail="Database unavailable")
+    def load():
+        conn = get_db_connection()
+        if not conn:
+            raise HTTPException(status_code=404, detail="Database unavailable")
     
-    try:
-        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor = conn.cursor(dictionary=True)
         
-        # Get node info
-        cursor.execute("SELECT * FROM nodes WHERE ip_address = %s", (ip,))
-        node = cursor.fetchone()
+            # Get node info
+            cursor.execute("SELECT * FROM nodes WHERE ip_address = %s", (ip,))
+            node = cursor.fetchone()
         
-        if not node:
-            raise HTTPException(status_code=404, detail="Node not found")
+            if not node:
+                raise HTTPException(status_code=404, detail="Node not found")
+            node.pop('ip_bin', None)
         
-        # Get history
-        cursor.execute("""
-            SELECT * FROM node_history 
-            WHERE ip_address = %s 
-            ORDER BY recorded_at DESC 
-            LIMIT 10
-        """, (ip,))
-        history = cursor.fetchall()
+            # Get history
+            cursor.execute("""
+                SELECT * FROM node_history 
+                WHERE ip_address = %s 
+                ORDER BY recorded_at DESC 
+                LIMIT 10
+            """, (ip,))
+            history = cursor.fetchall()
         
-        cursor.close()
+            cursor.close()
+        
+            return {
+                "node": node,
+                "history": history,
+                "vm": proxmox_inventory.owner(ip, node['mac_address'])
+            }
+        finally:
+            conn.close()
+    
+    return await run_db(load)
+
+@app.get("/api/node/{ip}/availability")
+async def get_node_availability(ip: str, granularity: str = "hourly", days: int = 7):
+    """Get a node's availability (share of scans that found it up) per hour or day"""
+    if granularity not in ("hourly", "daily"):
+        raise HTTPException(status_code=400, detail="granularity must be hourly or daily")
+    if not 1 <= days <= AVAILABILITY_DAILY_RETENTION_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be 1-{AVAILABILITY_DAILY_RETENTION_DAYS}")
+    
+    def load():
+        conn = get_db_connection()
+        if not conn:
+            raise HTTPException(status_code=500, detail="Database connection failed")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT bucket, observations, up_observations
+                FROM node_availability_{granularity}
+                WHERE ip_address = %s AND bucket >= NOW() - INTERVAL %s DAY
+                ORDER BY bucket
+            """, (ip, days))
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+    
+    rows = await run_db(load)
+    observations = sum(row['observations'] for row in rows)
+    up_observations = sum(row['up_observations'] for row in rows)
+    for row in rows:
+        row['availability'] = round(row['up_observations'] / row['observations'] * 100, 2) if row['observations'] else None
+    return {
+        "ip": ip,
+        "granularity": granularity,
+        "days": days,
+        "availability": round(up_observations / observations * 100, 2) if observations else None,
+        "buckets": rows
+    }
+
+# =============================================
+# Network discovery
+# =============================================
+
+NETWORK_CACHE_TTL = int(os.getenv("NETWORK_CACHE_TTL", 300))  # fallback when change notifications are unavailable
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTM_GETADDR = 22
+RTM_NEWADDR = 20
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+NLMSG_HEADER = struct.Struct("=LHHLL")   # length, type, flags, sequence, port id
+IFADDRMSG = struct.Struct("=BBBBi")      # family, prefix length, flags, scope, interface index
+RTATTR = struct.Struct("=HH")            # length, type
+
+
+def netlink_ipv4_addresses() -> List[tuple]:
+    """Dump (interface, address, prefix) for every IPv4 address via an RTM_GETADDR netlink request"""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.settimeout(2)
+        sock.bind((0, 0))
+        request = IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), RTM_GETADDR,
+                                    NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + request)
+        addresses = []
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if msg_type == NLMSG_DONE:
+                    return addresses
+                if msg_type == NLMSG_ERROR:
+                    raise OSError("netlink RTM_GETADDR failed")
+                if msg_type == RTM_NEWADDR:
+                    family, prefix, _, _, index = IFADDRMSG.unpack_from(data, offset + NLMSG_HEADER.size)
+                    attributes = {}
+                    attr = offset + NLMSG_HEADER.size + IFADDRMSG.size
+                    while attr + RTATTR.size <= offset + length:
+                        attr_length, attr_type = RTATTR.unpack_from(data, attr)
+                        if attr_length < RTATTR.size:
+                            break
+                        attributes[attr_type] = data[attr + RTATTR.size:attr + attr_length]
+                        attr += (attr_length + 3) & ~3
+                    # IFA_ADDRESS is the peer on point-to-point links; IFA_LOCAL is ours
+                    address = attributes.get(IFA_LOCAL) or attributes.get(IFA_ADDRESS)
+                    if family == socket.AF_INET and address:
+                        addresses.append((socket.if_indextoname(index), socket.inet_ntoa(address), prefix))
+                offset += (length + 3) & ~3
+    finally:
+        sock.close()
+
+
+def default_gateway() -> Optional[tuple]:
+    """(interface, gateway) of the lowest-metric IPv4 default route, from /proc/net/route"""
+    best = None
+    try:
+        with open("/proc/net/route") as routes:
+            next(routes)
+            for line in routes:
+                fields = line.split()
+                if len(fields) < 8 or fields[1] != "00000000" or fields[7] != "00000000":
+                    continue
+                metric = int(fields[6])
+                if best is None or metric < best[0]:
+                    gateway = socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
+                    best = (metric, fields[0], gateway)
+    except (OSError, StopIteration):
+        return None
+    return best[1:] if best else None
+
+
+class NetworkDiscovery:
+    """
+    Cached view of the host's IPv4 networks, read straight from the kernel.
+
+    Addresses and real prefixes come from a netlink address dump (falling
+    back to the SIOCGIF ioctls), the default route from /proc/net/route. A
+    watcher thread subscribed to netlink link/address/route notifications
+    drops the cache whenever something changes; NETWORK_CACHE_TTL only
+    matters where that subscription isn't possible.
+    """
+
+    def __init__(self, ttl: int = NETWORK_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.networks = None
+        self.loaded_at = 0.0
+        self.loads = 0
+        self.invalidations = 0
+        self.watching = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def addresses(self) -> List[tuple]:
+        try:
+            return netlink_ipv4_addresses()
+        except (OSError, AttributeError):
+            # No AF_NETLINK (non-Linux) or it is blocked: primary addresses only
+            return [(iface["interface"], iface["ip_address"], iface["network"].prefixlen)
+                    for iface in local_ipv4_interfaces()]
+
+    def load(self) -> List[dict]:
+        gateway = default_gateway()
+        networks = []
+        for name, address, prefix in self.addresses():
+            if address.startswith('127.'):
+                continue
+            network = ipaddress.IPv4Network(f"{address}/{prefix}", strict=False)
+            entry = {
+                "interface": name,
+                "ip_address": address,
+                "cidr": str(network),
+                "network": str(network.network_address),
+                "subnet": address.rsplit('.', 1)[0],  # the /24 holding this address, for the grid
+                "prefix": prefix,
+                "subnet_mask": str(network.netmask),
+                "total_ips": network.num_addresses - 2 if prefix < 31 else network.num_addresses,
+                "scannable": prefix >= SCAN_MIN_PREFIX,
+                "network_type": "Local" if name.startswith(('eth', 'en', 'wlan', 'wl')) else "Virtual",
+                "is_primary": False
+            }
+            if gateway and gateway[0] == name and ipaddress.IPv4Address(gateway[1]) in network:
+                entry["is_primary"] = True
+                entry["gateway"] = gateway[1]
+            networks.append(entry)
         
+        # Primary first
+        networks.sort(key=lambda x: (not x['is_primary'], x['interface'], x['cidr']))
+        return networks
+
+    def get(self, refresh: bool = False) -> List[dict]:
+        with self.lock:
+            fresh = self.networks is not None and (self.watching or time.monotonic() - self.loaded_at < self.ttl)
+            if fresh and not refresh:
+                return self.networks
+            self.networks = self.load()
+            self.loaded_at = time.monotonic()
+            self.loads += 1
+            return self.networks
+
+    def invalidate(self):
+        with self.lock:
+            if self.networks is not None:
+                self.networks = None
+                self.invalidations += 1
+
+    def watch(self, sock):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    sock.recv(65536)
+                except socket.timeout:
+                    continue
+                self.invalidate()
+        except OSError as e:
+            print(f"⚠ Network change watcher stopped: {e}")
+        finally:
+            self.watching = False
+            sock.close()
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE))
+            sock.settimeout(1)
+        except (OSError, AttributeError) as e:
+            print(f"⚠ Network change notifications unavailable, caching for {self.ttl}s: {e}")
+            return
+        self.stop_event.clear()
+        self.watching = True
+        self.invalidate()  # anything cached before the subscription may have missed changes
+        self.thread = threading.Thread(target=self.watch, args=(sock,), name="network-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self) -> dict:
         return {
-            "node": node,
-            "history": history
+            "cached": self.networks is not None,
+            "watching": self.watching,
+            "ttl": self.ttl,
+            "loads": self.loads,
+            "invalidations": self.invalidations
         }
-    finally:
-        conn.close()
 
-@app.get("/api/networks/discover")
-async def discover_networks():
-    """Discover all network interfaces and their subnets"""
-    networks = []
-    
-    try:
-        # result = subprocess.run(
-        #     ['ip', 'addr', 'show'],
-        #     capture_output=True,
-        #     text=True,
-        #     timeout=5
-        # )
-
-        result = subprocess.run(
-            ['hostname', '-I'],
-            capture_output=True,
-            text=True,
-            timeout=5,
-            shell=False
-        )
 
-        # Parse the output - it's just space-separated IPs
-        ips = result.stdout.strip().split()
+network_discovery = NetworkDiscovery()
+
+
+@app.on_event("startup")
+async def start_network_watcher():
+    network_discovery.start()
 
-        for ip_addr in ips:
-            if ip_addr.startswith('127.'):
-                continue
-            
-            octets = [int(x) for x in ip_addr.split('.')]
-            subnet = f"{octets[0]}.{octets[1]}.{octets[2]}"
 
-            networks.append({
-                "interface": "host",
-                "ip_address": ip_addr,
-                "subnet": subnet,
-                "prefix": 24,
-                "subnet_mask": "255.255.255.0",
-                "total_ips": 254,
-                "network_type": "Local",
-                "is_primary": True
-            })        
-        
-        current_interface = None
-        
-        for line in result.stdout.split('\n'):
-            # Match interface name
-            if_match = re.match(r'^\d+:\s+(\w+):', line)
-            if if_match:
-                current_interface = if_match.group(1)
-            
-            # Match IP address with subnet
-            ip_match = re.search(r'inet\s+(\d+\.\d+\.\d+\.\d+)/(\d+)', line)
-            if ip_match and current_interface:
-                ip_addr = ip_match.group(1)
-                prefix = int(ip_match.group(2))
-                
-                # Skip loopback
-                if ip_addr.startswith('127.'):
-                    continue
-                
-                # Calculate subnet (first 3 octets for /24)
-                octets = [int(x) for x in ip_addr.split('.')]
-                subnet = f"{octets[0]}.{octets[1]}.{octets[2]}"
-                
-                networks.append({
-                    "interface": current_interface,
-                    "ip_address": ip_addr,
-                    "subnet": subnet,
-                    "prefix": prefix,
-                    "subnet_mask": "255.255.255.0",
-                    "total_ips": 254,
-                    "network_type": "Local" if current_interface.startswith(('eth', 'en', 'wlan', 'wl')) else "Virtual"
-                })
-        
-        # Get default gateway
-        try:
-            route_result = subprocess.run(
-                ['ip', 'route', 'show', 'default'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            
-            gateway_match = re.search(r'default via (\d+\.\d+\.\d+\.\d+)', route_result.stdout)
-            if gateway_match:
-                gateway = gateway_match.group(1)
-                gateway_subnet = '.'.join(gateway.split('.')[:3])
-                for net in networks:
-                    if net['subnet'] == gateway_subnet:
-                        net['is_primary'] = True
-                        net['gateway'] = gateway
-        except:
-            pass
-        
-        # Sort: primary first
-        networks.sort(key=lambda x: (not x.get('is_primary', False), x['interface']))
-        
+@app.on_event("shutdown")
+async def stop_network_watcher():
+    network_discovery.stop()
+
+
+@app.get("/api/networks/discover")
+async def discover_networks(refresh: bool = False):
+    """Discover the host's IPv4 networks with their real CIDRs (cached until interfaces or routes change)"""
+    try:
+        networks = network_discovery.get(refresh)
         return {"networks": networks, "count": len(networks)}
-        
     except Exception as e:
         print(f"Network discovery error: {e}")
-        return {"networks": [], "count": 0, "error": str(e)}    
+        return {"networks": [], "count": 0, "error": str(e)}
+
+
+@app.get("/api/networks/cache")
+async def get_network_cache_stats():
+    """Get network discovery cache stats"""
+    return network_discovery.stats()
 
     #===========================================================
 
     # Proxmox Integration
 import requests
+import requests.adapters
+from urllib.parse import quote
 import urllib3
 
 # Disable SSL warnings for self-signed certs
@@ -644,33 +3335,56 @@ PROXMOX_USER = os.getenv("PROXMOX_USER", "root@pam")
 PROXMOX_PASSWORD = os.getenv("PROXMOX_PASSWORD")
 PROXMOX_NODE = os.getenv("PROXMOX_NODE", "proxmox")
 
+# PVE tickets are valid for two hours; log in again a little before that
+PROXMOX_TICKET_REFRESH = int(os.getenv("PROXMOX_TICKET_REFRESH", 6600))
+PROXMOX_POOL_SIZE = int(os.getenv("PROXMOX_POOL_SIZE", 10))
+PROXMOX_TASK_TIMEOUT = int(os.getenv("PROXMOX_TASK_TIMEOUT", 600))
+PROXMOX_BULK_CONCURRENCY = int(os.getenv("PROXMOX_BULK_CONCURRENCY", 4))
+PROXMOX_BULK_MAX_VMS = int(os.getenv("PROXMOX_BULK_MAX_VMS", 100))
+
 class ProxmoxAPI:
-    """Proxmox VE API Client"""
+    """Proxmox VE API Client (thread-safe, keep-alive session, cached ticket)"""
     
     def __init__(self, host, port, user, password, verify_ssl=False):
         self.base_url = f"https://{host}:{port}/api2/json"
         self.verify_ssl = verify_ssl
+        self.user = user
+        self.password = password
         self.ticket = None
         self.csrf_token = None
-        self.authenticate(user, password)
+        self.ticket_time = 0.0
+        self.auth_lock = threading.Lock()
+        
+        self.session = requests.Session()
+        self.session.verify = verify_ssl
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=PROXMOX_POOL_SIZE)
+        self.session.mount("https://", adapter)
     
-    def authenticate(self, user, password):
+    def authenticate(self):
         """Get authentication ticket"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/access/ticket",
-                data={"username": user, "password": password},
-                verify=self.verify_ssl,
+                data={"username": self.user, "password": self.password},
                 timeout=10
             )
             response.raise_for_status()
             data = response.json()["data"]
-            self.ticket = data["ticket"]
-            self.csrf_token = data["CSRFPreventionToken"]
-            return True
         except Exception as e:
             print(f"Proxmox authentication failed: {e}")
-            return False
+            raise RuntimeError(f"Proxmox authentication failed: {e}")
+        
+        self.ticket = data["ticket"]
+        self.csrf_token = data["CSRFPreventionToken"]
+        self.ticket_time = time.monotonic()
+        print("✓ Proxmox ticket acquired")
+    
+    def ensure_ticket(self, stale_ticket=None):
+        """Log in if there's no ticket, it's near expiry, or it was rejected"""
+        with self.auth_lock:
+            expired = time.monotonic() - self.ticket_time > PROXMOX_TICKET_REFRESH
+            if not self.ticket or expired or (stale_ticket and self.ticket == stale_ticket):
+                self.authenticate()
     
     def get_headers(self):
         """Get request headers with auth"""
@@ -679,28 +3393,69 @@ class ProxmoxAPI:
             "Cookie": f"PVEAuthCookie={self.ticket}"
         }
     
-    def get(self, endpoint):
+    def request(self, method, endpoint, data=None, params=None, timeout=10):
+        """Send an authenticated request, logging in again once on 401"""
+        self.ensure_ticket()
+        for attempt in range(2):
+            ticket = self.ticket
+            started = time.perf_counter()
+            response = self.session.request(
+                method,
+                f"{self.base_url}/{endpoint}",
+                headers=self.get_headers(),
+                data=data,
+                params=params,
+                timeout=timeout
+            )
+            PROXMOX_REQUEST_SECONDS.labels(method, str(response.status_code)).observe(time.perf_counter() - started)
+            if response.status_code == 401 and attempt == 0:
+                self.ensure_ticket(stale_ticket=ticket)
+                continue
+            response.raise_for_status()
+            return response.json()["data"]
+    
+    def get(self, endpoint, params=None):
         """GET request"""
-        response = requests.get(
-            f"{self.base_url}/{endpoint}",
-            headers=self.get_headers(),
-            verify=self.verify_ssl,
-            timeout=10
-        )
-        response.raise_for_status()
-        return response.json()["data"]
+        return self.request("GET", endpoint, params=params)
     
     def post(self, endpoint, data):
         """POST request"""
-        response = requests.post(
-            f"{self.base_url}/{endpoint}",
-            headers=self.get_headers(),
-            data=data,
-            verify=self.verify_ssl,
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()["data"]
+        return self.request("POST", endpoint, data=data, timeout=30)
+    
+    def wait_for_task(self, upid, timeout=None, poll_interval=1.0):
+        """Block until a task (UPID) stops; raise if it didn't end with OK"""
+        if not upid or not str(upid).startswith("UPID:"):
+            return  # synchronous call, nothing to wait for
+        node = upid.split(":")[1]
+        deadline = time.monotonic() + (timeout or PROXMOX_TASK_TIMEOUT)
+        while True:
+            status = self.get(f"nodes/{node}/tasks/{quote(upid, safe='')}/status")
+            if status.get("status") == "stopped":
+                if status.get("exitstatus") != "OK":
+                    raise RuntimeError(f"Proxmox task {status.get('type', upid)} failed: {status.get('exitstatus')}")
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Proxmox task {upid} did not finish in time")
+            time.sleep(poll_interval)
+
+
+proxmox_client = None
+proxmox_client_lock = threading.Lock()
+
+def get_proxmox_client() -> ProxmoxAPI:
+    """Return the process-wide Proxmox client"""
+    global proxmox_client
+    with proxmox_client_lock:
+        if proxmox_client is None:
+            proxmox_client = ProxmoxAPI(PROXMOX_HOST, PROXMOX_PORT, PROXMOX_USER, PROXMOX_PASSWORD, verify_ssl=False)
+        return proxmox_client
+
+async def proxmox_call(method: str, endpoint: str, data=None):
+    """Run a Proxmox API call on the default executor, off the event loop"""
+    proxmox = get_proxmox_client()
+    call = proxmox.get if method == "GET" else proxmox.post
+    args = (endpoint,) if method == "GET" else (endpoint, data)
+    return await asyncio.get_running_loop().run_in_executor(None, call, *args)
 
 # Pydantic models for Proxmox
 class ProxmoxVMRequest(BaseModel):
@@ -715,6 +3470,137 @@ class ProxmoxVMRequest(BaseModel):
     gateway: str = "192.168.0.1"
     nameserver: str = "8.8.8.8"
 
+class ProxmoxBulkVMRequest(BaseModel):
+    vms: List[ProxmoxVMRequest]
+    concurrency: Optional[int] = None
+    
+    @validator("vms")
+    def validate_vms(cls, v):
+        if not 1 <= len(v) <= PROXMOX_BULK_MAX_VMS:
+            raise ValueError(f"vms must contain 1-{PROXMOX_BULK_MAX_VMS} entries")
+        ips = [vm.ip_address for vm in v]
+        if len(set(ips)) != len(ips):
+            raise ValueError("Duplicate ip_address in vms")
+        return v
+    
+    @validator("concurrency")
+    def validate_concurrency(cls, v):
+        if v is not None and not 1 <= v <= 16:
+            raise ValueError("concurrency must be 1-16")
+        return v
+
+
+class VMIDAllocator:
+    """Hands out VMIDs that are neither in use on the cluster nor claimed by an in-flight build"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.claimed = set()
+    
+    def allocate(self, proxmox: ProxmoxAPI) -> int:
+        with self.lock:
+            used = {int(vm["vmid"]) for vm in proxmox.get("cluster/resources", params={"type": "vm"})}
+            vmid = int(proxmox.get("cluster/nextid"))
+            while vmid in used or vmid in self.claimed:
+                vmid += 1
+            self.claimed.add(vmid)
+            return vmid
+    
+    def release(self, vmid: int):
+        with self.lock:
+            self.claimed.discard(vmid)
+
+
+vmid_allocator = VMIDAllocator()
+
+
+def build_proxmox_vm(proxmox: ProxmoxAPI, request: ProxmoxVMRequest, vmid: int, report=None):
+    """Clone or create, configure and optionally start one VM, waiting on each Proxmox task"""
+    def stage(name):
+        if report:
+            report(name)
+    
+    cidr = "24"
+    
+    if request.template_id:
+        stage("cloning")
+        clone_data = {"newid": vmid, "name": request.vm_name, "full": 1}
+        task = proxmox.post(f"nodes/{PROXMOX_NODE}/qemu/{request.template_id}/clone", clone_data)
+        proxmox.wait_for_task(task)
+        
+        stage("configuring")
+        config_data = {
+            "cores": request.cores,
+            "memory": request.memory,
+            "ipconfig0": f"ip={request.ip_address}/{cidr},gw={request.gateway}",
+            "nameserver": request.nameserver,
+            "boot": "order=scsi0",  # Ensure boot order is set
+            "ciuser": "ubuntu",  # Set default username
+            "cipassword": "ubuntu"  # Set default password
+        }
+        task = proxmox.post(f"nodes/{PROXMOX_NODE}/qemu/{vmid}/config", config_data)
+        proxmox.wait_for_task(task)
+    else:
+        stage("creating")
+        vm_data = {
+            "vmid": vmid,
+            "name": request.vm_name,
+            "cores": request.cores,
+            "memory": request.memory,
+            "net0": f"virtio,bridge={request.bridge}",
+            "scsi0": f"local-lvm:{request.disk_size}",
+            "ostype": "l26",
+            "ipconfig0": f"ip={request.ip_address}/{cidr},gw={request.gateway}",
+            "nameserver": request.nameserver
+        }
+        task = proxmox.post(f"nodes/{PROXMOX_NODE}/qemu", vm_data)
+        proxmox.wait_for_task(task)
+    
+    if request.start_vm:
+        stage("starting")
+        task = proxmox.post(f"nodes/{PROXMOX_NODE}/qemu/{vmid}/status/start", {})
+        proxmox.wait_for_task(task)
+
+
+def reserve_provisioned_ips(built: List[tuple]):
+    """Mark (request, vmid) pairs as reserved in one transaction, creating missing node rows"""
+    if not built:
+        return
+    
+    conn = get_db_connection()
+    if not conn:
+        print("✗ Database connection failed, VM IPs not reserved")
+        return
+    try:
+        cursor = conn.cursor()
+        node_params = []
+        reservation_params = []
+        for request, vmid in built:
+            subnet, last_octet = request.ip_address.rsplit('.', 1)
+            note = f"\nProxmox VM: {request.vm_name} (VMID: {vmid})"
+            node_params.extend((request.ip_address, subnet, int(last_octet), note))
+            reservation_params.extend((request.ip_address, request.vm_name, note.strip()))
+        
+        cursor.execute(f"""
+            INSERT INTO nodes (ip_address, subnet, last_octet, status, is_reserved, notes,
+                               reserved_by, reserved_at, times_seen)
+            VALUES {sql_placeholders(len(built), "(%s, %s, %s, 'reserved', TRUE, %s, 'Proxmox', NOW(), 0)")}
+            ON DUPLICATE KEY UPDATE
+                status = 'reserved', is_reserved = TRUE,
+                notes = CONCAT(COALESCE(notes, ''), VALUES(notes)),
+                reserved_by = 'Proxmox', reserved_at = NOW()
+        """, node_params)
+        cursor.execute(f"""
+            INSERT INTO ip_reservations (ip_address, reserved_for, description, reserved_by)
+            VALUES {sql_placeholders(len(built), "(%s, %s, %s, 'Proxmox')")}
+        """, reservation_params)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    
+    grid_cache.patch_many([request.ip_address for request, _ in built], status='reserved', is_reserved=True)
+
 @app.get("/api/proxmox/status")
 async def proxmox_status():
     """Check Proxmox connectivity"""
@@ -722,8 +3608,7 @@ async def proxmox_status():
         if not PROXMOX_PASSWORD:
             return {"connected": False, "error": "Proxmox credentials not configured"}
         
-        proxmox = ProxmoxAPI(PROXMOX_HOST, PROXMOX_PORT, PROXMOX_USER, PROXMOX_PASSWORD, verify_ssl=False)
-        version = proxmox.get("version")
+        version = await proxmox_call("GET", "version")
         
         return {
             "connected": True,
@@ -738,8 +3623,7 @@ async def proxmox_status():
 async def get_proxmox_templates():
     """Get list of available VM templates"""
     try:
-        proxmox = ProxmoxAPI(PROXMOX_HOST, PROXMOX_PORT, PROXMOX_USER, PROXMOX_PASSWORD, verify_ssl=False)
-        vms = proxmox.get(f"nodes/{PROXMOX_NODE}/qemu")
+        vms = await proxmox_call("GET", f"nodes/{PROXMOX_NODE}/qemu")
         
         templates = []
         for vm in vms:
@@ -760,73 +3644,20 @@ async def get_proxmox_templates():
 async def get_next_vmid():
     """Get next available VM ID"""
     try:
-        proxmox = ProxmoxAPI(PROXMOX_HOST, PROXMOX_PORT, PROXMOX_USER, PROXMOX_PASSWORD, verify_ssl=False)
-        next_id = proxmox.get("cluster/nextid")
+        next_id = await proxmox_call("GET", "cluster/nextid")
         return {"next_vmid": int(next_id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/proxmox/create-vm")
-async def create_proxmox_vm(request: ProxmoxVMRequest):
-    """Create a new Proxmox VM with specified IP"""
+def provision_proxmox_vm(request: ProxmoxVMRequest):
+    """Create a new Proxmox VM with specified IP (blocking)"""
+    vmid = None
     try:
-        proxmox = ProxmoxAPI(PROXMOX_HOST, PROXMOX_PORT, PROXMOX_USER, PROXMOX_PASSWORD, verify_ssl=False)
-        vmid = int(proxmox.get("cluster/nextid"))
-        
-        subnet_parts = request.ip_address.split('.')
-        cidr = "24"
-        
-
-        if request.template_id:
-            clone_data = {"newid": vmid, "name": request.vm_name, "full": 1}
-            task = proxmox.post(f"nodes/{PROXMOX_NODE}/qemu/{request.template_id}/clone", clone_data)
-            
-            import time
-            time.sleep(3)  # Wait longer for clone to complete
-            
-            config_data = {
-                "cores": request.cores,
-                "memory": request.memory,
-                "ipconfig0": f"ip={request.ip_address}/{cidr},gw={request.gateway}",
-                "nameserver": request.nameserver,
-                "boot": "order=scsi0",  # Ensure boot order is set
-                "ciuser": "ubuntu",  # Set default username
-                "cipassword": "ubuntu"  # Set default password
-            }
-            proxmox.post(f"nodes/{PROXMOX_NODE}/qemu/{vmid}/config", config_data)        
-        else:
-            vm_data = {
-                "vmid": vmid,
-                "name": request.vm_name,
-                "cores": request.cores,
-                "memory": request.memory,
-                "net0": f"virtio,bridge={request.bridge}",
-                "scsi0": f"local-lvm:{request.disk_size}",
-                "ostype": "l26",
-                "ipconfig0": f"ip={request.ip_address}/{cidr},gw={request.gateway}",
-                "nameserver": request.nameserver
-            }
-            task = proxmox.post(f"nodes/{PROXMOX_NODE}/qemu", vm_data)
-        
-        if request.start_vm:
-            import time
-            time.sleep(3)
-            proxmox.post(f"nodes/{PROXMOX_NODE}/qemu/{vmid}/status/start", {})
-        
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE nodes 
-                SET status = 'reserved', is_reserved = TRUE,
-                    notes = CONCAT(COALESCE(notes, ''), '\nProxmox VM: ', %s, ' (VMID: ', %s, ')'),
-                    reserved_by = 'Proxmox', reserved_at = NOW()
-                WHERE ip_address = %s
-            """, (request.vm_name, vmid, request.ip_address))
-            conn.commit()
-            cursor.close()
-            conn.close()
+        proxmox = get_proxmox_client()
+        vmid = vmid_allocator.allocate(proxmox)
+        build_proxmox_vm(proxmox, request, vmid)
         
+        reserve_provisioned_ips([(request, vmid)])
         add_prometheus_target(request.ip_address)            
         
         return {
@@ -840,74 +3671,462 @@ async def create_proxmox_vm(request: ProxmoxVMRequest):
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to create VM: {str(e)}")
+    finally:
+        if vmid is not None:
+            vmid_allocator.release(vmid)
+
+@app.post("/api/proxmox/create-vm")
+async def create_proxmox_vm(request: ProxmoxVMRequest):
+    """Create a new Proxmox VM with specified IP"""
+    return await asyncio.get_running_loop().run_in_executor(None, provision_proxmox_vm, request)
+
+@app.post("/api/proxmox/bulk-create")
+async def bulk_create_proxmox_vms(request: ProxmoxBulkVMRequest):
+    """
+    Create several VMs concurrently and stream per-VM progress as Server-Sent Events.
+
+    Emits 'vm' events ({index, vm_name, ip_address, vmid, stage}) as each build
+    moves through allocating, cloning/creating, configuring, starting and done
+    (or failed). Successful IPs are reserved and registered with Prometheus in
+    one batch, then a final 'summary' event is sent.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    concurrency = request.concurrency or PROXMOX_BULK_CONCURRENCY
+    
+    def emit(event, payload):
+        loop.call_soon_threadsafe(events.put_nowait, (event, payload))
+    
+    def build_one(index: int, spec: ProxmoxVMRequest):
+        vmid = None
+        state = {"index": index, "vm_name": spec.vm_name, "ip_address": spec.ip_address, "vmid": None}
+        
+        def report(stage, **extra):
+            emit("vm", {**state, "stage": stage, **extra})
+        
+        try:
+            report("allocating")
+            proxmox = get_proxmox_client()
+            vmid = vmid_allocator.allocate(proxmox)
+            state["vmid"] = vmid
+            build_proxmox_vm(proxmox, spec, vmid, report)
+            report("built")
+            return spec, vmid
+        except Exception as e:
+            report("failed", error=str(e))
+            if vmid is not None:
+                vmid_allocator.release(vmid)
+            return None
+    
+    def run_bulk():
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="proxmox") as pool:
+            outcomes = list(pool.map(build_one, range(len(request.vms)), request.vms))
+        built = [outcome for outcome in outcomes if outcome]
+        # Built VMIDs stay claimed until the whole batch is done
+        for _, vmid in built:
+            vmid_allocator.release(vmid)
+        
+        # Reservation and monitoring registration happen once for the whole batch
+        reserve_provisioned_ips(built)
+        add_prometheus_targets([spec.ip_address for spec, _ in built])
+        for index, outcome in enumerate(outcomes):
+            if outcome:
+                emit("vm", {"index": index, "vm_name": outcome[0].vm_name,
+                            "ip_address": outcome[0].ip_address, "vmid": outcome[1], "stage": "done"})
+        
+        emit("summary", {
+            "requested": len(request.vms),
+            "created": len(built),
+            "failed": len(request.vms) - len(built),
+            "vms": [{"vm_name": spec.vm_name, "ip_address": spec.ip_address, "vmid": vmid} for spec, vmid in built],
+            "elapsed": round(time.time() - started, 2)
+        })
+    
+    async def event_stream():
+        future = loop.run_in_executor(None, run_bulk)
+        while True:
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, future}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                event, payload = getter.result()
+                yield sse_event(event, json.dumps(payload))
+                if event == "summary":
+                    break
+                continue
+            getter.cancel()
+            while not events.empty():
+                event, payload = events.get_nowait()
+                yield sse_event(event, json.dumps(payload))
+            if future.exception():
+                yield sse_event("error", json.dumps({"error": str(future.exception())}))
+            break
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# =============================================
+# Proxmox inventory
+# =============================================
+
+INVENTORY_TTL = int(os.getenv("INVENTORY_TTL", 60))
+INVENTORY_FETCH_WORKERS = int(os.getenv("INVENTORY_FETCH_WORKERS", 8))
+
+MAC_PATTERN = re.compile(r"([0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5})")
+IP_SETTING_PATTERN = re.compile(r"(?:^|,)ip=(\d+\.\d+\.\d+\.\d+)")
+
+
+class ProxmoxInventory:
+    """
+    Cached view of cluster guests indexed by IP and MAC.
+
+    A background thread pulls cluster/resources plus each guest's config and,
+    for running QEMU guests, the guest-agent interface list, then swaps in new
+    indexes. Request handlers only read the indexes, so they never call
+    Proxmox; stale data is served while a refresh runs.
+    """
+
+    def __init__(self, ttl: int = INVENTORY_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.vms = {}          # vmid -> vm dict
+        self.by_ip = {}        # ip -> vmid
+        self.by_mac = {}       # upper-case mac -> vmid
+        self.refreshed_at = None
+        self.refresh_seconds = None
+        self.refreshes = 0
+        self.last_error = None
+
+    @staticmethod
+    def parse_config(vm: dict, config: dict):
+        """Collect MACs and static IPs from netX/ipconfigX config entries"""
+        for key, value in config.items():
+            if not isinstance(value, str):
+                continue
+            if key.startswith("net"):
+                mac = MAC_PATTERN.search(value)
+                if mac:
+                    vm["macs"].add(mac.group(1).upper())
+                ip = IP_SETTING_PATTERN.search(value)  # LXC keeps ip= on netX
+                if ip:
+                    vm["ips"].add(ip.group(1))
+            elif key.startswith("ipconfig"):
+                ip = IP_SETTING_PATTERN.search(value)
+                if ip:
+                    vm["ips"].add(ip.group(1))
+
+    @staticmethod
+    def parse_agent_interfaces(vm: dict, agent: dict):
+        """Collect MACs and IPv4 addresses reported by the QEMU guest agent"""
+        for iface in agent.get("result", []):
+            if iface.get("name") == "lo":
+                continue
+            mac = iface.get("hardware-address")
+            if mac and mac != "00:00:00:00:00:00":
+                vm["macs"].add(mac.upper())
+            for address in iface.get("ip-addresses", []):
+                if address.get("ip-address-type") == "ipv4" and not address["ip-address"].startswith("127."):
+                    vm["ips"].add(address["ip-address"])
+
+    def fetch_guest(self, proxmox: ProxmoxAPI, resource: dict) -> dict:
+        guest_type = resource.get("type", "qemu")
+        vm = {
+            "vmid": int(resource["vmid"]),
+            "name": resource.get("name"),
+            "node": resource.get("node"),
+            "type": guest_type,
+            "status": resource.get("status"),
+            "template": bool(resource.get("template", 0)),
+            "ips": set(),
+            "macs": set()
+        }
+        base = f"nodes/{vm['node']}/{guest_type}/{vm['vmid']}"
+        try:
+            self.parse_config(vm, proxmox.get(f"{base}/config"))
+        except Exception as e:
+            print(f"Inventory: config for {vm['vmid']} failed: {e}")
+        if guest_type == "qemu" and vm["status"] == "running" and not vm["template"]:
+            try:
+                self.parse_agent_interfaces(vm, proxmox.get(f"{base}/agent/network-get-interfaces"))
+            except Exception:
+                pass  # no guest agent - config data is all we have
+        return vm
+
+    def refresh(self):
+        """Pull the cluster inventory in bulk and swap in new indexes (blocking)"""
+        with self.refresh_lock:
+            started = time.monotonic()
+            proxmox = get_proxmox_client()
+            resources = proxmox.get("cluster/resources", params={"type": "vm"})
+            with ThreadPoolExecutor(max_workers=INVENTORY_FETCH_WORKERS, thread_name_prefix="inventory") as pool:
+                guests = list(pool.map(lambda r: self.fetch_guest(proxmox, r), resources))
+
+            vms, by_ip, by_mac = {}, {}, {}
+            for vm in guests:
+                vm["ips"] = sorted(vm["ips"])
+                vm["macs"] = sorted(vm["macs"])
+                vms[vm["vmid"]] = vm
+                for ip in vm["ips"]:
+                    by_ip[ip] = vm["vmid"]
+                for mac in vm["macs"]:
+                    by_mac[mac] = vm["vmid"]
+
+            with self.lock:
+                self.vms, self.by_ip, self.by_mac = vms, by_ip, by_mac
+                self.refreshed_at = time.time()
+                self.refresh_seconds = round(time.monotonic() - started, 3)
+                self.refreshes += 1
+                self.last_error = None
+            print(f"✓ Proxmox inventory refreshed: {len(vms)} guests, {len(by_ip)} IPs")
+
+    @property
+    def stale(self) -> bool:
+        return self.refreshed_at is None or time.time() - self.refreshed_at > self.ttl
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Proxmox inventory refresh failed: {e}")
+            self.stop_event.wait(self.ttl)
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="proxmox-inventory", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    @staticmethod
+    def summary(vm: dict) -> dict:
+        return {"vmid": vm["vmid"], "name": vm["name"], "node": vm["node"],
+                "type": vm["type"], "status": vm["status"]}
+
+    def owner(self, ip: Optional[str] = None, mac: Optional[str] = None) -> Optional[dict]:
+        """Find the guest owning an IP (or, failing that, a MAC) from the cache"""
+        with self.lock:
+            vmid = self.by_ip.get(ip) if ip else None
+            if vmid is None and mac:
+                vmid = self.by_mac.get(mac.upper())
+            vm = self.vms.get(vmid) if vmid is not None else None
+        return self.summary(vm) if vm else None
+
+    def owners_in_subnet(self, subnet: str) -> Dict[int, dict]:
+        """Map last octet -> guest for every cached IP in a /24"""
+        prefix = f"{subnet}."
+        with self.lock:
+            return {
+                int(ip[len(prefix):]): self.summary(self.vms[vmid])
+                for ip, vmid in self.by_ip.items() if ip.startswith(prefix)
+            }
+
+    def reconcile(self, nodes: List[dict]) -> dict:
+        """Join guests against discovered nodes by IP and MAC"""
+        with self.lock:
+            vms, by_ip, by_mac = self.vms, self.by_ip, self.by_mac
+
+        matched, unknown_hosts, conflicts = [], [], []
+        seen_vmids = set()
+        for node in nodes:
+            ip_vmid = by_ip.get(node['ip_address'])
+            mac_vmid = by_mac.get(node['mac_address'].upper()) if node['mac_address'] else None
+            if ip_vmid is None and mac_vmid is None:
+                if node['status'] == 'up':
+                    unknown_hosts.append({"ip_address": node['ip_address'], "mac_address": node['mac_address'],
+                                          "hostname": node['hostname'], "vendor": node['vendor']})
+                continue
+            seen_vmids.update(v for v in (ip_vmid, mac_vmid) if v is not None)
+            entry = {"ip_address": node['ip_address'], "mac_address": node['mac_address'],
+                     "status": node['status'], "vm": self.summary(vms[ip_vmid or mac_vmid])}
+            if ip_vmid is not None and mac_vmid is not None and ip_vmid != mac_vmid:
+                entry["mac_owner"] = self.summary(vms[mac_vmid])
+                conflicts.append(entry)
+            else:
+                matched.append(entry)
+
+        orphaned_vms = [
+            {**self.summary(vm), "ips": vm["ips"], "macs": vm["macs"]}
+            for vmid, vm in vms.items() if vmid not in seen_vmids and not vm["template"]
+        ]
+        return {
+            "matched": matched,
+            "unknown_hosts": unknown_hosts,
+            "orphaned_vms": orphaned_vms,
+            "conflicts": conflicts,
+            "counts": {"matched": len(matched), "unknown_hosts": len(unknown_hosts),
+                       "orphaned_vms": len(orphaned_vms), "conflicts": len(conflicts)}
+        }
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "guests": len(self.vms),
+                "indexed_ips": len(self.by_ip),
+                "indexed_macs": len(self.by_mac),
+                "refreshed_at": self.refreshed_at,
+                "refresh_seconds": self.refresh_seconds,
+                "refreshes": self.refreshes,
+                "ttl": self.ttl,
+                "stale": self.stale,
+                "last_error": self.last_error
+            }
+
+
+proxmox_inventory = ProxmoxInventory()
+
+
+@app.on_event("startup")
+async def start_proxmox_inventory():
+    if PROXMOX_PASSWORD:
+        proxmox_inventory.start()
+
+
+@app.on_event("shutdown")
+async def stop_proxmox_inventory():
+    proxmox_inventory.stop()
+
+
+@app.get("/api/proxmox/inventory")
+async def get_proxmox_inventory():
+    """List cached Proxmox guests with their IPs and MACs"""
+    with proxmox_inventory.lock:
+        vms = list(proxmox_inventory.vms.values())
+    return {"vms": vms, "stats": proxmox_inventory.stats()}
+
+
+@app.post("/api/proxmox/inventory/refresh")
+async def refresh_proxmox_inventory():
+    """Refresh the inventory now instead of waiting for the TTL"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, proxmox_inventory.refresh)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Inventory refresh failed: {str(e)}")
+    return proxmox_inventory.stats()
+
+
+@app.get("/api/proxmox/inventory/reconcile")
+async def reconcile_proxmox_inventory(subnet: Optional[str] = None):
+    """Join the inventory with discovered nodes: matches, unknown hosts, orphaned VMs, IP/MAC conflicts"""
+    def load_nodes():
+        conn = get_db_connection()
+        if not conn:
+            raise HTTPException(status_code=500, detail="Database connection failed")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            query = "SELECT ip_address, status, hostname, mac_address, vendor FROM nodes"
+            if subnet:
+                cursor.execute(query + " WHERE ip_num BETWEEN %s AND %s", subnet_bounds(subnet))
+            else:
+                cursor.execute(query)
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+
+    nodes = await run_db(load_nodes)
+    result = proxmox_inventory.reconcile(nodes)
+    if subnet:
+        # Only guests with an address in this subnet can be orphaned here
+        result["orphaned_vms"] = [vm for vm in result["orphaned_vms"]
+                                  if any(ip.startswith(f"{subnet}.") for ip in vm["ips"])]
+        result["counts"]["orphaned_vms"] = len(result["orphaned_vms"])
+    result["inventory"] = proxmox_inventory.stats()
+    return result
+
 
 # =============================================
 
 @app.delete("/api/network/clear/{subnet}")
 async def clear_network_data(subnet: str):
     """Clear all node data for a specific subnet"""
-    try:
+    def clear():
+        bounds = subnet_bounds(subnet)
         conn = get_db_connection()
         if not conn:
             raise HTTPException(status_code=500, detail="Database connection failed")
+        try:
+            cursor = conn.cursor()
         
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM node_history WHERE ip_address LIKE %s", (f"{subnet}.%",))
-        cursor.execute("DELETE FROM scan_history WHERE subnet = %s", (subnet,))
-        cursor.execute("DELETE FROM ip_reservations WHERE ip_address LIKE %s", (f"{subnet}.%",))
-        cursor.execute("DELETE FROM nodes WHERE subnet = %s", (subnet,))
+            cursor.execute("DELETE FROM node_history WHERE ip_num BETWEEN %s AND %s", bounds)
+            cursor.execute("DELETE FROM node_availability_hourly WHERE ip_num BETWEEN %s AND %s", bounds)
+            cursor.execute("DELETE FROM node_availability_daily WHERE ip_num BETWEEN %s AND %s", bounds)
+            cursor.execute("DELETE FROM scan_history WHERE subnet = %s", (subnet,))
+            cursor.execute("DELETE FROM ip_reservations WHERE ip_num BETWEEN %s AND %s", bounds)
+            cursor.execute("DELETE FROM nodes WHERE ip_num BETWEEN %s AND %s", bounds)
         
-        conn.commit()
-        nodes_deleted = cursor.rowcount
+            conn.commit()
+            nodes_deleted = cursor.rowcount
+            grid_cache.invalidate(subnet)
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return {
-            "success": True,
-            "subnet": subnet,
-            "message": f"Cleared all data for subnet {subnet}.x",
-            "nodes_deleted": nodes_deleted
-        }
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Failed to clear network: {str(e)}")
+            return {
+                "success": True,
+                "subnet": subnet,
+                "message": f"Cleared all data for subnet {subnet}.x",
+                "nodes_deleted": nodes_deleted
+            }
+        except Exception as e:
+            conn.rollback()
+            import traceback
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=f"Failed to clear network: {str(e)}")
+        finally:
+            conn.close()
+    
+    return await run_db(clear)
 
 
 @app.post("/api/network/reset-status/{subnet}")
 async def reset_network_status(subnet: str):
     """Reset all nodes in a subnet to 'down' status"""
-    try:
+    def reset():
+        bounds = subnet_bounds(subnet)
         conn = get_db_connection()
         if not conn:
             raise HTTPException(status_code=500, detail="Database connection failed")
+        try:
+            cursor = conn.cursor()
         
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE nodes 
-            SET status = 'down', last_scanned = NULL
-            WHERE subnet = %s AND is_reserved = FALSE
-        """, (subnet,))
+            cursor.execute("""
+                UPDATE nodes 
+                SET status = 'down', last_scanned = NULL
+                WHERE ip_num BETWEEN %s AND %s AND is_reserved = FALSE
+            """, bounds)
         
-        conn.commit()
-        nodes_reset = cursor.rowcount
+            conn.commit()
+            nodes_reset = cursor.rowcount
+            grid_cache.invalidate(subnet)
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return {
-            "success": True,
-            "subnet": subnet,
-            "message": f"Reset status for {nodes_reset} nodes in {subnet}.x",
-            "nodes_reset": nodes_reset
-        }
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Failed to reset network: {str(e)}")
+            return {
+                "success": True,
+                "subnet": subnet,
+                "message": f"Reset status for {nodes_reset} nodes in {subnet}.x",
+                "nodes_reset": nodes_reset
+            }
+        except Exception as e:
+            conn.rollback()
+            import traceback
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=f"Failed to reset network: {str(e)}")
+        finally:
+            conn.close()
+    
+    return await run_db(reset)
 # ============================================================================
 # Traffic Monitoring Integration
 # ============================================================================
@@ -934,164 +4153,816 @@ class TrafficTestResult(BaseModel):
     results: Optional[Dict] = None
     error: Optional[str] = None
 
+SSH_USERNAME = os.getenv("SSH_USERNAME", "ubuntu")
+SSH_PASSWORD = os.getenv("SSH_PASSWORD", "ubuntu")
+SSH_KEY_FILE = os.getenv("SSH_KEY_FILE") or None
+SSH_CONNECT_TIMEOUT = int(os.getenv("SSH_CONNECT_TIMEOUT", 15))
+SSH_BANNER_TIMEOUT = int(os.getenv("SSH_BANNER_TIMEOUT", 15))
+SSH_KEEPALIVE = int(os.getenv("SSH_KEEPALIVE", 30))
+SSH_IDLE_TIMEOUT = int(os.getenv("SSH_IDLE_TIMEOUT", 300))
+SSH_MAX_SESSIONS = int(os.getenv("SSH_MAX_SESSIONS", 32))
+SSH_MAX_CHANNELS = int(os.getenv("SSH_MAX_CHANNELS", 8))
+
+
+class SSHPoolExhausted(Exception):
+    pass
+
+
+class PooledSSHConnection:
+    """One authenticated transport to a host, shared by up to SSH_MAX_CHANNELS channels"""
+    
+    def __init__(self, host: str, client: paramiko.SSHClient):
+        self.host = host
+        self.client = client
+        self.channels = threading.BoundedSemaphore(SSH_MAX_CHANNELS)
+        self.in_use = 0
+        self.commands = 0
+        self.created = time.time()
+        self.last_used = time.monotonic()
+    
+    @property
+    def alive(self) -> bool:
+        transport = self.client.get_transport()
+        return bool(transport and transport.is_active() and transport.is_authenticated())
+
+
 class SSHManager:
-    """Manage SSH connections to VMs"""
+    """Pool of SSH connections to VMs, one multiplexed transport per host"""
     
-    def __init__(self, username="ubuntu", password="ubuntu", key_file=None):
+    def __init__(self, username=SSH_USERNAME, password=SSH_PASSWORD, key_file=SSH_KEY_FILE,
+                 max_sessions=SSH_MAX_SESSIONS, idle_timeout=SSH_IDLE_TIMEOUT):
         self.username = username
         self.password = password
         self.key_file = key_file
-        self.connections = {}
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.connections: Dict[str, PooledSSHConnection] = {}
+        self.lock = threading.Lock()        # guards connections and host_locks
+        self.host_locks: Dict[str, threading.Lock] = {}
+        self.stop_event = threading.Event()
+        self.reaper = None
+        self.counters = {"connects": 0, "reconnects": 0, "reuses": 0, "failures": 0, "evictions": 0}
+    
+    def host_lock(self, host: str) -> threading.Lock:
+        with self.lock:
+            return self.host_locks.setdefault(host, threading.Lock())
     
-    def connect(self, host: str, port: int = 22):
+    def connect(self, host: str, port: int = 22, timeout: float = SSH_CONNECT_TIMEOUT) -> paramiko.SSHClient:
         """Establish SSH connection to host"""
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        
+        print(f"🔌 Connecting to {host}:{port} as {self.username}...")
         try:
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            print(f"🔌 Connecting to {host}:{port} as {self.username}...")
-            
-            client.connect(
-                hostname=host,
-                port=port,
-                username=self.username,
-                password=self.password,
-                timeout=15,
-                allow_agent=False,
-                look_for_keys=False,
-                banner_timeout=60
-            )
-            
-            print(f"✓ Connected to {host}")
-            self.connections[host] = client
-            return client
-            
-        except Exception as e:
-            print(f"✗ SSH failed to {host}: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
-
+            with SSH_SECONDS.labels("connect").time():
+                client.connect(
+                    hostname=host,
+                    port=port,
+                    username=self.username,
+                    password=self.password,
+                    key_filename=self.key_file,
+                    timeout=timeout,
+                    allow_agent=False,
+                    look_for_keys=False,
+                    banner_timeout=min(SSH_BANNER_TIMEOUT, timeout),
+                    auth_timeout=timeout
+                )
+        except Exception as e:
+            client.close()
+            self.counters["failures"] += 1
+            print(f"✗ SSH failed to {host}: {e}")
+            raise
+        
+        client.get_transport().set_keepalive(SSH_KEEPALIVE)
+        print(f"✓ Connected to {host}")
+        return client
+    
+    def make_room(self):
+        """Evict the least recently used idle connection when the pool is full (caller holds self.lock)"""
+        if len(self.connections) < self.max_sessions:
+            return
+        idle = [conn for conn in self.connections.values() if conn.in_use == 0]
+        if not idle:
+            raise SSHPoolExhausted(f"SSH pool is full ({self.max_sessions} sessions, all busy)")
+        victim = min(idle, key=lambda conn: conn.last_used)
+        del self.connections[victim.host]
+        self.counters["evictions"] += 1
+        victim.client.close()
+    
+    def acquire(self, host: str, connect_timeout: float = SSH_CONNECT_TIMEOUT) -> PooledSSHConnection:
+        """Return a live pooled connection for host, reconnecting if its transport died"""
+        with self.host_lock(host):
+            with self.lock:
+                conn = self.connections.get(host)
+            if conn and conn.alive:
+                self.counters["reuses"] += 1
+            else:
+                if conn:
+                    print(f"⚠ SSH transport to {host} is dead, reconnecting")
+                    self.counters["reconnects"] += 1
+                    self.discard(conn)
+                with self.lock:
+                    self.make_room()
+                client = self.connect(host, timeout=connect_timeout)
+                conn = PooledSSHConnection(host, client)
+                self.counters["connects"] += 1
+                with self.lock:
+                    self.make_room()
+                    self.connections[host] = conn
+            with self.lock:
+                conn.in_use += 1
+                conn.last_used = time.monotonic()
+            return conn
+    
+    def release(self, conn: PooledSSHConnection):
+        with self.lock:
+            conn.in_use -= 1
+            conn.last_used = time.monotonic()
+    
+    def discard(self, conn: PooledSSHConnection):
+        """Drop a connection from the pool; channels already open on it are left to fail"""
+        with self.lock:
+            if self.connections.get(conn.host) is conn:
+                del self.connections[conn.host]
+        conn.client.close()
+    
+    @contextmanager
+    def channel(self, host: str, connect_timeout: float = SSH_CONNECT_TIMEOUT):
+        """Hold one channel slot on host's shared transport; yields the SSHClient"""
+        with SSH_SECONDS.labels("checkout").time():
+            conn = self.acquire(host, connect_timeout)
+            conn.channels.acquire()
+        try:
+            conn.commands += 1
+            yield conn.client
+        finally:
+            conn.channels.release()
+            self.release(conn)
+    
+    def run(self, host: str, command: str, timeout: Optional[float] = None):
+        """
+        Run a command, retrying once on a fresh transport if the pooled one dropped.
 
-    def execute_command(self, host: str, command: str):
-        """Execute command on remote host"""
+        With a timeout, connecting and the whole command are bounded by it and a
+        command still running at the deadline raises socket.timeout; without one
+        the command may run as long as it needs. Output is drained while waiting,
+        so a large report can't stall the command on a full channel window.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        connect_timeout = min(timeout, SSH_CONNECT_TIMEOUT) if timeout is not None else SSH_CONNECT_TIMEOUT
+        for attempt in range(2):
+            with self.channel(host, connect_timeout) as client:
+                try:
+                    stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+                except (paramiko.SSHException, EOFError, OSError):
+                    conn = self.connections.get(host)
+                    if attempt or (conn and conn.alive):
+                        raise
+                    continue
+                channel = stdout.channel
+                output, error = [], []
+                while not channel.exit_status_ready():
+                    if deadline is not None and time.monotonic() > deadline:
+                        channel.close()
+                        raise socket.timeout(f"Command on {host} did not finish within {timeout}s")
+                    if channel.recv_ready():
+                        output.append(channel.recv(65536))
+                    elif channel.recv_stderr_ready():
+                        error.append(channel.recv_stderr(65536))
+                    else:
+                        channel.status_event.wait(0.1)
+                output.append(stdout.read())
+                error.append(stderr.read())
+                return b"".join(output).decode('utf-8'), b"".join(error).decode('utf-8')
+    
+    def execute_command(self, host: str, command: str, timeout: Optional[float] = None):
+        """Execute command on remote host; timeout (seconds) bounds the whole command"""
         try:
-            client = self.connections.get(host) or self.connect(host)
-            if not client:
-                return None, f"Failed to connect to {host}"
-            
-            stdin, stdout, stderr = client.exec_command(command, timeout=300)
-            exit_code = stdout.channel.recv_exit_status()
-            
-            output = stdout.read().decode('utf-8')
-            error = stderr.read().decode('utf-8')
-            
+            with SSH_SECONDS.labels("command").time():
+                output, error = self.run(host, command, timeout)
             return output, error if error else None
         except Exception as e:
             return None, str(e)
     
+    def stream_command(self, host: str, command: str, on_line, idle_timeout: int = 60):
+        """
+        Run a command and hand each stdout line to on_line as it arrives.
+
+        Returns (exit_status, stderr). Stdout is consumed as it is produced, so
+        long-running commands never stall on a full channel window.
+        """
+        with self.channel(host) as client:
+            channel = client.get_transport().open_session()
+            try:
+                channel.settimeout(idle_timeout)
+                channel.exec_command(command)
+                buffer, stderr = b"", []
+                while True:
+                    data = channel.recv(32768)
+                    if not data:
+                        break
+                    *lines, buffer = (buffer + data).split(b"\n")
+                    for line in lines:
+                        if line.strip():
+                            on_line(line.decode('utf-8', 'replace'))
+                    while channel.recv_stderr_ready():
+                        stderr.append(channel.recv_stderr(32768))
+                if buffer.strip():
+                    on_line(buffer.decode('utf-8', 'replace'))
+                exit_status = channel.recv_exit_status()
+                while channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(32768))
+                return exit_status, b"".join(stderr).decode('utf-8', 'replace')
+            finally:
+                channel.close()
+    
+    def evict_idle(self) -> int:
+        """Close connections that have been idle longer than idle_timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.lock:
+            stale = [conn for conn in self.connections.values()
+                     if conn.in_use == 0 and (conn.last_used < cutoff or not conn.alive)]
+            for conn in stale:
+                del self.connections[conn.host]
+            self.counters["evictions"] += len(stale)
+        for conn in stale:
+            conn.client.close()
+        return len(stale)
+    
+    def reap(self):
+        while not self.stop_event.wait(max(1, self.idle_timeout // 4)):
+            evicted = self.evict_idle()
+            if evicted:
+                print(f"Closed {evicted} idle SSH session(s)")
+    
+    def start(self):
+        if self.reaper and self.reaper.is_alive():
+            return
+        self.stop_event.clear()
+        self.reaper = threading.Thread(target=self.reap, name="ssh-reaper", daemon=True)
+        self.reaper.start()
+    
     def close(self, host: str):
         """Close SSH connection"""
-        if host in self.connections:
-            self.connections[host].close()
-            del self.connections[host]
+        with self.lock:
+            conn = self.connections.pop(host, None)
+        if conn:
+            conn.client.close()
     
     def close_all(self):
         """Close all SSH connections"""
+        self.stop_event.set()
         for host in list(self.connections.keys()):
             self.close(host)
+    
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            hosts = {
+                host: {
+                    "alive": conn.alive,
+                    "active_channels": conn.in_use,
+                    "commands": conn.commands,
+                    "age_seconds": round(time.time() - conn.created, 1),
+                    "idle_seconds": round(now - conn.last_used, 1) if conn.in_use == 0 else 0
+                }
+                for host, conn in self.connections.items()
+            }
+        return {
+            "sessions": len(hosts),
+            "max_sessions": self.max_sessions,
+            "max_channels_per_host": SSH_MAX_CHANNELS,
+            "idle_timeout": self.idle_timeout,
+            "keepalive": SSH_KEEPALIVE,
+            **self.counters,
+            "hosts": hosts
+        }
 
 # Initialize SSH manager
-ssh_manager = SSHManager(username="ubuntu", password="ubuntu")
+ssh_manager = SSHManager()
+SSH_SESSIONS.set_function(lambda: len(ssh_manager.connections))
 
-# Store active traffic tests
-active_traffic_tests: Dict[str, TrafficTestResult] = {}
+@app.on_event("startup")
+async def start_ssh_reaper():
+    ssh_manager.start()
 
-@app.post("/api/traffic/start", response_model=TrafficTestResult)
-async def start_traffic_test(request: TrafficTestRequest):
-    """Start iperf3 traffic test between two VMs"""
-    try:
-        test_id = str(uuid.uuid4())
-        
-        # Build iperf3 command
-        cmd_parts = [
-            "iperf3",
-            "-c", request.target_ip,
-            "-t", str(request.duration),
-            "-J"
-        ]
-        
-        if request.protocol == "udp":
-            cmd_parts.append("-u")
-        
-        if request.bandwidth:
-            cmd_parts.extend(["-b", request.bandwidth])
+@app.on_event("shutdown")
+async def close_ssh_sessions():
+    ssh_manager.close_all()
+
+@app.get("/api/ssh/pool")
+async def get_ssh_pool_stats():
+    """Get SSH connection pool stats"""
+    return ssh_manager.stats()
+
+TRAFFIC_CACHE_SIZE = int(os.getenv("TRAFFIC_CACHE_SIZE", 50))
+TRAFFIC_RETENTION_DAYS = int(os.getenv("TRAFFIC_RETENTION_DAYS", 90))
+TRAFFIC_PRUNE_INTERVAL = 3600
+TRAFFIC_COMMAND_MARGIN = int(os.getenv("TRAFFIC_COMMAND_MARGIN", 60))  # seconds past -t before giving up on iperf3
+TRAFFIC_PAGE_MAX = 500
+
+TRAFFIC_SUMMARY_COLUMNS = ["bandwidth_bps", "bytes_transferred", "retransmits", "jitter_ms",
+                           "lost_packets", "packets", "lost_percent"]
+
+
+def summarize_traffic_results(protocol: str, results: dict) -> dict:
+    """Pull the headline numbers out of iperf3 -J output"""
+    # For UDP use "sum", for TCP use "sum_received"
+    if protocol == "udp":
+        end_data = results.get("end", {}).get("sum", {})
+    else:
+        end_data = results.get("end", {}).get("sum_received", {})
+    
+    return {
+        "bandwidth_bps": end_data.get("bits_per_second", 0),
+        "bytes_transferred": end_data.get("bytes", 0),
+        "retransmits": results.get("end", {}).get("sum_sent", {}).get("retransmits", 0) if protocol == "tcp" else 0,
+        "jitter_ms": end_data.get("jitter_ms", 0),
+        "lost_packets": end_data.get("lost_packets", 0),
+        "packets": end_data.get("packets", 0),
+        "lost_percent": end_data.get("lost_percent", 0)
+    }
+
+
+# Live intervals need iperf3 >= 3.17 on the source VM; iperf_supports_json_stream checks each
+# host and older ones fall back to -J. Set to false to always use -J.
+TRAFFIC_JSON_STREAM = os.getenv("TRAFFIC_JSON_STREAM", "true").lower() == "true"
+IPERF_JSON_STREAM_VERSION = (3, 17)
+IPERF_VERSION_PATTERN = re.compile(r"iperf (\d+)\.(\d+)")
+
+iperf_stream_support: Dict[str, bool] = {}   # source ip -> iperf3 there supports --json-stream
+iperf_stream_lock = threading.Lock()
+
+
+def iperf_supports_json_stream(host: str) -> bool:
+    """Check `iperf3 --version` on host once; unknown versions count as unsupported"""
+    with iperf_stream_lock:
+        if host in iperf_stream_support:
+            return iperf_stream_support[host]
+    output, error = ssh_manager.execute_command(host, "iperf3 --version", timeout=15)
+    if output is None:
+        return False  # SSH trouble: don't cache, the test itself will report it
+    match = IPERF_VERSION_PATTERN.search(output)
+    supported = bool(match) and tuple(int(part) for part in match.groups()) >= IPERF_JSON_STREAM_VERSION
+    if not supported:
+        version = output.strip().splitlines()[0] if output.strip() else error
+        print(f"⚠ iperf3 on {host} predates --json-stream ({version}), using -J")
+    with iperf_stream_lock:
+        iperf_stream_support[host] = supported
+    return supported
+
+
+def summarize_traffic_interval(protocol: str, data: dict) -> dict:
+    """Per-interval numbers from an iperf3 --json-stream 'interval' event"""
+    interval = data.get("sum", {})
+    summary = {
+        "start": round(interval.get("start", 0), 3),
+        "end": round(interval.get("end", 0), 3),
+        "bits_per_second": interval.get("bits_per_second", 0),
+        "bandwidth_mbps": round(interval.get("bits_per_second", 0) / 1000000, 2),
+        "bytes": interval.get("bytes", 0),
+        "omitted": interval.get("omitted", False)
+    }
+    if protocol == "udp":
+        summary.update({
+            "jitter_ms": interval.get("jitter_ms", 0),
+            "lost_packets": interval.get("lost_packets", 0),
+            "packets": interval.get("packets", 0),
+            "lost_percent": interval.get("lost_percent", 0)
+        })
+    else:
+        summary["retransmits"] = interval.get("retransmits", 0)
+    return summary
+
+
+def traffic_final_event(test: TrafficTestResult, summary: dict) -> tuple:
+    """The closing SSE event for a finished test: 'summary' or 'error'"""
+    if test.status != "completed":
+        return "error", json.dumps({"test_id": test.test_id, "status": test.status, "error": test.error})
+    payload = {"test_id": test.test_id, "status": test.status, "source": test.source_ip,
+               "target": test.target_ip, "protocol": test.protocol,
+               "start_time": test.start_time, "end_time": test.end_time, **summary}
+    if summary.get("bandwidth_bps") is not None:
+        payload["bandwidth_mbps"] = round(summary["bandwidth_bps"] / 1000000, 2)
+    return "summary", json.dumps(payload)
+
+
+class TrafficTestFeed:
+    """Fan-out of one running test's events to any number of SSE subscribers, with replay"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []            # (event, payload) so late subscribers can catch up
+        self.subscribers = []       # (loop, asyncio.Queue)
+        self.closed = False
+    
+    def publish(self, event: Optional[str], payload: Optional[str] = None):
+        """Send an event to every subscriber; event=None closes the feed"""
+        with self.lock:
+            if self.closed:
+                return
+            if event is None:
+                self.closed = True
+            else:
+                self.events.append((event, payload))
+            item = (event, payload) if event else None
+            for loop, queue in self.subscribers:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+    
+    def subscribe(self, loop) -> tuple:
+        """Return (backlog, queue, closed); the queue receives everything after the backlog"""
+        queue = asyncio.Queue()
+        with self.lock:
+            if not self.closed:
+                self.subscribers.append((loop, queue))
+            return list(self.events), queue, self.closed
+    
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers = [(loop, q) for loop, q in self.subscribers if q is not queue]
+
+
+class TrafficHostBusy(Exception):
+    pass
+
+
+class TrafficTestStore:
+    """
+    Traffic tests persisted to the traffic_tests table.
+
+    Only running tests and the TRAFFIC_CACHE_SIZE most recently finished ones
+    are held in memory; everything else is read back from MySQL on demand.
+    Raw iperf3 JSON is stored zlib-compressed.
+    """
+    
+    def __init__(self, cache_size: int = TRAFFIC_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.running: Dict[str, TrafficTestResult] = {}
+        self.feeds: Dict[str, TrafficTestFeed] = {}
+        self.recent: "OrderedDict[str, TrafficTestResult]" = OrderedDict()
+        self.totals = None          # status -> count, loaded lazily from the table
+        self.last_prune = 0.0
+    
+    def remember(self, test: TrafficTestResult):
+        """Put a finished test at the head of the LRU (caller holds the lock)"""
+        self.recent[test.test_id] = test
+        self.recent.move_to_end(test.test_id)
+        while len(self.recent) > self.cache_size:
+            self.recent.popitem(last=False)
+    
+    def execute(self, query: str, params: tuple = ()) -> int:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            conn.commit()
+            affected = cursor.rowcount
+            cursor.close()
+            return affected
+        finally:
+            conn.close()
+    
+    def fetch(self, query: str, params: tuple = ()) -> List[dict]:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+    
+    def start(self, test: TrafficTestResult, request: TrafficTestRequest):
+        with self.lock:
+            # iperf3 serves one client at a time; a second client would fail or skew both tests
+            for other in self.running.values():
+                if other.target_ip == test.target_ip:
+                    raise TrafficHostBusy(f"{test.target_ip} is already serving test {other.test_id}")
+                if other.source_ip == test.source_ip:
+                    raise TrafficHostBusy(f"{test.source_ip} is already running test {other.test_id}")
+            self.running[test.test_id] = test
+            self.feeds[test.test_id] = TrafficTestFeed()
+        try:
+            self.execute("""
+                INSERT INTO traffic_tests
+                    (test_id, status, source_ip, target_ip, protocol, duration, bandwidth,
+                     parallel_streams, reverse_mode, started_at)
+                VALUES (%s, 'running', %s, %s, %s, %s, %s, %s, %s, FROM_UNIXTIME(%s))
+            """, (test.test_id, test.source_ip, test.target_ip, test.protocol, request.duration,
+                  request.bandwidth, request.parallel, request.reverse, test.start_time))
+        except Exception as e:
+            print(f"⚠ Couldn't persist traffic test {test.test_id}: {e}")
+    
+    def finish(self, test: TrafficTestResult):
+        """Persist a finished test's summary and compressed results, then move it to the LRU"""
+        summary = {column: None for column in TRAFFIC_SUMMARY_COLUMNS}
+        raw = None
+        if test.results is not None:
+            if "raw_output" not in test.results:
+                try:
+                    summary = summarize_traffic_results(test.protocol, test.results)
+                except Exception as e:
+                    print(f"⚠ Couldn't summarize traffic test {test.test_id}: {e}")
+            raw = zlib.compress(json.dumps(test.results).encode('utf-8'))
         
-        if request.parallel > 1:
-            cmd_parts.extend(["-P", str(request.parallel)])
+        try:
+            self.execute(f"""
+                UPDATE traffic_tests
+                SET status = %s, ended_at = FROM_UNIXTIME(%s), error = %s, raw_results = %s,
+                    {", ".join(f"{column} = %s" for column in TRAFFIC_SUMMARY_COLUMNS)}
+                WHERE test_id = %s
+            """, (test.status, test.end_time, test.error, raw,
+                  *(summary[column] for column in TRAFFIC_SUMMARY_COLUMNS), test.test_id))
+        except Exception as e:
+            print(f"⚠ Couldn't persist traffic test {test.test_id}: {e}")
         
-        if request.reverse:
-            cmd_parts.append("-R")
+        with self.lock:
+            self.running.pop(test.test_id, None)
+            feed = self.feeds.pop(test.test_id, None)
+            self.remember(test)
+            if self.totals is not None:
+                self.totals[test.status] = self.totals.get(test.status, 0) + 1
         
-        command = " ".join(cmd_parts)
+        if feed:
+            feed.publish(*traffic_final_event(test, summary))
+            feed.publish(None)
         
-        # Create test record
-        test_record = TrafficTestResult(
-            test_id=test_id,
-            status="running",
-            source_ip=request.source_ip,
-            target_ip=request.target_ip,
-            protocol=request.protocol,
-            start_time=time.time()
+        if time.time() - self.last_prune > TRAFFIC_PRUNE_INTERVAL:
+            self.prune()
+    
+    @staticmethod
+    def from_row(row: dict) -> TrafficTestResult:
+        raw = row.get("raw_results")
+        return TrafficTestResult(
+            test_id=row["test_id"],
+            status=row["status"],
+            source_ip=row["source_ip"],
+            target_ip=row["target_ip"],
+            protocol=row["protocol"],
+            start_time=float(row["start_time"]),
+            end_time=float(row["end_time"]) if row["end_time"] is not None else None,
+            results=json.loads(zlib.decompress(raw)) if raw else None,
+            error=row["error"]
         )
+    
+    def get(self, test_id: str) -> Optional[TrafficTestResult]:
+        """Look a test up in memory, falling back to the table"""
+        with self.lock:
+            test = self.running.get(test_id)
+            if test is None and test_id in self.recent:
+                self.recent.move_to_end(test_id)
+                test = self.recent[test_id]
+        if test is not None:
+            return test
         
-        active_traffic_tests[test_id] = test_record
+        rows = self.fetch("""
+            SELECT test_id, status, source_ip, target_ip, protocol, error, raw_results,
+                   UNIX_TIMESTAMP(started_at) AS start_time, UNIX_TIMESTAMP(ended_at) AS end_time
+            FROM traffic_tests WHERE test_id = %s
+        """, (test_id,))
+        if not rows:
+            return None
+        test = self.from_row(rows[0])
+        with self.lock:
+            self.remember(test)
+        return test
+    
+    def query(self, source_ip: Optional[str] = None, target_ip: Optional[str] = None,
+              status: Optional[str] = None, since: Optional[datetime] = None,
+              until: Optional[datetime] = None, limit: int = 50, offset: int = 0) -> dict:
+        """Page through stored tests (summary columns only), newest first"""
+        conditions, params = [], []
+        for column, value in (("source_ip", source_ip), ("target_ip", target_ip), ("status", status)):
+            if value:
+                conditions.append(f"{column} = %s")
+                params.append(value)
+        if since:
+            conditions.append("started_at >= %s")
+            params.append(since)
+        if until:
+            conditions.append("started_at < %s")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         
-        # Execute test asynchronously
-        def run_test():
+        total = self.fetch(f"SELECT COUNT(*) AS total FROM traffic_tests {where}", tuple(params))[0]["total"]
+        rows = self.fetch(f"""
+            SELECT test_id, status, source_ip, target_ip, protocol, duration, bandwidth,
+                   parallel_streams, reverse_mode, error,
+                   UNIX_TIMESTAMP(started_at) AS start_time, UNIX_TIMESTAMP(ended_at) AS end_time,
+                   {", ".join(TRAFFIC_SUMMARY_COLUMNS)}
+            FROM traffic_tests {where}
+            ORDER BY started_at DESC, id DESC
+            LIMIT %s OFFSET %s
+        """, (*params, limit, offset))
+        for row in rows:
+            row["start_time"] = float(row["start_time"])
+            row["end_time"] = float(row["end_time"]) if row["end_time"] is not None else None
+            row["reverse_mode"] = bool(row["reverse_mode"])
+            if row["bandwidth_bps"] is not None:
+                row["bandwidth_mbps"] = round(row["bandwidth_bps"] / 1000000, 2)
+        return {"total": total, "limit": limit, "offset": offset, "tests": rows}
+    
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            totals = dict(self.totals) if self.totals is not None else None
+        if totals is None:
             try:
-                output, error = ssh_manager.execute_command(request.source_ip, command)
-                
-                if error:
-                    test_record.status = "failed"
-                    test_record.error = error
-                else:
-                    test_record.status = "completed"
-                    try:
-                        test_record.results = json.loads(output)
-                    except json.JSONDecodeError:
-                        test_record.results = {"raw_output": output}
-                
-                test_record.end_time = time.time()
-                
-            except Exception as e:
+                rows = self.fetch("SELECT status, COUNT(*) AS n FROM traffic_tests GROUP BY status")
+                totals = {row["status"]: row["n"] for row in rows}
+                totals.pop("running", None)     # running tests are counted from memory
+                with self.lock:
+                    self.totals = dict(totals)
+            except Exception:
+                with self.lock:
+                    totals = {}
+                    for test in self.recent.values():
+                        totals[test.status] = totals.get(test.status, 0) + 1
+        return totals
+    
+    def fail_interrupted(self) -> int:
+        """Mark tests that were running when the backend last stopped as failed"""
+        try:
+            return self.execute("""
+                UPDATE traffic_tests
+                SET status = 'failed', ended_at = NOW(3), error = 'Interrupted by backend restart'
+                WHERE status = 'running'
+            """)
+        except Exception as e:
+            print(f"⚠ Couldn't recover interrupted traffic tests: {e}")
+            return 0
+    
+    def prune(self, retention_days: int = TRAFFIC_RETENTION_DAYS) -> int:
+        """Delete stored tests older than the retention window"""
+        self.last_prune = time.time()
+        try:
+            deleted = self.execute(
+                "DELETE FROM traffic_tests WHERE started_at < NOW() - INTERVAL %s DAY AND status <> 'running'",
+                (retention_days,)
+            )
+        except Exception as e:
+            print(f"⚠ Traffic test retention failed: {e}")
+            return 0
+        if deleted:
+            print(f"✓ Pruned {deleted} traffic tests older than {retention_days} days")
+            with self.lock:
+                self.totals = None
+        return deleted
+
+
+traffic_store = TrafficTestStore()
+TRAFFIC_TESTS_RUNNING.set_function(lambda: len(traffic_store.running))
+
+def build_iperf_command(request: TrafficTestRequest, stream: bool = False) -> str:
+    """iperf3 client command line for a test request (-J, or --json-stream when stream)"""
+    cmd_parts = [
+        "iperf3",
+        "-c", request.target_ip,
+        "-t", str(request.duration),
+        "--json-stream" if stream else "-J"
+    ]
+    if stream:
+        cmd_parts.append("--forceflush")
+    
+    if request.protocol == "udp":
+        cmd_parts.append("-u")
+    
+    if request.bandwidth:
+        cmd_parts.extend(["-b", request.bandwidth])
+    
+    if request.parallel > 1:
+        cmd_parts.extend(["-P", str(request.parallel)])
+    
+    if request.reverse:
+        cmd_parts.append("-R")
+    
+    return " ".join(cmd_parts)
+
+def create_traffic_test(request: TrafficTestRequest) -> TrafficTestResult:
+    """Register a new running test (blocking); raises TrafficHostBusy on contention"""
+    test_record = TrafficTestResult(
+        test_id=str(uuid.uuid4()),
+        status="running",
+        source_ip=request.source_ip,
+        target_ip=request.target_ip,
+        protocol=request.protocol,
+        start_time=time.time()
+    )
+    traffic_store.start(test_record, request)
+    return test_record
+
+def run_traffic_test(test_record: TrafficTestResult, request: TrafficTestRequest):
+    """Run a registered test to completion and store its result (blocking)"""
+    try:
+        stream = TRAFFIC_JSON_STREAM and iperf_supports_json_stream(request.source_ip)
+        command = build_iperf_command(request, stream)
+        if stream:
+            run_streaming_traffic_test(test_record, command)
+        else:
+            output, error = ssh_manager.execute_command(request.source_ip, command,
+                                                        timeout=request.duration + TRAFFIC_COMMAND_MARGIN)
+            
+            if error:
                 test_record.status = "failed"
-                test_record.error = str(e)
-                test_record.end_time = time.time()
+                test_record.error = error
+            else:
+                test_record.status = "completed"
+                try:
+                    test_record.results = json.loads(output)
+                except json.JSONDecodeError:
+                    test_record.results = {"raw_output": output}
+            
+            test_record.end_time = time.time()
+        
+    except Exception as e:
+        test_record.status = "failed"
+        test_record.error = str(e)
+        test_record.end_time = time.time()
+    
+    traffic_store.finish(test_record)
+
+@app.post("/api/traffic/start", response_model=TrafficTestResult)
+async def start_traffic_test(request: TrafficTestRequest):
+    """Start iperf3 traffic test between two VMs"""
+    try:
+        test_record = await asyncio.get_running_loop().run_in_executor(None, create_traffic_test, request)
         
-        thread = threading.Thread(target=run_test, daemon=True)
+        # Execute test asynchronously
+        thread = threading.Thread(target=run_traffic_test, args=(test_record, request), daemon=True)
         thread.start()
         
         return test_record
         
+    except TrafficHostBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def run_streaming_traffic_test(test: TrafficTestResult, command: str):
+    """
+    Run iperf3 with --json-stream, publishing each interval as it arrives.
+
+    The start/interval/end events are reassembled into the same shape as -J
+    output, so the stored results and summaries are unchanged.
+    """
+    feed = traffic_store.feeds.get(test.test_id)
+    results = {"start": {}, "intervals": [], "end": {}}
+    errors = []
+    
+    def on_line(line: str):
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        event, data = message.get("event"), message.get("data")
+        if event == "interval":
+            results["intervals"].append(data)
+            if feed:
+                feed.publish("interval", json.dumps({"test_id": test.test_id,
+                                                     **summarize_traffic_interval(test.protocol, data)}))
+        elif event == "start":
+            results["start"] = data
+        elif event == "end":
+            results["end"] = data
+        elif event == "error":
+            errors.append(str(data))
+    
+    try:
+        exit_status, stderr = ssh_manager.stream_command(test.source_ip, command, on_line)
+        if exit_status == 0 and results["end"]:
+            test.status = "completed"
+            test.results = results
+        else:
+            test.status = "failed"
+            test.error = "; ".join(errors) or stderr.strip() or f"iperf3 exited with status {exit_status}"
+    except Exception as e:
+        test.status = "failed"
+        test.error = "; ".join(errors) or str(e)
+    test.end_time = time.time()
+
+async def load_traffic_test(test_id: str) -> TrafficTestResult:
+    try:
+        test = await run_db(traffic_store.get, test_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load test: {str(e)}")
+    if test is None:
+        raise HTTPException(status_code=404, detail="Test not found")
+    return test
+
 @app.get("/api/traffic/status/{test_id}", response_model=TrafficTestResult)
 async def get_traffic_test_status(test_id: str):
     """Get status of traffic test"""
-    if test_id not in active_traffic_tests:
-        raise HTTPException(status_code=404, detail="Test not found")
-    
-    return active_traffic_tests[test_id]
+    return await load_traffic_test(test_id)
 
 @app.get("/api/traffic/results/{test_id}")
 async def get_traffic_test_results(test_id: str):
     """Get detailed results of completed test"""
-    if test_id not in active_traffic_tests:
-        raise HTTPException(status_code=404, detail="Test not found")
-    
-    test = active_traffic_tests[test_id]
+    test = await load_traffic_test(test_id)
     
     if test.status == "running":
         return {"status": "running", "message": "Test is still in progress"}
@@ -1104,82 +4975,444 @@ async def get_traffic_test_results(test_id: str):
         return {"status": "completed", "message": "No results available"}
     
     try:
-        # For UDP use "sum", for TCP use "sum_received"
-        if test.protocol == "udp":
-            end_data = results.get("end", {}).get("sum", {})
-        else:
-            end_data = results.get("end", {}).get("sum_received", {})
-        
-        summary = {
+        summary = summarize_traffic_results(test.protocol, results)
+        return {
             "test_id": test_id,
             "source": test.source_ip,
             "target": test.target_ip,
             "protocol": test.protocol,
             "status": "completed",
-            "bandwidth_bps": end_data.get("bits_per_second", 0),
-            "bandwidth_mbps": round(end_data.get("bits_per_second", 0) / 1000000, 2),
-            "bytes_transferred": end_data.get("bytes", 0),
-            "retransmits": results.get("end", {}).get("sum_sent", {}).get("retransmits", 0) if test.protocol == "tcp" else 0,
-            "jitter_ms": end_data.get("jitter_ms", 0),
-            "lost_packets": end_data.get("lost_packets", 0),
-            "packets": end_data.get("packets", 0),
-            "lost_percent": end_data.get("lost_percent", 0),
+            **summary,
+            "bandwidth_mbps": round(summary["bandwidth_bps"] / 1000000, 2),
             "raw_results": results
         }
-        return summary    
     
     except Exception as e:
         return {"status": "completed", "results": results, "parse_error": str(e)}
 
+@app.get("/api/traffic/stream/{test_id}")
+async def stream_traffic_test(test_id: str):
+    """
+    Stream a traffic test as Server-Sent Events.
+
+    Emits 'interval' events (per-interval throughput, retransmits or
+    jitter/loss) while the test runs, replaying any already sent, then a
+    final 'summary' or 'error'. Finished tests get only the final event.
+    """
+    feed = traffic_store.feeds.get(test_id)
+    if feed is None:
+        test = await load_traffic_test(test_id)
+        feed = traffic_store.feeds.get(test_id)
+    
+    async def event_stream():
+        if feed is None:
+            if test.status == "running":    # left over from before a restart; it will never finish
+                yield sse_event("error", json.dumps({"test_id": test_id, "status": "running",
+                                                     "error": "No live feed for this test"}))
+                return
+            summary = {}
+            if test.status == "completed" and test.results and "raw_output" not in test.results:
+                summary = summarize_traffic_results(test.protocol, test.results)
+            yield sse_event(*traffic_final_event(test, summary))
+            return
+        
+        backlog, queue, closed = feed.subscribe(asyncio.get_running_loop())
+        try:
+            for event, payload in backlog:
+                yield sse_event(event, payload)
+            while not closed:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield sse_event(*item)
+        finally:
+            feed.unsubscribe(queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/traffic/active")
 async def get_active_tests():
     """Get list of all active traffic tests"""
-    active = [t for t in active_traffic_tests.values() if t.status == "running"]
-    completed = [t for t in active_traffic_tests.values() if t.status == "completed"]
-    failed = [t for t in active_traffic_tests.values() if t.status == "failed"]
+    totals = await run_db(traffic_store.counts)
+    with traffic_store.lock:
+        active = list(traffic_store.running.values())
+        recent = list(traffic_store.recent.values())
+    completed = [t for t in recent if t.status == "completed"]
+    failed = [t for t in recent if t.status == "failed"]
     
     return {
         "active": active,
         "completed": completed[-10:],
         "failed": failed[-10:],
         "total_active": len(active),
-        "total_completed": len(completed),
-        "total_failed": len(failed)
+        "total_completed": totals.get("completed", 0),
+        "total_failed": totals.get("failed", 0)
     }
 
+@app.get("/api/traffic/tests")
+async def list_traffic_tests(source: Optional[str] = None, target: Optional[str] = None,
+                             status: Optional[str] = None, since: Optional[datetime] = None,
+                             until: Optional[datetime] = None, limit: int = 50, offset: int = 0):
+    """Page through stored traffic tests, filtered by source, target, status and start time"""
+    if not 1 <= limit <= TRAFFIC_PAGE_MAX or offset < 0:
+        raise HTTPException(status_code=400, detail=f"limit must be 1-{TRAFFIC_PAGE_MAX} and offset >= 0")
+    if status and status not in ("running", "completed", "failed"):
+        raise HTTPException(status_code=400, detail="status must be running, completed or failed")
+    try:
+        return await run_db(lambda: traffic_store.query(source, target, status, since, until, limit, offset))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to query tests: {str(e)}")
+
+@app.post("/api/traffic/tests/prune")
+async def prune_traffic_tests(retention_days: int = TRAFFIC_RETENTION_DAYS):
+    """Delete stored tests older than retention_days"""
+    if retention_days < 1:
+        raise HTTPException(status_code=400, detail="retention_days must be >= 1")
+    deleted = await run_db(traffic_store.prune, retention_days)
+    return {"deleted": deleted, "retention_days": retention_days}
+
+@app.on_event("startup")
+async def recover_traffic_tests():
+    def recover():
+        traffic_store.fail_interrupted()
+        traffic_store.prune()
+    asyncio.get_running_loop().run_in_executor(db_executor, recover)
+
+
+# =============================================
+# Traffic matrix scheduler
+# =============================================
+
+TRAFFIC_MATRIX_MAX_HOSTS = int(os.getenv("TRAFFIC_MATRIX_MAX_HOSTS", 32))
+TRAFFIC_MATRIX_CONCURRENCY = int(os.getenv("TRAFFIC_MATRIX_CONCURRENCY", 16))
+TRAFFIC_MATRIX_ROUND_GAP = float(os.getenv("TRAFFIC_MATRIX_ROUND_GAP", 1.0))  # lets iperf3 servers reset
+TRAFFIC_MATRIX_HISTORY = int(os.getenv("TRAFFIC_MATRIX_HISTORY", 20))
+
+
+class TrafficMatrixRequest(BaseModel):
+    hosts: List[str]
+    pattern: str = "mesh"           # mesh: every ordered pair, ring: i -> i+1, hub: hub <-> every spoke
+    hub: Optional[str] = None       # defaults to the first host
+    protocol: str = "tcp"
+    duration: int = 10
+    bandwidth: str = "100M"
+    parallel: int = 1
+
+    @validator('hosts')
+    def validate_hosts(cls, v):
+        if len(set(v)) != len(v):
+            raise ValueError("hosts must be unique")
+        if not 2 <= len(v) <= TRAFFIC_MATRIX_MAX_HOSTS:
+            raise ValueError(f"hosts must list 2-{TRAFFIC_MATRIX_MAX_HOSTS} VMs")
+        for host in v:
+            ipaddress.IPv4Address(host)
+        return v
+
+    @validator('pattern')
+    def validate_pattern(cls, v):
+        if v not in ("mesh", "ring", "hub"):
+            raise ValueError("pattern must be mesh, ring or hub")
+        return v
+
+    @validator('hub', always=True)
+    def validate_hub(cls, v, values):
+        if v is not None and v not in values.get('hosts', []):
+            raise ValueError("hub must be one of hosts")
+        return v
+
+    @validator('duration')
+    def validate_duration(cls, v):
+        if not 1 <= v <= 3600:
+            raise ValueError("duration must be 1-3600 seconds")
+        return v
+
+
+def traffic_matrix_pairs(hosts: List[str], pattern: str, hub: Optional[str] = None) -> List[tuple]:
+    """Ordered (client, server) pairs for a pattern"""
+    n = len(hosts)
+    if pattern == "ring":
+        return [(hosts[i], hosts[(i + 1) % n]) for i in range(n)]
+    if pattern == "hub":
+        hub = hub or hosts[0]
+        spokes = [host for host in hosts if host != hub]
+        return [pair for spoke in spokes for pair in ((hub, spoke), (spoke, hub))]
+    # Mesh, listed by offset so first-fit packing yields n-1 full rounds (i -> i+k for each k)
+    return [(hosts[i], hosts[(i + k) % n]) for k in range(1, n) for i in range(n)]
+
+
+def plan_traffic_rounds(pairs: List[tuple]) -> List[List[tuple]]:
+    """
+    Pack pairs into rounds where no host is a client twice or a server twice.
+
+    First-fit edge colouring of the client/server bipartite graph; for the
+    mesh ordering above it produces the optimal n-1 rounds.
+    """
+    rounds = []     # (pairs, clients, servers)
+    for client, server in pairs:
+        for planned, clients, servers in rounds:
+            if client not in clients and server not in servers:
+                break
+        else:
+            planned, clients, servers = [], set(), set()
+            rounds.append((planned, clients, servers))
+        planned.append((client, server))
+        clients.add(client)
+        servers.add(server)
+    return [planned for planned, _, _ in rounds]
+
+
+class TrafficMatrixJob:
+    """A matrix run: planned rounds, their test IDs and the resulting bandwidth matrix"""
+    
+    def __init__(self, request: TrafficMatrixRequest):
+        self.job_id = str(uuid.uuid4())
+        self.request = request
+        self.rounds = plan_traffic_rounds(traffic_matrix_pairs(request.hosts, request.pattern, request.hub))
+        self.status = "queued"
+        self.current_round = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.results: Dict[tuple, dict] = {}     # (client, server) -> {test_id, status, bandwidth_mbps, ...}
+    
+    def record(self, test: TrafficTestResult):
+        outcome = {"test_id": test.test_id, "status": test.status}
+        if test.status == "completed" and test.results and "raw_output" not in test.results:
+            summary = summarize_traffic_results(test.protocol, test.results)
+            outcome.update(summary, bandwidth_mbps=round(summary["bandwidth_bps"] / 1000000, 2))
+        elif test.error:
+            outcome["error"] = test.error
+        self.results[(test.source_ip, test.target_ip)] = outcome
+    
+    def matrix(self) -> List[List[Optional[float]]]:
+        """Rows are clients, columns servers, cells Mbps (None if not tested or failed)"""
+        hosts = self.request.hosts
+        return [[self.results.get((client, server), {}).get("bandwidth_mbps") for server in hosts]
+                for client in hosts]
+    
+    def to_dict(self, include_results: bool = True) -> dict:
+        data = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "pattern": self.request.pattern,
+            "hosts": self.request.hosts,
+            "rounds_total": len(self.rounds),
+            "current_round": self.current_round,
+            "tests_total": sum(len(planned) for planned in self.rounds),
+            "tests_done": len(self.results),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "matrix": self.matrix()
+        }
+        if include_results:
+            data["rounds"] = [[{"source": client, "target": server, **self.results.get((client, server), {})}
+                               for client, server in planned] for planned in self.rounds]
+        return data
+
+
+traffic_matrix_jobs: Dict[str, TrafficMatrixJob] = {}
+traffic_matrix_lock = threading.Lock()
+BACKGROUND_JOBS.labels("traffic_matrix").set_function(
+    lambda: sum(1 for job in list(traffic_matrix_jobs.values()) if job.finished_at is None)
+)
+
+
+def run_traffic_matrix(job: TrafficMatrixJob):
+    """Run each round's pairs in parallel, rounds one after another (blocking)"""
+    job.status = "running"
+    request = job.request
+    with ThreadPoolExecutor(max_workers=TRAFFIC_MATRIX_CONCURRENCY, thread_name_prefix="traffic-matrix") as pool:
+        for index, planned in enumerate(job.rounds):
+            if job.cancel_event.is_set():
+                break
+            job.current_round = index + 1
+            
+            def run_pair(pair):
+                test_request = TrafficTestRequest(
+                    source_ip=pair[0], target_ip=pair[1], protocol=request.protocol,
+                    duration=request.duration, bandwidth=request.bandwidth, parallel=request.parallel
+                )
+                try:
+                    test = create_traffic_test(test_request)
+                except TrafficHostBusy as e:
+                    # Something outside this matrix is using the host
+                    job.results[pair] = {"test_id": None, "status": "failed", "error": str(e)}
+                    return
+                run_traffic_test(test, test_request)
+                job.record(test)
+            
+            list(pool.map(run_pair, planned))
+            if index + 1 < len(job.rounds):
+                job.cancel_event.wait(TRAFFIC_MATRIX_ROUND_GAP)
+    
+    job.status = "cancelled" if job.cancel_event.is_set() else "completed"
+    job.finished_at = time.time()
+    print(f"✓ Traffic matrix {job.job_id} {job.status}: {len(job.results)} tests in {job.current_round} rounds")
+
+
+@app.post("/api/traffic/matrix", status_code=202)
+async def start_traffic_matrix(request: TrafficMatrixRequest):
+    """Plan a mesh/ring/hub test matrix and run it in contention-free rounds"""
+    job = TrafficMatrixJob(request)
+    with traffic_matrix_lock:
+        finished = [j for j in traffic_matrix_jobs.values() if j.finished_at]
+        for old in sorted(finished, key=lambda j: j.created_at)[:max(0, len(finished) - TRAFFIC_MATRIX_HISTORY)]:
+            del traffic_matrix_jobs[old.job_id]
+        traffic_matrix_jobs[job.job_id] = job
+    
+    threading.Thread(target=run_traffic_matrix, args=(job,), daemon=True).start()
+    return job.to_dict()
+
+@app.get("/api/traffic/matrix")
+async def list_traffic_matrices():
+    """List matrix runs without per-test detail"""
+    with traffic_matrix_lock:
+        jobs = sorted(traffic_matrix_jobs.values(), key=lambda j: j.created_at, reverse=True)
+    return {"jobs": [j.to_dict(include_results=False) for j in jobs]}
+
+@app.get("/api/traffic/matrix/{job_id}")
+async def get_traffic_matrix(job_id: str):
+    """Get a matrix run's progress, per-pair results and bandwidth matrix"""
+    job = traffic_matrix_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Matrix job not found")
+    return job.to_dict()
+
+@app.delete("/api/traffic/matrix/{job_id}")
+async def cancel_traffic_matrix(job_id: str):
+    """Stop a matrix run after its current round"""
+    job = traffic_matrix_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Matrix job not found")
+    job.cancel_event.set()
+    return {"job_id": job_id, "status": "cancelling" if not job.finished_at else job.status}
+
+
+# =============================================
+# VM readiness checks
+# =============================================
+
+VM_CHECK_CONCURRENCY = int(os.getenv("VM_CHECK_CONCURRENCY", 16))
+VM_CHECK_TIMEOUT = float(os.getenv("VM_CHECK_TIMEOUT", 10))
+VM_CHECK_CACHE_TTL = int(os.getenv("VM_CHECK_CACHE_TTL", 30))
+VM_CHECK_MAX_HOSTS = int(os.getenv("VM_CHECK_MAX_HOSTS", 1024))
+METRICS_PROBE_BYTES = 4096
+
+# One round-trip: unit states (one line each), then the count of listening exporter/iperf sockets
+VM_CHECK_COMMAND = "systemctl is-active node_exporter iperf3-server; ss -tuln | grep -cE ':(9100|5201)\\b'"
+
+vm_check_executor = ThreadPoolExecutor(max_workers=VM_CHECK_CONCURRENCY, thread_name_prefix="vm-check")
+vm_check_cache: Dict[str, tuple] = {}   # ip -> (expires_at, result)
+vm_check_lock = threading.Lock()
+
+
+def probe_metrics(ip: str, timeout: float) -> bool:
+    """Check node_exporter answers without downloading the whole exposition"""
+    try:
+        with requests.get(f"http://{ip}:9100/metrics", timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                return False
+            head = next(response.iter_content(METRICS_PROBE_BYTES), b"")
+            return b"# HELP" in head or b"# TYPE" in head
+    except Exception:
+        return False
+
+
+def check_vm_readiness(ip: str, timeout: float = VM_CHECK_TIMEOUT) -> dict:
+    """Check node_exporter, iperf3 and metrics on one VM (blocking, returns within about timeout)"""
+    result = {"ip": ip, "checked_at": time.time()}
+    deadline = time.monotonic() + timeout
+    output, error = ssh_manager.execute_command(ip, VM_CHECK_COMMAND, timeout=timeout)
+    if output is None:
+        result.update({"error": error, "node_exporter_running": False, "iperf3_running": False,
+                       "ports_listening": False})
+    else:
+        lines = output.strip().splitlines()
+        states = lines[:2] + ["unknown"] * (2 - len(lines[:2]))
+        result.update({
+            "node_exporter_running": states[0].strip() == "active",
+            "iperf3_running": states[1].strip() == "active",
+            "ports_listening": len(lines) > 2 and lines[-1].strip().isdigit() and int(lines[-1]) > 0
+        })
+    result["metrics_available"] = probe_metrics(ip, max(deadline - time.monotonic(), 1.0))
+    result["ready"] = result["node_exporter_running"] and result["iperf3_running"] and result["metrics_available"]
+    
+    if result["iperf3_running"]:
+        prometheus_targets.add([ip], ["iperf"])
+    with vm_check_lock:
+        vm_check_cache[ip] = (time.monotonic() + VM_CHECK_CACHE_TTL, result)
+    return result
+
+
+def cached_vm_check(ip: str) -> Optional[dict]:
+    with vm_check_lock:
+        entry = vm_check_cache.get(ip)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        vm_check_cache.pop(ip, None)
+    return None
+
+
+async def check_vms(ips: List[str], use_cache: bool = True, timeout: float = VM_CHECK_TIMEOUT) -> List[dict]:
+    """Check many VMs concurrently, bounded by the check executor, with a per-host deadline"""
+    loop = asyncio.get_running_loop()
+    
+    async def check_one(ip: str) -> dict:
+        cached = cached_vm_check(ip) if use_cache else None
+        if cached:
+            return {**cached, "cached": True}
+        try:
+            # The deadline covers connect, the remote command and the metrics probe
+            result = await asyncio.wait_for(
+                loop.run_in_executor(vm_check_executor, check_vm_readiness, ip, timeout),
+                timeout=timeout * 2
+            )
+        except asyncio.TimeoutError:
+            result = {"ip": ip, "checked_at": time.time(), "error": "Check timed out",
+                      "node_exporter_running": False, "iperf3_running": False,
+                      "ports_listening": False, "metrics_available": False, "ready": False}
+        return {**result, "cached": False}
+    
+    return await asyncio.gather(*(check_one(ip) for ip in ips))
+
+
+class VMCheckBatchRequest(BaseModel):
+    ips: List[str] = []
+    subnet: Optional[str] = None     # "a.b.c" - checks every node currently up in it
+    refresh: bool = False
+    timeout: float = VM_CHECK_TIMEOUT
+
+    @validator('ips', each_item=True)
+    def validate_ip(cls, v):
+        ipaddress.IPv4Address(v)
+        return v
+
+    @validator('subnet', always=True)
+    def validate_subnet(cls, v, values):
+        if v is not None and not re.fullmatch(r"\d{1,3}\.\d{1,3}\.\d{1,3}", v):
+            raise ValueError("subnet must look like 192.168.1")
+        if v is None and not values.get('ips'):
+            raise ValueError("Provide ips or subnet")
+        return v
+
+    @validator('timeout')
+    def validate_timeout(cls, v):
+        if not 0 < v <= 60:
+            raise ValueError("timeout must be 0-60 seconds")
+        return v
+
+
 @app.post("/api/traffic/vm/check")
 async def check_vm_monitoring(request: dict):
     """Check if VM has monitoring tools installed"""
     ip = request.get("ip")
     try:
-        output, error = ssh_manager.execute_command(ip, "systemctl is-active node_exporter")
-        node_exporter_running = output and output.strip() == "active"
-        
-        output, error = ssh_manager.execute_command(ip, "systemctl is-active iperf3-server")
-        iperf3_running = output and output.strip() == "active"
-        
-        output, error = ssh_manager.execute_command(ip, "ss -tulpn | grep -E '(9100|5201)'")
-        ports_listening = bool(output)
-        
-        try:
-            import requests
-            metrics_response = requests.get(f"http://{ip}:9100/metrics", timeout=5)
-            metrics_available = metrics_response.status_code == 200
-            metrics_count = len(metrics_response.text.split('\n')) if metrics_available else 0
-        except:
-            metrics_available = False
-            metrics_count = 0
-        
-        return {
-            "ip": ip,
-            "node_exporter_running": node_exporter_running,
-            "iperf3_running": iperf3_running,
-            "ports_listening": ports_listening,
-            "metrics_available": metrics_available,
-            "metrics_count": metrics_count,
-            "ready": node_exporter_running and iperf3_running and metrics_available
-        }
-        
+        results = await check_vms([ip], use_cache=False)
+        return results[0]
     except Exception as e:
         return {
             "ip": ip,
@@ -1187,3 +5420,43 @@ async def check_vm_monitoring(request: dict):
             "ready": False
         }
 
+
+@app.post("/api/traffic/vm/check/batch")
+async def check_vm_monitoring_batch(request: VMCheckBatchRequest):
+    """Check readiness of many VMs at once, by IP list and/or subnet"""
+    ips = list(dict.fromkeys(request.ips))
+    if request.subnet:
+        def load_up_nodes():
+            conn = get_db_connection()
+            if not conn:
+                raise HTTPException(status_code=500, detail="Database connection failed")
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT ip_address FROM nodes WHERE status = 'up' AND ip_num BETWEEN %s AND %s ORDER BY ip_num",
+                    subnet_bounds(request.subnet)
+                )
+                rows = cursor.fetchall()
+                cursor.close()
+                return [row[0] for row in rows]
+            finally:
+                conn.close()
+        
+        for ip in await run_db(load_up_nodes):
+            if ip not in ips:
+                ips.append(ip)
+    
+    if len(ips) > VM_CHECK_MAX_HOSTS:
+        raise HTTPException(status_code=400, detail=f"Too many hosts ({len(ips)} > {VM_CHECK_MAX_HOSTS})")
+    
+    started = time.time()
+    results = await check_vms(ips, use_cache=not request.refresh, timeout=request.timeout)
+    ready = sum(1 for result in results if result["ready"])
+    return {
+        "total": len(results),
+        "ready": ready,
+        "not_ready": len(results) - ready,
+        "cached": sum(1 for result in results if result["cached"]),
+        "check_time": round(time.time() - started, 2),
+        "results": results
+    }
@@ -0,0 +1,68 @@
+"""SubnetGridCache keeps reservations across scans (no MySQL needed)"""
+import ipaddress
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, tables):
+        self.tables = tables
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        self.rows = self.tables["ip_reservations" if "ip_reservations" in sql else "nodes"]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self.tables)
+
+    def close(self):
+        pass
+
+
+def scan_result(ip, status):
+    return main.IPStatus(ip=ip, status=status, last_scanned="2026-01-01T00:00:00",
+                         last_seen="2026-01-01T00:00:00" if status == "up" else None)
+
+
+def test_scan_keeps_reservation_only_address_reserved(monkeypatch):
+    # 10.0.0.5 is held only through an active ip_reservations row
+    tables = {"nodes": [(5, "down", 0, None)], "ip_reservations": [(int(ipaddress.IPv4Address("10.0.0.5")),)]}
+    monkeypatch.setattr(main, "get_db_connection", lambda: FakeConnection(tables))
+    cache = main.SubnetGridCache()
+
+    assert cache.get("10.0.0").is_reserved(5)
+
+    cache.apply_results([scan_result("10.0.0.5", "up"), scan_result("10.0.0.6", "up")])
+    grid = cache.get("10.0.0")
+    assert grid.is_reserved(5)
+    assert grid.status[5] == main.GRID_STATUS_CODES["up"]
+    assert not grid.is_reserved(6)
+
+    # A release is authoritative and does clear the bit
+    cache.patch("10.0.0.5", is_reserved=False)
+    assert not cache.get("10.0.0").is_reserved(5)
+
+
+def test_scan_reports_reservation_from_nodes():
+    cache = main.SubnetGridCache()
+    cache.grids["10.0.1"] = main.SubnetGrid()
+
+    result = scan_result("10.0.1.7", "reserved")
+    result.is_reserved = True
+    cache.apply_results([result])
+    assert cache.get("10.0.1").is_reserved(7)
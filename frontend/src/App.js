@@ -16,6 +16,7 @@ function App() {
     reverse: false
   });
   const [activeTests, setActiveTests] = useState([]);
+  const [liveIntervals, setLiveIntervals] = useState({});
   const [testResults, setTestResults] = useState(null);
   const [showResults, setShowResults] = useState(false);
 
@@ -112,12 +113,8 @@ function App() {
     setResults([]);
     setScanProgress(0);
     
-    const progressInterval = setInterval(() => {
-      setScanProgress(prev => Math.min(prev + 10, 90));
-    }, 200);
-    
     try {
-      const response = await fetch('http://localhost:8000/api/scan', {
+      const response = await fetch('http://localhost:8000/api/scan/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -129,14 +126,48 @@ function App() {
         })
       });
       
-      const data = await response.json();
-      setResults(data.results);
+      // Read Server-Sent Events so the grid fills in as each shard lands
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let finished = false;
+      
+      while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        const batch = [];
+        
+        for (const raw of events) {
+          const eventLine = raw.split('\n').find(line => line.startsWith('event: '));
+          const dataLine = raw.split('\n').find(line => line.startsWith('data: '));
+          if (!eventLine || !dataLine) continue;
+          const event = eventLine.slice(7);
+          const data = JSON.parse(dataLine.slice(6));
+          
+          if (event === 'result') {
+            batch.push(data);
+          } else if (event === 'progress') {
+            setScanProgress(Math.min(data.progress, 99));
+          } else if (event === 'summary') {
+            finished = true;
+          } else if (event === 'error') {
+            throw new Error(data.error || `Scan ${data.status}`);
+          }
+        }
+        
+        if (batch.length) {
+          setResults(prev => prev.concat(batch));
+        }
+      }
+      
       setScanProgress(100);
-      clearInterval(progressInterval);
     } catch (error) {
       console.error('Scan failed:', error);
       alert('Scan failed: ' + error.message);
-      clearInterval(progressInterval);
     } finally {
       setTimeout(() => {
         setScanning(false);
@@ -502,8 +533,8 @@ const handleResetStatus = async () => {
         alert(`✓ Traffic test started!\n\nTest ID: ${data.test_id}\nDuration: ${trafficConfig.duration}s\n\nMonitor progress in Grafana:\nhttp://localhost:3001`);
         setShowTrafficModal(false);
 
-        // Poll for results
-        pollTestResults(data.test_id);
+        // Stream live intervals and the final results
+        watchTestResults(data.test_id);
 
         // Refresh active tests
         loadActiveTests();
@@ -515,36 +546,40 @@ const handleResetStatus = async () => {
     }
   };
 
-  const pollTestResults = async (testId) => {
-    const maxAttempts = 120; // Poll for up to 2 minutes after test should complete
-    let attempts = 0;
+  const watchTestResults = (testId) => {
+    // Live per-interval stats arrive over SSE; the final summary closes the stream
+    const source = new EventSource(`http://localhost:8000/api/traffic/stream/${testId}`);
 
-    const pollInterval = setInterval(async () => {
-      attempts++;
+    source.addEventListener('interval', (event) => {
+      const interval = JSON.parse(event.data);
+      setLiveIntervals(prev => ({ ...prev, [testId]: interval }));
+    });
 
+    const finish = async () => {
+      source.close();
+      setLiveIntervals(prev => {
+        const { [testId]: _, ...rest } = prev;
+        return rest;
+      });
       try {
-        const response = await fetch(`http://localhost:8000/api/traffic/status/${testId}`);
-        const data = await response.json();
+        const resultsResponse = await fetch(`http://localhost:8000/api/traffic/results/${testId}`);
+        const resultsData = await resultsResponse.json();
 
-        if (data.status === 'completed' || data.status === 'failed') {
-          clearInterval(pollInterval);
-
-          // Get detailed results
-          const resultsResponse = await fetch(`http://localhost:8000/api/traffic/results/${testId}`);
-          const resultsData = await resultsResponse.json();
-
-          setTestResults(resultsData);
-          setShowResults(true);
-          loadActiveTests();
-        }
-
-        if (attempts >= maxAttempts) {
-          clearInterval(pollInterval);
-        }
+        setTestResults(resultsData);
+        setShowResults(true);
+        loadActiveTests();
       } catch (error) {
-        console.error('Error polling test results:', error);
+        console.error('Error loading test results:', error);
+      }
+    };
+
+    source.addEventListener('summary', finish);
+    source.addEventListener('error', (event) => {
+      // Server-sent 'error' events carry data; bare connection errors do not
+      if (event.data || source.readyState === EventSource.CLOSED) {
+        finish();
       }
-    }, 5000); // Poll every 5 seconds
+    });
   };
 
   const loadActiveTests = async () => {
@@ -568,7 +603,7 @@ const handleResetStatus = async () => {
       const data = await response.json();
 
       if (data.ready) {
-        alert(`✓ VM ${ip} is ready for monitoring!\n\n✓ node_exporter running\n✓ iperf3 server running\n✓ Metrics available (${data.metrics_count} metrics)`);
+        alert(`✓ VM ${ip} is ready for monitoring!\n\n✓ node_exporter running\n✓ iperf3 server running\n✓ Metrics available`);
       } else {
         alert(`⚠ VM ${ip} needs setup\n\nnode_exporter: ${data.node_exporter_running ? '✓' : '✗'}\niperf3: ${data.iperf3_running ? '✓' : '✗'}\nmetrics: ${data.metrics_available ? '✓' : '✗'}\n\nRun prepare-vm.sh on the VM first.`);
       }
@@ -1064,7 +1099,7 @@ const handleResetStatus = async () => {
                       </div>
                       <div className="network-info">
                         <div className="network-name">
-                          {network.subnet}.0/24
+                          {network.cidr || `${network.subnet}.0/24`}
                           {network.is_primary && <span className="primary-badge">Primary</span>}
                         </div>
                         <div className="network-details">
@@ -1528,6 +1563,9 @@ Examples:
               </div>
               <div className="test-details">
                 {test.protocol.toUpperCase()} • {test.status}
+                {liveIntervals[test.test_id] && (
+                  <> • {liveIntervals[test.test_id].bandwidth_mbps} Mbps @ {Math.round(liveIntervals[test.test_id].end)}s</>
+                )}
               </div>
             </div>
           ))}
@@ -3,7 +3,10 @@
 
 CREATE TABLE IF NOT EXISTS nodes (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    ip_address VARCHAR(15) NOT NULL UNIQUE,
+    ip_address VARCHAR(45) NOT NULL UNIQUE,
+    -- Numeric forms for range/CIDR queries: ip_num for IPv4 (NULL for IPv6), ip_bin for either
+    ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED,
+    ip_bin VARBINARY(16) AS (INET6_ATON(ip_address)) STORED,
     subnet VARCHAR(15) NOT NULL,
     last_octet INT NOT NULL,
     status ENUM('up', 'down', 'previously_used', 'reserved') DEFAULT 'down',
@@ -19,6 +22,9 @@ CREATE TABLE IF NOT EXISTS nodes (
     reserved_by VARCHAR(100),
     reserved_at TIMESTAMP NULL,
     INDEX idx_ip (ip_address),
+    UNIQUE INDEX idx_ip_num (ip_num),
+    INDEX idx_ip_bin (ip_bin),
+    INDEX idx_status_ip_num (status, ip_num),
     INDEX idx_subnet (subnet),
     INDEX idx_status (status),
     INDEX idx_last_seen (last_seen)
@@ -40,6 +46,7 @@ CREATE TABLE IF NOT EXISTS scan_history (
 CREATE TABLE IF NOT EXISTS ip_reservations (
     id INT AUTO_INCREMENT PRIMARY KEY,
     ip_address VARCHAR(15) NOT NULL,
+    ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED,
     reserved_for VARCHAR(255) NOT NULL,
     description TEXT,
     reserved_by VARCHAR(100),
@@ -47,21 +54,84 @@ CREATE TABLE IF NOT EXISTS ip_reservations (
     expires_at TIMESTAMP NULL,
     is_active BOOLEAN DEFAULT TRUE,
     INDEX idx_ip (ip_address),
+    INDEX idx_ip_num_active (ip_num, is_active),
     INDEX idx_active (is_active)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- One row per state transition (up/down or hostname/MAC/vendor change);
+-- repeat observations of the same state only bump observations/last_recorded_at.
+-- Partitioned by month so retention drops whole partitions. MySQL doesn't allow
+-- foreign keys on partitioned tables, so rows are deleted explicitly with their node.
 CREATE TABLE IF NOT EXISTS node_history (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+    id INT AUTO_INCREMENT,
     node_id INT NOT NULL,
     ip_address VARCHAR(15) NOT NULL,
+    ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED,
     status ENUM('up', 'down') NOT NULL,
     hostname VARCHAR(255),
     mac_address VARCHAR(17),
     vendor VARCHAR(255),
-    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (node_id) REFERENCES nodes(id) ON DELETE CASCADE,
+    recorded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_recorded_at TIMESTAMP NULL,
+    observations INT NOT NULL DEFAULT 1,
+    PRIMARY KEY (id, recorded_at),
     INDEX idx_node (node_id),
+    INDEX idx_ip_recorded (ip_address, recorded_at),
+    INDEX idx_ip_num_recorded (ip_num, recorded_at),
     INDEX idx_recorded_at (recorded_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (UNIX_TIMESTAMP(recorded_at)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Availability rollups: scans that saw the address vs. scans that found it up
+CREATE TABLE IF NOT EXISTS node_availability_hourly (
+    ip_address VARCHAR(15) NOT NULL,
+    ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED,
+    bucket DATETIME NOT NULL,
+    observations INT NOT NULL DEFAULT 0,
+    up_observations INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (ip_address, bucket),
+    INDEX idx_ip_num_bucket (ip_num, bucket),
+    INDEX idx_bucket (bucket)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS node_availability_daily (
+    ip_address VARCHAR(15) NOT NULL,
+    ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED,
+    bucket DATE NOT NULL,
+    observations INT NOT NULL DEFAULT 0,
+    up_observations INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (ip_address, bucket),
+    INDEX idx_ip_num_bucket (ip_num, bucket),
+    INDEX idx_bucket (bucket)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS traffic_tests (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    test_id CHAR(36) NOT NULL UNIQUE,
+    status ENUM('running', 'completed', 'failed') NOT NULL DEFAULT 'running',
+    source_ip VARCHAR(15) NOT NULL,
+    target_ip VARCHAR(15) NOT NULL,
+    protocol ENUM('tcp', 'udp') NOT NULL DEFAULT 'tcp',
+    duration INT,
+    bandwidth VARCHAR(16),
+    parallel_streams INT,
+    reverse_mode BOOLEAN DEFAULT FALSE,
+    started_at TIMESTAMP(3) NOT NULL,
+    ended_at TIMESTAMP(3) NULL,
+    bandwidth_bps DOUBLE,
+    bytes_transferred BIGINT,
+    retransmits INT,
+    jitter_ms DOUBLE,
+    lost_packets INT,
+    packets INT,
+    lost_percent DOUBLE,
+    error TEXT,
+    raw_results MEDIUMBLOB,  -- zlib-compressed iperf3 JSON
+    INDEX idx_source_started (source_ip, started_at),
+    INDEX idx_target_started (target_ip, started_at),
+    INDEX idx_started_at (started_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Insert some example data for testing
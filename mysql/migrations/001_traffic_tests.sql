@@ -0,0 +1,30 @@
+-- Persist traffic tests (iperf3 runs) instead of keeping them in backend memory.
+-- init.sql only runs on a fresh data volume; apply this to existing databases:
+--   docker exec -i ipam-mysql mysql -u root -p ipmanager < mysql/migrations/001_traffic_tests.sql
+
+CREATE TABLE IF NOT EXISTS traffic_tests (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    test_id CHAR(36) NOT NULL UNIQUE,
+    status ENUM('running', 'completed', 'failed') NOT NULL DEFAULT 'running',
+    source_ip VARCHAR(15) NOT NULL,
+    target_ip VARCHAR(15) NOT NULL,
+    protocol ENUM('tcp', 'udp') NOT NULL DEFAULT 'tcp',
+    duration INT,
+    bandwidth VARCHAR(16),
+    parallel_streams INT,
+    reverse_mode BOOLEAN DEFAULT FALSE,
+    started_at TIMESTAMP(3) NOT NULL,
+    ended_at TIMESTAMP(3) NULL,
+    bandwidth_bps DOUBLE,
+    bytes_transferred BIGINT,
+    retransmits INT,
+    jitter_ms DOUBLE,
+    lost_packets INT,
+    packets INT,
+    lost_percent DOUBLE,
+    error TEXT,
+    raw_results MEDIUMBLOB,  -- zlib-compressed iperf3 JSON
+    INDEX idx_source_started (source_ip, started_at),
+    INDEX idx_target_started (target_ip, started_at),
+    INDEX idx_started_at (started_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
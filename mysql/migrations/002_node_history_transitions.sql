@@ -0,0 +1,66 @@
+-- Turn node_history into a transition log with run-length counts, add the
+-- (ip_address, recorded_at) index and monthly partitioning, and create the
+-- availability rollup tables. Apply to databases created before this change:
+--   docker exec -i ipam-mysql mysql -u root -p ipmanager < mysql/migrations/002_node_history_transitions.sql
+
+-- Partitioned tables can't have foreign keys; rows are deleted with their node instead
+ALTER TABLE node_history DROP FOREIGN KEY node_history_ibfk_1;
+
+ALTER TABLE node_history
+    MODIFY recorded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ADD COLUMN last_recorded_at TIMESTAMP NULL,
+    ADD COLUMN observations INT NOT NULL DEFAULT 1,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (id, recorded_at),
+    ADD INDEX idx_ip_recorded (ip_address, recorded_at);
+
+-- Collapse runs of identical consecutive observations into one row each
+CREATE TEMPORARY TABLE node_history_runs AS
+SELECT MIN(id) AS keep_id, COUNT(*) AS observations, MAX(recorded_at) AS last_recorded_at
+FROM (
+    SELECT id, ip_address, recorded_at,
+           SUM(changed) OVER (PARTITION BY ip_address ORDER BY recorded_at, id) AS run
+    FROM (
+        SELECT id, ip_address, recorded_at,
+               CASE WHEN (status, COALESCE(hostname, ''), COALESCE(mac_address, ''), COALESCE(vendor, ''))
+                         = (LAG(status) OVER w, COALESCE(LAG(hostname) OVER w, ''),
+                            COALESCE(LAG(mac_address) OVER w, ''), COALESCE(LAG(vendor) OVER w, ''))
+                    THEN 0 ELSE 1 END AS changed
+        FROM node_history
+        WINDOW w AS (PARTITION BY ip_address ORDER BY recorded_at, id)
+    ) flagged
+) runs
+GROUP BY ip_address, run;
+
+UPDATE node_history h JOIN node_history_runs r ON h.id = r.keep_id
+SET h.observations = r.observations, h.last_recorded_at = r.last_recorded_at;
+
+DELETE h FROM node_history h LEFT JOIN node_history_runs r ON h.id = r.keep_id
+WHERE r.keep_id IS NULL;
+
+DROP TEMPORARY TABLE node_history_runs;
+
+-- The backend splits monthly partitions off pmax and drops expired ones
+ALTER TABLE node_history
+PARTITION BY RANGE (UNIX_TIMESTAMP(recorded_at)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Availability rollups: scans that saw the address vs. scans that found it up
+CREATE TABLE IF NOT EXISTS node_availability_hourly (
+    ip_address VARCHAR(15) NOT NULL,
+    bucket DATETIME NOT NULL,
+    observations INT NOT NULL DEFAULT 0,
+    up_observations INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (ip_address, bucket),
+    INDEX idx_bucket (bucket)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS node_availability_daily (
+    ip_address VARCHAR(15) NOT NULL,
+    bucket DATE NOT NULL,
+    observations INT NOT NULL DEFAULT 0,
+    up_observations INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (ip_address, bucket),
+    INDEX idx_bucket (bucket)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
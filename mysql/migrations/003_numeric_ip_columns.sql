@@ -0,0 +1,27 @@
+-- Add numeric IP columns (generated from ip_address, so writers don't change)
+-- and the composite indexes that turn CIDR/range queries into index range scans.
+--   docker exec -i ipam-mysql mysql -u root -p ipmanager < mysql/migrations/003_numeric_ip_columns.sql
+
+ALTER TABLE nodes
+    MODIFY ip_address VARCHAR(45) NOT NULL,
+    ADD COLUMN ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED AFTER ip_address,
+    ADD COLUMN ip_bin VARBINARY(16) AS (INET6_ATON(ip_address)) STORED AFTER ip_num,
+    ADD UNIQUE INDEX idx_ip_num (ip_num),
+    ADD INDEX idx_ip_bin (ip_bin),
+    ADD INDEX idx_status_ip_num (status, ip_num);
+
+ALTER TABLE ip_reservations
+    ADD COLUMN ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED AFTER ip_address,
+    ADD INDEX idx_ip_num_active (ip_num, is_active);
+
+ALTER TABLE node_history
+    ADD COLUMN ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED AFTER ip_address,
+    ADD INDEX idx_ip_num_recorded (ip_num, recorded_at);
+
+ALTER TABLE node_availability_hourly
+    ADD COLUMN ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED AFTER ip_address,
+    ADD INDEX idx_ip_num_bucket (ip_num, bucket);
+
+ALTER TABLE node_availability_daily
+    ADD COLUMN ip_num INT UNSIGNED AS (INET_ATON(ip_address)) STORED AFTER ip_address,
+    ADD INDEX idx_ip_num_bucket (ip_num, bucket);